@@ -0,0 +1,239 @@
+"""
+Table-driven checksums for every DBC checksum type.
+
+The scalar functions take any bytes-like frame (bytes, bytearray, memoryview) and never modify it,
+so the parser can pass frames without copying. CRCs iterate the frame directly over tuple lookup tables,
+which is faster in CPython than indexed loops or 16-bit slice tables.
+batch_checksum validates many frames of one address at once with NumPy.
+"""
+from collections.abc import Callable
+from functools import reduce
+from operator import xor
+
+import numpy as np
+
+from opendbc.car.crc import CRC8H2F, CRC8J1850, CRC16_XMODEM, _gen_crc8_table
+from opendbc.car.volkswagen.mqbcan import VOLKSWAGEN_MQB_MEB_CONSTANTS
+
+CRC8_BODY = _gen_crc8_table(0xD5)
+
+FCA_GIORGIO_FINAL_XOR = {0xDE: 0x10, 0x106: 0xF6, 0x122: 0xF1}
+HKG_CAN_FD_FINAL_XOR = {8: 0x5F29, 16: 0x041D, 24: 0x819D, 32: 0x9F5B}
+PSA_CHECKSUM_INIT = {0x452: 0x4, 0x38D: 0x7, 0x42D: 0xC}
+
+# sum of the two nibbles of every byte value
+NIBBLE_SUM = bytes((b >> 4) + (b & 0xF) for b in range(256))
+
+
+def _crc8(table: tuple[int, ...], crc: int, d) -> int:
+  for b in d:
+    crc = table[crc ^ b]
+  return crc
+
+
+def _crc16(table: tuple[int, ...], crc: int, d) -> int:
+  for b in d:
+    crc = ((crc << 8) & 0xFFFF) ^ table[(crc >> 8) ^ b]
+  return crc
+
+
+CRC8H2F_T = tuple(CRC8H2F)
+CRC8J1850_T = tuple(CRC8J1850)
+CRC8_BODY_T = tuple(CRC8_BODY)
+CRC16_XMODEM_T = tuple(CRC16_XMODEM)
+
+
+def _addr_byte_sum(address: int) -> int:
+  return sum(address.to_bytes((address.bit_length() + 7) // 8, "little"))
+
+
+def _addr_nibble_sum(address: int) -> int:
+  s = 0
+  while address:
+    s += address & 0xF
+    address >>= 4
+  return s
+
+
+# ***** per-frame checksums *****
+
+def honda_checksum(address: int, sig, d) -> int:
+  s = _addr_nibble_sum(address)
+  if len(d):
+    s += sum(map(NIBBLE_SUM.__getitem__, d[:-1])) + (d[-1] >> 4)
+  s = 8 - s
+  if address > 0x7FF:
+    s += 3
+  return s & 0xF
+
+
+def toyota_checksum(address: int, sig, d) -> int:
+  return (len(d) + _addr_byte_sum(address) + sum(d[:-1])) & 0xFF
+
+
+def subaru_checksum(address: int, sig, d) -> int:
+  return (_addr_byte_sum(address) + sum(d[1:])) & 0xFF
+
+
+def tesla_checksum(address: int, sig, d) -> int:
+  checksum = (address & 0xFF) + ((address >> 8) & 0xFF) + sum(d)
+  checksum_byte = sig.start_bit // 8
+  if checksum_byte < len(d):
+    checksum -= d[checksum_byte]
+  return checksum & 0xFF
+
+
+def xor_checksum(address: int, sig, d) -> int:
+  checksum = reduce(xor, d, 0)
+  checksum_byte = sig.start_bit // 8
+  if checksum_byte < len(d):
+    checksum ^= d[checksum_byte]
+  return checksum
+
+
+def chrysler_checksum(address: int, sig, d) -> int:
+  return _crc8(CRC8J1850_T, 0xFF, d[:-1]) ^ 0xFF
+
+
+def fca_giorgio_checksum(address: int, sig, d) -> int:
+  return _crc8(CRC8J1850_T, 0, d[:-1]) ^ FCA_GIORGIO_FINAL_XOR.get(address, 0x0A)
+
+
+def body_checksum(address: int, sig, d) -> int:
+  return _crc8(CRC8_BODY_T, 0xFF, d[-2::-1])
+
+
+def volkswagen_mqb_meb_checksum(address: int, sig, d) -> int:
+  crc = _crc8(CRC8H2F_T, 0xFF, d[1:])
+  const = VOLKSWAGEN_MQB_MEB_CONSTANTS.get(address)
+  if const:
+    crc = CRC8H2F_T[crc ^ const[d[1] & 0x0F]]
+  return crc ^ 0xFF
+
+
+def hkg_can_fd_checksum(address: int, sig, d) -> int:
+  crc = _crc16(CRC16_XMODEM_T, 0, d[2:])
+  crc = _crc16(CRC16_XMODEM_T, crc, ((address >> 0) & 0xFF, (address >> 8) & 0xFF))
+  return crc ^ HKG_CAN_FD_FINAL_XOR.get(len(d), 0)
+
+
+def psa_checksum(address: int, sig, d) -> int:
+  # the checksum's own nibble is left out of the sum
+  checksum = sum(map(NIBBLE_SUM.__getitem__, d))
+  b = d[sig.start_bit // 8]
+  checksum -= (b >> 4) if sig.start_bit % 8 >= 4 else (b & 0xF)
+  return (PSA_CHECKSUM_INIT.get(address, 0xB) - checksum) & 0xF
+
+
+# ***** batch checksums *****
+
+CRC8H2F_NP = np.array(CRC8H2F, dtype=np.uint8)
+CRC8J1850_NP = np.array(CRC8J1850, dtype=np.uint8)
+CRC8_BODY_NP = np.array(CRC8_BODY, dtype=np.uint8)
+CRC16_XMODEM_NP = np.array(CRC16_XMODEM, dtype=np.uint16)
+NIBBLE_SUM_NP = np.frombuffer(NIBBLE_SUM, dtype=np.uint8)
+
+
+def _crc8_batch(table: np.ndarray, crc: int, cols: np.ndarray) -> np.ndarray:
+  ret = np.full(cols.shape[0], crc, dtype=np.uint8)
+  for i in range(cols.shape[1]):
+    ret = table[ret ^ cols[:, i]]
+  return ret
+
+
+def _without_byte(cols: np.ndarray, idx: int) -> np.ndarray:
+  return np.delete(cols, idx, axis=1) if idx < cols.shape[1] else cols
+
+
+def _nibble_sum_batch(cols: np.ndarray) -> np.ndarray:
+  return NIBBLE_SUM_NP[cols].sum(axis=1, dtype=np.int64)
+
+
+def _honda_batch(address: int, sig, dat: np.ndarray) -> np.ndarray:
+  s = np.full(dat.shape[0], _addr_nibble_sum(address), dtype=np.int64)
+  if dat.shape[1]:
+    s += _nibble_sum_batch(dat[:, :-1]) + (dat[:, -1] >> 4)
+  s = 8 - s
+  if address > 0x7FF:
+    s += 3
+  return s & 0xF
+
+
+def _toyota_batch(address: int, sig, dat: np.ndarray) -> np.ndarray:
+  return (dat.shape[1] + _addr_byte_sum(address) + dat[:, :-1].sum(axis=1, dtype=np.int64)) & 0xFF
+
+
+def _subaru_batch(address: int, sig, dat: np.ndarray) -> np.ndarray:
+  return (_addr_byte_sum(address) + dat[:, 1:].sum(axis=1, dtype=np.int64)) & 0xFF
+
+
+def _tesla_batch(address: int, sig, dat: np.ndarray) -> np.ndarray:
+  s = (address & 0xFF) + ((address >> 8) & 0xFF)
+  return (s + _without_byte(dat, sig.start_bit // 8).sum(axis=1, dtype=np.int64)) & 0xFF
+
+
+def _xor_batch(address: int, sig, dat: np.ndarray) -> np.ndarray:
+  return np.bitwise_xor.reduce(_without_byte(dat, sig.start_bit // 8), axis=1, initial=0).astype(np.int64)
+
+
+def _chrysler_batch(address: int, sig, dat: np.ndarray) -> np.ndarray:
+  return (_crc8_batch(CRC8J1850_NP, 0xFF, dat[:, :-1]) ^ 0xFF).astype(np.int64)
+
+
+def _fca_giorgio_batch(address: int, sig, dat: np.ndarray) -> np.ndarray:
+  return (_crc8_batch(CRC8J1850_NP, 0, dat[:, :-1]) ^ FCA_GIORGIO_FINAL_XOR.get(address, 0x0A)).astype(np.int64)
+
+
+def _body_batch(address: int, sig, dat: np.ndarray) -> np.ndarray:
+  return _crc8_batch(CRC8_BODY_NP, 0xFF, dat[:, -2::-1]).astype(np.int64)
+
+
+def _volkswagen_mqb_meb_batch(address: int, sig, dat: np.ndarray) -> np.ndarray:
+  crc = _crc8_batch(CRC8H2F_NP, 0xFF, dat[:, 1:])
+  const = VOLKSWAGEN_MQB_MEB_CONSTANTS.get(address)
+  if const:
+    crc = CRC8H2F_NP[crc ^ np.array(const, dtype=np.uint8)[dat[:, 1] & 0x0F]]
+  return (crc ^ 0xFF).astype(np.int64)
+
+
+def _hkg_can_fd_batch(address: int, sig, dat: np.ndarray) -> np.ndarray:
+  crc = np.zeros(dat.shape[0], dtype=np.int64)
+  for i in range(2, dat.shape[1]):
+    crc = ((crc << 8) ^ CRC16_XMODEM_NP[(crc >> 8) ^ dat[:, i]]) & 0xFFFF
+  for b in (address & 0xFF, (address >> 8) & 0xFF):
+    crc = ((crc << 8) ^ CRC16_XMODEM_NP[(crc >> 8) ^ b]) & 0xFFFF
+  return crc ^ HKG_CAN_FD_FINAL_XOR.get(dat.shape[1], 0)
+
+
+def _psa_batch(address: int, sig, dat: np.ndarray) -> np.ndarray:
+  b = dat[:, sig.start_bit // 8]
+  checksum = _nibble_sum_batch(dat) - ((b >> 4) if sig.start_bit % 8 >= 4 else (b & 0xF))
+  return (PSA_CHECKSUM_INIT.get(address, 0xB) - checksum) & 0xF
+
+
+BATCH_CHECKSUMS: dict[Callable, Callable[[int, object, np.ndarray], np.ndarray]] = {
+  honda_checksum: _honda_batch,
+  toyota_checksum: _toyota_batch,
+  subaru_checksum: _subaru_batch,
+  tesla_checksum: _tesla_batch,
+  xor_checksum: _xor_batch,
+  chrysler_checksum: _chrysler_batch,
+  fca_giorgio_checksum: _fca_giorgio_batch,
+  body_checksum: _body_batch,
+  volkswagen_mqb_meb_checksum: _volkswagen_mqb_meb_batch,
+  hkg_can_fd_checksum: _hkg_can_fd_batch,
+  psa_checksum: _psa_batch,
+}
+
+
+def batch_checksum(address: int, sig, dat: np.ndarray) -> np.ndarray:
+  """
+  Vectorized equivalent of sig.calc_checksum over many frames of one address.
+  dat is a uint8 [N, length] matrix of frames that all share the same length.
+  """
+  batch_fn = BATCH_CHECKSUMS.get(sig.calc_checksum)
+  if batch_fn is not None:
+    return batch_fn(address, sig, dat)
+
+  # no vectorized version, fall back to the per-frame function
+  return np.array([sig.calc_checksum(address, sig, d.tobytes()) for d in dat], dtype=np.int64)
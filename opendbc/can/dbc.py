@@ -1,20 +1,15 @@
 import re
 import os
-from dataclasses import dataclass
+import hashlib
+import json
+import stat
+import tempfile
+from dataclasses import dataclass, field
 from collections.abc import Callable
 
 from opendbc import DBC_PATH
-
-# TODO: these should just be passed in along with the DBC file
-from opendbc.car.honda.hondacan import honda_checksum
-from opendbc.car.toyota.toyotacan import toyota_checksum
-from opendbc.car.subaru.subarucan import subaru_checksum
-from opendbc.car.chrysler.chryslercan import chrysler_checksum, fca_giorgio_checksum
-from opendbc.car.hyundai.hyundaicanfd import hkg_can_fd_checksum
-from opendbc.car.volkswagen.mqbcan import volkswagen_mqb_meb_checksum, xor_checksum
-from opendbc.car.tesla.teslacan import tesla_checksum
-from opendbc.car.body.bodycan import body_checksum
-from opendbc.car.psa.psacan import psa_checksum
+from opendbc.can.checksums import honda_checksum, toyota_checksum, subaru_checksum, chrysler_checksum, fca_giorgio_checksum, \
+                                  hkg_can_fd_checksum, volkswagen_mqb_meb_checksum, xor_checksum, tesla_checksum, body_checksum, psa_checksum
 
 
 class SignalType:
@@ -33,6 +28,9 @@ class SignalType:
   PSA_CHECKSUM = 12
 
 
+AttributeValue = str | int | float
+
+
 @dataclass
 class Signal:
   name: str
@@ -45,7 +43,8 @@ class Signal:
   offset: float
   is_little_endian: bool
   type: int = SignalType.DEFAULT
-  calc_checksum: 'Callable[[int, Signal, bytearray], int] | None' = None
+  calc_checksum: 'Callable[[int, Signal, bytes | bytearray | memoryview], int] | None' = None
+  comment: str = ""
 
 
 @dataclass
@@ -54,6 +53,29 @@ class Msg:
   address: int
   size: int
   sigs: dict[str, Signal]
+  comment: str = ""
+  attributes: dict[str, AttributeValue] = field(default_factory=dict)
+  # BA_ values of this message's signals, by signal name
+  signal_attributes: dict[str, dict[str, AttributeValue]] = field(default_factory=dict)
+  # GenMsgCycleTime in ms, from BA_ or its BA_DEF_DEF_ default. None when unset or 0
+  cycle_time: int | None = None
+
+
+@dataclass
+class AttributeDef:
+  name: str
+  object_type: str  # "" for the network, else BU_, BO_, SG_ or EV_
+  value_type: str  # INT, HEX, FLOAT, STRING or ENUM, followed by its limits or values
+  default: AttributeValue | None = None
+
+
+@dataclass
+class MuxVal:
+  """SG_MUL_VAL_: signal is present when the switch signal's value is in one of the inclusive ranges"""
+  address: int
+  signal: str
+  switch: str
+  ranges: list[tuple[int, int]]
 
 
 @dataclass
@@ -65,10 +87,21 @@ class Val:
 
 
 BO_RE = re.compile(r"^BO_ (\w+) (\w+) *: (\w+) (\w+)")
-SG_RE = re.compile(r"^SG_ (\w+) : (\d+)\|(\d+)@(\d)([+-]) \(([0-9.+\-eE]+),([0-9.+\-eE]+)\) \[[0-9.+\-eE]+\|[0-9.+\-eE]+\] \".*\" .*")
-SGM_RE = re.compile(r"^SG_ (\w+) (\w+) *: (\d+)\|(\d+)@(\d)([+-]) \(([0-9.+\-eE]+),([0-9.+\-eE]+)\) \[[0-9.+\-eE]+\|[0-9.+\-eE]+\] \".*\" .*")
+# plain and multiplexed signals, the mux indicator is skipped
+SG_RE = re.compile(r"^SG_ (\w+)(?: \w+)? *: (\d+)\|(\d+)@(\d)([+-]) \(([0-9.+\-eE]+),([0-9.+\-eE]+)\) \[[0-9.+\-eE]+\|[0-9.+\-eE]+\] \".*\" .*")
 VAL_RE = re.compile(r"^VAL_ (\w+) (\w+) (.*);")
+# BA_ "name" [BO_ <address> | SG_ <address> <signal>] <value>; the most common statement after SG_
+BA_RE = re.compile(r'^BA_ "(\w+)" (?:(BO_|SG_) (\d+) (?:(\w+) )?)?("[^"]*"|[^\s;"]+);$')
+# CM_ [BO_ <address> | SG_ <address> <signal>] "comment"; on one line, without escaped quotes
+CM_RE = re.compile(r'^CM_ (?:(BO_|SG_) (\d+) (?:(\w+) )?)?"([^"]*)";$')
 VAL_SPLIT_RE = re.compile(r'["]+')
+# quoted strings (with their quotes) or runs of anything else up to whitespace or ;
+TOKEN_RE = re.compile(r'"(?:[^"\\]|\\.)*"|[^\s;]+')
+
+# parsed DBCs are cached here as JSON, keyed by path, mtime and content hash. off unless OPENDBC_CACHE_DIR is set.
+# only files owned by this user and not writable by others are loaded
+DBC_CACHE_DIR = os.environ.get("OPENDBC_CACHE_DIR", "")
+DBC_CACHE_VERSION = 3
 
 
 @dataclass
@@ -78,81 +111,284 @@ class DBC:
   addr_to_msg: dict[int, Msg]
   name_to_msg: dict[str, Msg]
   vals: list[Val]
+  comment: str
+  attribute_defs: dict[str, AttributeDef]
+  attributes: dict[str, AttributeValue]
+  mux_vals: list[MuxVal]
 
   def __init__(self, name: str):
-    dbc_path = name
-    if not os.path.exists(dbc_path):
-      dbc_path = os.path.join(DBC_PATH, name + ".dbc")
+    dbc_path = get_dbc_path(name)
 
-    self._parse(dbc_path)
+    with open(dbc_path, "rb") as f:
+      content = f.read()
+    cache_path = _cache_path(dbc_path)
+    if cache_path is None:
+      self._parse(dbc_path, content.decode())
+      return
 
-  def _parse(self, path: str):
-    self.name = os.path.basename(path).replace(".dbc", "")
-    with open(path) as f:
-      lines = f.readlines()
+    cache_key = (DBC_CACHE_VERSION, _parser_hash(), os.path.abspath(dbc_path), os.stat(dbc_path).st_mtime_ns,
+                 hashlib.blake2b(content).hexdigest())
+    if self._load_cache(cache_path, cache_key):
+      return
+    self._parse(dbc_path, content.decode())
+    self._save_cache(cache_path, cache_key)
+
+  def _load_cache(self, cache_path: str, cache_key: tuple) -> bool:
+    try:
+      if not _is_private(os.path.dirname(cache_path)):
+        return False
+      with open(cache_path, "rb") as f:
+        if not _is_private(f.fileno()):
+          return False
+        key, state = json.load(f)
+      if key != list(cache_key):
+        return False
+      self._from_cache(state)
+    except (OSError, ValueError, TypeError, KeyError, IndexError):
+      return False
+    return True
 
+  def _save_cache(self, cache_path: str, cache_key: tuple) -> None:
+    # write then rename, so concurrent loads never see a partial file
+    try:
+      os.makedirs(os.path.dirname(cache_path), mode=0o700, exist_ok=True)
+      with tempfile.NamedTemporaryFile("w", dir=os.path.dirname(cache_path), delete=False) as f:
+        json.dump([cache_key, self._to_cache()], f, separators=(",", ":"))
+      os.replace(f.name, cache_path)
+    except OSError:
+      pass
+
+  def _to_cache(self) -> dict:
+    # plain data only, the dataclasses and checksum functions are rebuilt on load
+    return {
+      "name": self.name,
+      "comment": self.comment,
+      "attributes": self.attributes,
+      "attribute_defs": [[d.name, d.object_type, d.value_type, d.default] for d in self.attribute_defs.values()],
+      "msgs": [[m.name, m.address, m.size, m.comment, m.attributes, m.signal_attributes, m.cycle_time,
+                [[s.name, s.start_bit, s.msb, s.lsb, s.size, s.is_signed, s.factor, s.offset, s.is_little_endian, s.type, s.comment]
+                 for s in m.sigs.values()]] for m in self.msgs.values()],
+      "vals": [[v.name, v.address, v.def_val] for v in self.vals],
+      "mux_vals": [[v.address, v.signal, v.switch, v.ranges] for v in self.mux_vals],
+    }
+
+  def _from_cache(self, state: dict) -> None:
+    self.name = state["name"]
+    self.comment = state["comment"]
+    self.attributes = state["attributes"]
+    self.attribute_defs = {d[0]: AttributeDef(*d) for d in state["attribute_defs"]}
+    checksum_state = get_checksum_state(self.name)
+    self.msgs = {}
+    for name, address, size, comment, attributes, signal_attributes, cycle_time, sigs in state["msgs"]:
+      signals = {}
+      for sig_name, *fields, comment_ in sigs:
+        sig = signals[sig_name] = Signal(sig_name, *fields, comment=comment_)
+        if checksum_state is not None and sig.type == checksum_state.checksum_type:
+          sig.calc_checksum = checksum_state.calc_checksum
+      self.msgs[address] = Msg(name, address, size, signals, comment, attributes, signal_attributes, cycle_time)
+    self.addr_to_msg = dict(self.msgs)
+    self.name_to_msg = {m.name: m for m in self.msgs.values()}
+    self.vals = [Val(*v) for v in state["vals"]]
+    self.mux_vals = [MuxVal(address, signal, switch, [tuple(r) for r in ranges]) for address, signal, switch, ranges in state["mux_vals"]]
+
+  def _parse(self, path: str, content: str):
+    self.name = os.path.basename(path).replace(".dbc", "")
     checksum_state = get_checksum_state(self.name)
-    be_bits = [j + i * 8 for i in range(64) for j in range(7, -1, -1)]
     self.msgs: dict[int, Msg] = {}
     self.addr_to_msg: dict[int, Msg] = {}
     self.name_to_msg: dict[str, Msg] = {}
     self.vals: list[Val] = []
-    address = 0
-    signals_temp: dict[int, dict[str, Signal]] = {}
-    for line_num, line in enumerate(lines, 1):
+    self.comment = ""
+    self.attribute_defs: dict[str, AttributeDef] = {}
+    self.attributes: dict[str, AttributeValue] = {}
+    self.mux_vals: list[MuxVal] = []
+    sigs: dict[str, Signal] = {}
+    statement = ""
+    for line_num, line in enumerate(content.splitlines(), 1):
       line = line.strip()
-      if line.startswith("BO_ "):
-        m = BO_RE.match(line)
+      if statement:
+        # continuation of a CM_ or BA_ string spanning lines, dropped if it runs into the next definition
+        if not line.startswith(("BO_ ", "SG_ ", "VAL_ ", "CM_ ", "BA_")):
+          line = statement + "\n" + line
+        statement = ""
+
+      # dispatch on the first 4 characters, cheaper than a startswith per statement type
+      kind = line[:4]
+      if kind == "SG_ ":
+        m = SG_RE.match(line)
         if not m:
           continue
-        address = int(m.group(1), 0)
-        msg_name = m.group(2)
-        size = int(m.group(3), 0)
-        sigs = {}
-        self.msgs[address] = Msg(msg_name, address, size, sigs)
-        self.addr_to_msg[address] = self.msgs[address]
-        self.name_to_msg[msg_name] = self.msgs[address]
-        signals_temp[address] = sigs
-      elif line.startswith("SG_ "):
-        m = SG_RE.search(line)
-        offset = 0
-        if not m:
-          m = SGM_RE.search(line)
-          if not m:
-            continue
-          offset = 1
-        sig_name = m.group(1)
-        start_bit = int(m.group(2 + offset))
-        size = int(m.group(3 + offset))
-        is_little_endian = m.group(4 + offset) == "1"
-        is_signed = m.group(5 + offset) == "-"
-        factor = float(m.group(6 + offset))
-        offset_val = float(m.group(7 + offset))
-
+        sig_name, start_bit, size, byte_order, sign, factor, offset = m.groups()
+        start_bit = int(start_bit)
+        size = int(size)
+        is_little_endian = byte_order == "1"
         if is_little_endian:
           lsb = start_bit
           msb = start_bit + size - 1
         else:
-          idx = be_bits.index(start_bit)
-          lsb = be_bits[idx + size - 1]
+          # big endian bits are numbered 7..0 within each byte, 15..8 in the next, and so on
+          idx = (start_bit // 8) * 8 + 7 - start_bit % 8 + size - 1
+          lsb = (idx // 8) * 8 + 7 - idx % 8
           msb = start_bit
 
-        sig = Signal(sig_name, start_bit, msb, lsb, size, is_signed, factor, offset_val, is_little_endian)
-        set_signal_type(sig, checksum_state, self.name, line_num)
-        signals_temp[address][sig_name] = sig
-      elif line.startswith("VAL_ "):
-        m = VAL_RE.search(line)
+        sig = Signal(sig_name, start_bit, msb, lsb, size, sign == "-", float(factor), float(offset), is_little_endian)
+        if checksum_state is not None:
+          set_signal_type(sig, checksum_state, self.name, line_num)
+        sigs[sig_name] = sig
+      elif kind == "BA_ " and (m := BA_RE.match(line)):
+        self._set_attribute(*m.groups())
+      elif kind == "CM_ " and (m := CM_RE.match(line)):
+        self._set_comment(*m.groups())
+      elif kind == "BO_ ":
+        m = BO_RE.match(line)
         if not m:
           continue
-        val_addr = int(m.group(1), 0)
-        sgname = m.group(2)
-        defs = m.group(3)
-        words = [w.strip() for w in VAL_SPLIT_RE.split(defs) if w.strip()]
-        words = [w.upper().replace(" ", "_") for w in words]
-        val_def = " ".join(words).strip()
-        self.vals.append(Val(sgname, val_addr, val_def))
-    for addr, sigs in signals_temp.items():
-      self.msgs[addr].sigs = sigs
+        address = int(m.group(1), 0)
+        msg_name = m.group(2)
+        sigs = {}
+        self.msgs[address] = self.addr_to_msg[address] = self.name_to_msg[msg_name] = Msg(msg_name, address, int(m.group(3), 0), sigs)
+      elif kind == "VAL_" and line.startswith("VAL_ "):
+        m = VAL_RE.match(line)
+        if not m:
+          continue
+        val_def = " ".join([w.replace(" ", "_") for w in map(str.strip, VAL_SPLIT_RE.split(m.group(3).upper())) if w])
+        self.vals.append(Val(m.group(2), int(m.group(1), 0), val_def))
+      elif line.startswith(("CM_ ", "BA_ ", "BA_DEF_ ", "BA_DEF_DEF_ ", "SG_MUL_VAL_ ")):
+        if line.count('"') % 2:
+          statement = line
+          continue
+        self._parse_statement(TOKEN_RE.findall(line))
+
+    for msg in self.msgs.values():
+      cycle_time = msg.attributes.get("GenMsgCycleTime", self.attribute_defs.get("GenMsgCycleTime", AttributeDef("", "", "")).default)
+      if isinstance(cycle_time, int | float) and cycle_time > 0:
+        msg.cycle_time = int(cycle_time)
+
+  def _set_comment(self, object_type: str | None, address: str | None, signal: str | None, comment: str) -> None:
+    if object_type is None:
+      self.comment = comment
+      return
+    msg = self.msgs.get(int(address, 0))
+    if msg is None:
+      return
+    if object_type == "BO_" and signal is None:
+      msg.comment = comment
+    elif object_type == "SG_" and signal in msg.sigs:
+      msg.sigs[signal].comment = comment
+
+  def _set_attribute(self, name: str, object_type: str | None, address: str | None, signal: str | None, token: str) -> None:
+    try:
+      value = _attribute_value(token)
+    except ValueError:
+      return
+    if object_type is None:
+      self.attributes[name] = value
+      return
+    msg = self.msgs.get(int(address, 0))
+    if msg is None:
+      return
+    if object_type == "BO_" and signal is None:
+      msg.attributes[name] = value
+    elif object_type == "SG_" and signal in msg.sigs:
+      sig_attributes = msg.signal_attributes.get(signal)
+      if sig_attributes is None:
+        sig_attributes = msg.signal_attributes[signal] = {}
+      sig_attributes[name] = value
+
+  def _parse_statement(self, tokens: list[str]) -> None:
+    """CM_, BA_DEF_, BA_DEF_DEF_, BA_ and SG_MUL_VAL_. Anything malformed or referring to unknown messages is skipped"""
+    if not tokens:
+      return
+    keyword = tokens[0]
+    try:
+      if keyword == "CM_":
+        if len(tokens) == 2:
+          self._set_comment(None, None, None, _unquote(tokens[1]))
+        elif tokens[1] == "BO_" and len(tokens) == 4:
+          self._set_comment("BO_", tokens[2], None, _unquote(tokens[3]))
+        elif tokens[1] == "SG_" and len(tokens) == 5:
+          self._set_comment("SG_", tokens[2], tokens[3], _unquote(tokens[4]))
+      elif keyword == "BA_DEF_":
+        object_type = tokens[1] if not tokens[1].startswith('"') else ""
+        tokens = tokens[2:] if object_type else tokens[1:]
+        name = _unquote(tokens[0])
+        self.attribute_defs[name] = AttributeDef(name, object_type, " ".join(tokens[1:]))
+      elif keyword == "BA_DEF_DEF_":
+        attr_def = self.attribute_defs.get(_unquote(tokens[1]))
+        if attr_def is not None:
+          attr_def.default = _attribute_value(tokens[2])
+      elif keyword == "BA_":
+        if len(tokens) == 3:
+          self._set_attribute(_unquote(tokens[1]), None, None, None, tokens[2])
+        elif tokens[2] in ("BO_", "SG_") and len(tokens) in (5, 6):
+          self._set_attribute(_unquote(tokens[1]), tokens[2], tokens[3], tokens[4] if len(tokens) == 6 else None, tokens[-1])
+      elif keyword == "SG_MUL_VAL_" and len(tokens) >= 5:
+        ranges = []
+        for r in " ".join(tokens[4:]).split(","):
+          lo, _, hi = r.strip().partition("-")
+          ranges.append((int(lo), int(hi)))
+        self.mux_vals.append(MuxVal(int(tokens[1], 0), tokens[2], tokens[3], ranges))
+    except (KeyError, IndexError, ValueError):
+      pass
+
+
+def _unquote(token: str) -> str:
+  return token[1:-1] if len(token) >= 2 and token[0] == token[-1] == '"' else token
+
+
+def _attribute_value(token: str) -> AttributeValue:
+  if token[:1] == '"':
+    return _unquote(token)
+  try:
+    return int(token)
+  except ValueError:
+    return float(token)
+
+
+def get_dbc_path(name: str) -> str:
+  if os.path.exists(name):
+    return name
+  return os.path.join(DBC_PATH, name + ".dbc")
+
+
+def _cache_path(dbc_path: str) -> str | None:
+  if not DBC_CACHE_DIR:
+    return None
+  path_hash = hashlib.blake2b(os.path.abspath(dbc_path).encode(), digest_size=8).hexdigest()
+  return os.path.join(DBC_CACHE_DIR, f"{os.path.basename(dbc_path)}.{path_hash}.json")
+
+
+def _is_private(path: str | int) -> bool:
+  # owned by this user and only writable by it, so nobody else can plant a cache
+  st = os.stat(path)
+  return (not hasattr(os, "getuid") or st.st_uid == os.getuid()) and not (st.st_mode & (stat.S_IWGRP | stat.S_IWOTH))
+
+
+_PARSER_HASH: str | None = None
+
+
+def _parser_hash() -> str:
+  # changes to the parser or checksum setup invalidate the cache
+  global _PARSER_HASH
+  if _PARSER_HASH is None:
+    with open(__file__, "rb") as f:
+      _PARSER_HASH = hashlib.blake2b(f.read()).hexdigest()
+  return _PARSER_HASH
+
+
+_DBC_REGISTRY: dict[str, DBC] = {}
+
+
+def get_dbc(name: str) -> DBC:
+  """
+  Returns the DBC shared by every parser, packer and define in this process.
+  It must not be modified.
+  """
+  key = os.path.abspath(get_dbc_path(name))
+  dbc = _DBC_REGISTRY.get(key)
+  if dbc is None:
+    dbc = _DBC_REGISTRY[key] = DBC(name)
+  return dbc
 
 
 # ***** checksum functions *****
@@ -173,7 +409,7 @@ class ChecksumState:
   counter_start_bit: int
   little_endian: bool
   checksum_type: int
-  calc_checksum: Callable[[int, Signal, bytearray], int] | None
+  calc_checksum: Callable[[int, Signal, bytes | bytearray | memoryview], int] | None
   setup_signal: Callable[[Signal, str, int], None] | None = None
 
 
@@ -1,44 +1,161 @@
 import math
+from collections.abc import Sequence
+from dataclasses import dataclass, field
+from typing import Literal
 
 from opendbc.car.carlog import carlog
-from opendbc.can.dbc import DBC, Signal, SignalType
+from opendbc.can.dbc import Msg, Signal, SignalType, get_dbc
+
+# (value_shift, mask, payload_shift, clear): bits value_shift.. of the value go to bits payload_shift.. of the payload
+Chunk = tuple[int, int, int, int]
+# (name, chunks, mask, factor, offset, is_counter)
+SignalPackPlan = tuple[str, tuple[Chunk, ...], int, float, float, bool]
+
+
+def _is_counter(sig: Signal) -> bool:
+  return sig.type == SignalType.COUNTER or sig.name == "COUNTER"
+
+
+def _signal_chunks(sig: Signal, size: int, little_endian: bool) -> list[Chunk]:
+  """
+  Split sig into the contiguous runs of bits it occupies in a size byte payload read as one
+  little or big endian integer. Walks the same bytes as set_value, so bits outside the frame are dropped.
+  """
+  chunks: list[list[int]] = []
+  full = (1 << (8 * size)) - 1
+  i = sig.lsb // 8
+  bits = sig.size
+  value_shift = 0
+  while 0 <= i < size and bits > 0:
+    shift = sig.lsb % 8 if (sig.lsb // 8) == i else 0
+    n = min(bits, 8 - shift)
+    payload_shift = (i * 8 if little_endian else (size - 1 - i) * 8) + shift
+    if chunks and chunks[-1][0] + chunks[-1][1] == value_shift and chunks[-1][2] + chunks[-1][1] == payload_shift:
+      chunks[-1][1] += n
+    else:
+      chunks.append([value_shift, n, payload_shift])
+    bits -= n
+    value_shift += n
+    i = i + 1 if sig.is_little_endian else i - 1
+  return [(vs, (1 << n) - 1, ps, full ^ (((1 << n) - 1) << ps)) for vs, n, ps in chunks]
+
+
+class PackPlan:
+  """
+  Everything CANPacker.pack needs for one message, computed once: the counter and checksum signals,
+  and per signal the shifts and masks that place it into the payload, read as a single integer.
+  The integer uses the byte order that keeps most signals in one contiguous chunk.
+  """
+  def __init__(self, msg: Msg):
+    self.msg = msg
+    self.address = msg.address
+    self.size = msg.size
+    self.counter = next((s for s in msg.sigs.values() if _is_counter(s)), None)
+    self.checksum = next((s for s in msg.sigs.values() if s.type > SignalType.COUNTER), None)
+
+    le_chunks = {name: _signal_chunks(sig, self.size, True) for name, sig in msg.sigs.items()}
+    be_chunks = {name: _signal_chunks(sig, self.size, False) for name, sig in msg.sigs.items()}
+    self.little_endian = sum(map(len, le_chunks.values())) <= sum(map(len, be_chunks.values()))
+    chunks = le_chunks if self.little_endian else be_chunks
+    self.byteorder: Literal["little", "big"] = "little" if self.little_endian else "big"
+
+    self.signals: dict[str, SignalPackPlan] = {}
+    for name, sig in msg.sigs.items():
+      self.signals[name] = (name, tuple(chunks[name]), (1 << sig.size) - 1, sig.factor, sig.offset, _is_counter(sig))
+
+
+@dataclass(frozen=True)
+class PackTemplate:
+  """A fixed signal order for CANPacker.pack_template, see CANPacker.get_template"""
+  address: int
+  signals: tuple[SignalPackPlan, ...]
+  # the message the signals were compiled for, only packers of the same DBC can pack the template
+  msg: Msg = field(compare=False, repr=False)
 
 
 class CANPacker:
   def __init__(self, dbc_name: str):
-    self.dbc = DBC(dbc_name)
+    self.dbc = get_dbc(dbc_name)
     self.counters: dict[int, int] = {}
+    self.plans: dict[int, PackPlan] = {}
 
-  def pack(self, address: int, values: dict[str, float]) -> bytearray:
-    msg = self.dbc.addr_to_msg.get(address)
+  def get_plan(self, address: int) -> PackPlan | None:
+    plan = self.plans.get(address)
+    if plan is None:
+      msg = self.dbc.addr_to_msg.get(address)
+      if msg is None:
+        return None
+      plan = self.plans[address] = PackPlan(msg)
+    return plan
+
+  def get_template(self, name_or_addr: str | int, signal_names: Sequence[str]) -> PackTemplate:
+    """
+    Compile a fixed signal order for a message. pack_template then takes the values
+    as a tuple in this order, skipping the per-call signal name lookups.
+    """
+    msg = self.dbc.addr_to_msg.get(name_or_addr) if isinstance(name_or_addr, int) else self.dbc.name_to_msg.get(name_or_addr)
     if msg is None:
+      raise KeyError(f"msg not found for {name_or_addr=}")
+    plan = self.get_plan(msg.address)
+    assert plan is not None
+    return PackTemplate(msg.address, tuple(plan.signals[name] for name in signal_names), msg)
+
+  def pack(self, address: int, values: dict[str, float]) -> bytearray:
+    plan = self.get_plan(address)
+    if plan is None:
       carlog.error(f"msg not found for {address=}")
       return bytearray()
-    dat = bytearray(msg.size)
+
+    address = plan.address
+    signals = plan.signals
+    dat = 0
     counter_set = False
     for name, value in values.items():
-      sig = msg.sigs.get(name)
-      if sig is None:
-        carlog.error(f"unknown signal {name=} in {msg.name}")
+      sig_plan = signals.get(name)
+      if sig_plan is None:
+        carlog.error(f"unknown signal {name=} in {plan.msg.name}")
         continue
-      ival = int(math.floor((value - sig.offset) / sig.factor + 0.5))
-      if ival < 0:
-        ival = (1 << sig.size) + ival
-      set_value(dat, sig, ival)
-      if sig.type == SignalType.COUNTER or sig.name == "COUNTER":
+      _, chunks, mask, factor, offset, is_counter = sig_plan
+      ival = int(math.floor((value - offset) / factor + 0.5)) & mask
+      for value_shift, chunk_mask, payload_shift, clear in chunks:
+        dat = (dat & clear) | (((ival >> value_shift) & chunk_mask) << payload_shift)
+      if is_counter:
         self.counters[address] = int(value)
         counter_set = True
-    sig_counter = next((s for s in msg.sigs.values() if s.type == SignalType.COUNTER or s.name == "COUNTER"), None)
-    if sig_counter and not counter_set:
+    return self._finish(plan, dat, counter_set)
+
+  def pack_template(self, template: PackTemplate, values: Sequence[float]) -> bytearray:
+    plan = self.get_plan(template.address)
+    if plan is None or plan.msg is not template.msg:
+      raise ValueError(f"template of {template.msg.name} is not from a packer of {self.dbc.name}")
+    dat = 0
+    counter_set = False
+    for (_, chunks, mask, factor, offset, is_counter), value in zip(template.signals, values, strict=True):
+      ival = int(math.floor((value - offset) / factor + 0.5)) & mask
+      for value_shift, chunk_mask, payload_shift, clear in chunks:
+        dat = (dat & clear) | (((ival >> value_shift) & chunk_mask) << payload_shift)
+      if is_counter:
+        self.counters[template.address] = int(value)
+        counter_set = True
+    return self._finish(plan, dat, counter_set)
+
+  def _finish(self, plan: PackPlan, dat: int, counter_set: bool) -> bytearray:
+    address = plan.address
+    sig_counter = plan.counter
+    if sig_counter is not None and not counter_set:
       if address not in self.counters:
         self.counters[address] = 0
-      set_value(dat, sig_counter, self.counters[address])
+      _, chunks, mask, _, _, _ = plan.signals[sig_counter.name]
+      ival = self.counters[address] & mask
+      for value_shift, chunk_mask, payload_shift, clear in chunks:
+        dat = (dat & clear) | (((ival >> value_shift) & chunk_mask) << payload_shift)
       self.counters[address] = (self.counters[address] + 1) % (1 << sig_counter.size)
-    sig_checksum = next((s for s in msg.sigs.values() if s.type > SignalType.COUNTER), None)
+
+    ret = bytearray(dat.to_bytes(plan.size, plan.byteorder))
+    sig_checksum = plan.checksum
     if sig_checksum and sig_checksum.calc_checksum:
-      checksum = sig_checksum.calc_checksum(address, sig_checksum, dat)
-      set_value(dat, sig_checksum, checksum)
-    return dat
+      set_value(ret, sig_checksum, sig_checksum.calc_checksum(address, sig_checksum, ret))
+    return ret
 
   def make_can_msg(self, name_or_addr, bus: int, values: dict[str, float]):
     if isinstance(name_or_addr, int):
@@ -54,6 +171,9 @@ class CANPacker:
       return 0, b'', bus
     return addr, bytes(dat), bus
 
+  def make_can_msg_template(self, template: PackTemplate, bus: int, values: Sequence[float]):
+    return template.address, bytes(self.pack_template(template, values)), bus
+
 
 def set_value(msg: bytearray, sig: Signal, ival: int) -> None:
   i = sig.lsb // 8
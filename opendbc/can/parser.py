@@ -1,14 +1,25 @@
 import math
 import numbers
+import struct
 from collections import defaultdict, deque
+from collections.abc import Callable, Iterable, Mapping, Sequence
 from dataclasses import dataclass, field
+from operator import itemgetter
+from typing import Any
+
+import numpy as np
 
 from opendbc.car.carlog import carlog
-from opendbc.can.dbc import DBC, Signal
+from opendbc.can.checksums import batch_checksum
+from opendbc.can.dbc import DBC, Signal, get_dbc
+from opendbc.safety import DLC_TO_LEN
 
 
 MAX_BAD_COUNTER = 5
 CAN_INVALID_CNT = 5
+CANPACKET_HEAD_SIZE = 6
+# byte 0: fd, bus and dlc, bytes 1-4: rejected, returned, extended and the address << 3
+CANPACKET_HEADER = struct.Struct("<BI")
 
 
 def get_raw_value(dat: bytes | bytearray, sig: Signal) -> int:
@@ -26,6 +37,168 @@ def get_raw_value(dat: bytes | bytearray, sig: Signal) -> int:
   return ret
 
 
+# (little_endian, shift, mask, sign_bit)
+SignalPlan = tuple[bool, int, int, int]
+
+
+def compile_signal(sig: Signal, length: int) -> SignalPlan | None:
+  """
+  Precompute how to extract sig from a frame of length bytes with one shift and mask
+  over the whole payload, read as a single little or big endian integer.
+  Returns None if the signal runs off the end of the frame, these are decoded with get_raw_value.
+  """
+  sign_bit = (1 << (sig.size - 1)) if sig.is_signed else 0
+  if sig.msb // 8 >= length:
+    # get_raw_value never reads past the end of the frame, so the signal decodes to zero
+    return (True, 0, 0, 0)
+
+  if sig.is_little_endian:
+    shift = sig.lsb
+  else:
+    shift = (length - 1 - sig.lsb // 8) * 8 + sig.lsb % 8
+    if shift < 0:
+      return None
+  return (sig.is_little_endian, shift, (1 << sig.size) - 1, sign_bit)
+
+
+def compile_decode_plan(signals: list[Signal], length: int) -> list[SignalPlan | None]:
+  return [compile_signal(sig, length) for sig in signals]
+
+
+def decode_raw_values(signals: list[Signal], plan: list[SignalPlan | None], dat: bytes | bytearray, idxs: list[int] = None) -> list[int]:
+  """Decode the signals at idxs, or all of them. Signals that aren't decoded are left as zero"""
+  le = int.from_bytes(dat, "little")
+  be = int.from_bytes(dat, "big")
+  ret = [0] * len(plan)
+  for i in (range(len(plan)) if idxs is None else idxs):
+    sp = plan[i]
+    if sp is None:
+      tmp = get_raw_value(dat, signals[i])
+      if signals[i].is_signed:
+        tmp -= ((tmp >> (signals[i].size - 1)) & 0x1) * (1 << signals[i].size)
+    else:
+      little_endian, shift, mask, sign_bit = sp
+      tmp = ((le if little_endian else be) >> shift) & mask
+      if tmp & sign_bit:
+        tmp -= sign_bit << 1
+    ret[i] = tmp
+  return ret
+
+
+# one CAN frame per row, dat is zero-padded past size
+CAN_FRAME_DTYPE = np.dtype([
+  ("nanos", np.uint64),
+  ("address", np.uint32),
+  ("bus", np.uint8),
+  ("size", np.uint8),
+  ("dat", np.uint8, (64, )),
+])
+
+
+def frames_to_array(strings) -> np.ndarray:
+  """Convert CANParser.update's list[tuple[nanos, list[(address, dat, src)]]] to a CAN_FRAME_DTYPE array"""
+  if strings and not isinstance(strings[0], list | tuple):
+    strings = [strings]
+  frames = [(t, address, src, dat) for t, msgs in strings for address, dat, src in msgs]
+  ret = np.zeros(len(frames), dtype=CAN_FRAME_DTYPE)
+  for i, (t, address, src, dat) in enumerate(frames):
+    ret[i]["nanos"] = t
+    ret[i]["address"] = address
+    ret[i]["bus"] = src
+    ret[i]["size"] = min(len(dat), 255)
+    ret[i]["dat"][:min(len(dat), 64)] = np.frombuffer(dat[:64], dtype=np.uint8)
+  return ret
+
+
+def batch_raw_values(dat: np.ndarray, sizes: np.ndarray, sig: Signal) -> np.ndarray:
+  """
+  Vectorized get_raw_value over a uint8 [N, 64] payload matrix, plus sign handling.
+  Walks the same byte chunks as get_raw_value once, applying each chunk's mask and shift to a whole column.
+  """
+  ret = np.zeros(dat.shape[0], dtype=np.uint64)
+  i = sig.msb // 8
+  bits = sig.size
+  while 0 <= i < dat.shape[1] and bits > 0:
+    lsb = sig.lsb if (sig.lsb // 8) == i else i * 8
+    msb = sig.msb if (sig.msb // 8) == i else (i + 1) * 8 - 1
+    size = msb - lsb + 1
+    d = (dat[:, i] >> (lsb - (i * 8))) & ((1 << size) - 1)
+    ret |= d.astype(np.uint64) << np.uint64(bits - size)
+    bits -= size
+    i = i - 1 if sig.is_little_endian else i + 1
+
+  # get_raw_value stops immediately when the first byte is past the end of the frame
+  ret[sizes <= sig.msb // 8] = 0
+
+  if sig.size == 64:
+    return ret.view(np.int64) if sig.is_signed else ret
+  ret = ret.astype(np.int64)
+  if sig.is_signed:
+    ret -= ((ret >> (sig.size - 1)) & 0x1) * (1 << sig.size)
+  return ret
+
+
+@dataclass
+class MessageBatch:
+  """All frames of one message from CANParser.decode_batch, one entry per frame"""
+  nanos: np.ndarray
+  vals: dict[str, np.ndarray]
+  checksum_valid: np.ndarray
+  counter_valid: np.ndarray
+
+  @property
+  def valid(self) -> np.ndarray:
+    return self.checksum_valid & self.counter_valid
+
+
+class MessageHistory:
+  """
+  The last depth frames of one message: a float64 column per signal and an int64 timestamp column,
+  preallocated at twice the depth. Frames are written in order and the buffer is compacted when it fills up,
+  so the latest frames are always one contiguous slice. Views are valid until the next CANParser update.
+  """
+  def __init__(self, signals: list[Signal], depth: int):
+    assert depth > 0
+    self.depth = depth
+    self.idxs = {sig.name: i for i, sig in enumerate(signals)}
+    self.vals_buf = np.zeros((len(signals), 2 * depth), dtype=np.float64)
+    self.nanos_buf = np.zeros(2 * depth, dtype=np.int64)
+    self.pos = 0  # one past the latest frame
+    self.size = 0  # number of valid frames, at most depth
+    self.num_new = 0  # frames since the start of the current update
+
+  def append(self, nanos: int, vals: list[float]) -> None:
+    if self.pos == 2 * self.depth:
+      keep = self.depth - 1
+      self.vals_buf[:, :keep] = self.vals_buf[:, self.pos - keep:self.pos]
+      self.nanos_buf[:keep] = self.nanos_buf[self.pos - keep:self.pos]
+      self.pos = keep
+    self.vals_buf[:, self.pos] = vals
+    self.nanos_buf[self.pos] = nanos
+    self.pos += 1
+    self.size = min(self.size + 1, self.depth)
+    self.num_new += 1
+
+  @property
+  def nanos(self) -> np.ndarray:
+    return self.nanos_buf[self.pos - self.size:self.pos]
+
+  @property
+  def vals(self) -> np.ndarray:
+    """[num_signals, size] view of all frames"""
+    return self.vals_buf[:, self.pos - self.size:self.pos]
+
+  def __getitem__(self, name: str) -> np.ndarray:
+    return self.vals_buf[self.idxs[name], self.pos - self.size:self.pos]
+
+  def new_nanos(self) -> np.ndarray:
+    return self.nanos_buf[self.pos - min(self.num_new, self.size):self.pos]
+
+  def new_vals(self, i: int) -> np.ndarray:
+    """View of signal i over the frames of the current update, the most recent depth if there were more"""
+    return self.vals_buf[i, self.pos - min(self.num_new, self.size):self.pos]
+
+
 @dataclass
 class MessageState:
   address: int
@@ -44,27 +217,52 @@ class MessageState:
   counter_fail: int = 0
   first_seen_nanos: int = 0
   last_warning_log_nanos: int = 0
+  # decode plans compiled per frame length, almost always just msg.size
+  decode_plans: dict[int, list[SignalPlan | None]] = field(default_factory=dict)
+  # indices of the counter and checksum signals, the only ones that need per-frame validation
+  check_idxs: list[int] = field(default_factory=list)
+  # lazy parsers keep the raw payloads instead of decoding every signal, see LazySignalDict
+  lazy: bool = False
+  last_dat: bytes = b""
+  all_dats: list[bytes] = field(default_factory=list)
+  generation: int = 0
+  # with a history depth, decoded frames go to a ring buffer instead of all_vals
+  history: MessageHistory | None = None
+
+  def __post_init__(self):
+    self.decode_plans[self.size] = compile_decode_plan(self.signals, self.size)
+    self.check_idxs = [i for i, sig in enumerate(self.signals) if sig.calc_checksum is not None or sig.type == 1]
 
   def rate_limited_log(self, last_update_nanos: int, msg: str) -> None:
     if (last_update_nanos - self.last_warning_log_nanos) >= 1_000_000_000:
       carlog.warning(f"CANParser: {hex(self.address)} {self.name} {msg}")
       self.last_warning_log_nanos = last_update_nanos
 
+  def get_plan(self, length: int) -> list[SignalPlan | None]:
+    plan = self.decode_plans.get(length)
+    if plan is None:
+      plan = self.decode_plans[length] = compile_decode_plan(self.signals, length)
+    return plan
+
+  def decode_value(self, i: int, dat: bytes) -> float:
+    sig = self.signals[i]
+    return decode_raw_values(self.signals, self.get_plan(len(dat)), dat, (i, ))[i] * sig.factor + sig.offset
+
   def parse(self, nanos: int, dat: bytes) -> bool:
-    tmp_vals: list[float] = [0.0] * len(self.signals)
     checksum_failed = False
     counter_failed = False
 
     if self.first_seen_nanos == 0:
       self.first_seen_nanos = nanos
 
-    for i, sig in enumerate(self.signals):
-      tmp = get_raw_value(dat, sig)
-      if sig.is_signed:
-        tmp -= ((tmp >> (sig.size - 1)) & 0x1) * (1 << sig.size)
+    raw_vals = decode_raw_values(self.signals, self.get_plan(len(dat)), dat, self.check_idxs if self.lazy else None)
+
+    for i in self.check_idxs:
+      sig = self.signals[i]
+      tmp = raw_vals[i]
 
       if not self.ignore_checksum and sig.calc_checksum is not None:
-        expected_checksum = sig.calc_checksum(self.address, sig, bytearray(dat))
+        expected_checksum = sig.calc_checksum(self.address, sig, dat)
         if tmp != expected_checksum:
           checksum_failed = True
           self.rate_limited_log(nanos, f"checksum failed: received {hex(tmp)}, calculated {hex(expected_checksum)}")
@@ -73,19 +271,29 @@ class MessageState:
         if not self.update_counter(tmp, sig.size):
           counter_failed = True
 
-      tmp_vals[i] = tmp * sig.factor + sig.offset
-
     # must have good counter and checksum to update data
     if checksum_failed or counter_failed:
       return False
 
-    if not self.vals:
+    if self.lazy:
+      # frames may be views into a buffer the caller reuses
+      self.last_dat = bytes(dat)
+      self.all_dats.append(self.last_dat)
+      self.generation += 1
+    elif not self.vals:
       self.vals = [0.0] * len(self.signals)
       self.all_vals = [[] for _ in self.signals]
 
-    for i, v in enumerate(tmp_vals):
-      self.vals[i] = v
-      self.all_vals[i].append(v)
+    if self.history is not None:
+      for i, sig in enumerate(self.signals):
+        self.vals[i] = raw_vals[i] * sig.factor + sig.offset
+      self.history.append(nanos, self.vals)
+      self.generation += 1
+    elif not self.lazy:
+      for i, sig in enumerate(self.signals):
+        v = raw_vals[i] * sig.factor + sig.offset
+        self.vals[i] = v
+        self.all_vals[i].append(v)
 
     self.timestamps.append(nanos)
 
@@ -114,6 +322,52 @@ class MessageState:
     return True
 
 
+class LazySignalDict(Mapping):
+  """
+  Signal dict of one message for lazy CANParsers. Signals are computed from the message's raw
+  frames on first access and memoized until the message is updated again.
+  A read-only Mapping holding no values of its own, so dict(d), {**d} and dict.update(d) go through __getitem__
+  """
+  def __init__(self, state: MessageState, compute: Callable[[int], Any]):
+    self.state = state
+    self.compute = compute
+    self.idxs = {sig.name: i for i, sig in enumerate(state.signals)}
+    self.memo = {name: compute(i) for name, i in self.idxs.items()}
+    self.memo_generation = dict.fromkeys(self.idxs, state.generation)
+
+  def __getitem__(self, key):
+    idx = self.idxs[key]
+    generation = self.state.generation
+    if self.memo_generation[key] != generation:
+      self.memo[key] = self.compute(idx)
+      self.memo_generation[key] = generation
+    return self.memo[key]
+
+  def __iter__(self):
+    return iter(self.idxs)
+
+  def __len__(self):
+    return len(self.idxs)
+
+  def __contains__(self, key):
+    return key in self.idxs
+
+  def copy(self) -> dict:
+    return {key: self[key] for key in self.idxs}
+
+  def __eq__(self, other):
+    if isinstance(other, Mapping):
+      return self.copy() == dict(other.items())
+    return NotImplemented
+
+  def __repr__(self):
+    return repr(self.copy())
+
+  def __reduce__(self):
+    # copy and pickle as a plain dict
+    return (dict, (self.copy(), ))
+
+
 class VLDict(dict):
   def __init__(self, parser):
     super().__init__()
@@ -126,14 +380,27 @@ class VLDict(dict):
 
 
 class CANParser:
-  def __init__(self, dbc_name: str, messages: list[tuple[str | int, int]], bus: int):
+  def __init__(self, dbc_name: str, messages: list[tuple[str | int, int]], bus: int, lazy: bool = False, history: int = 0):
+    """
+    With lazy=True, update only validates counters and checksums and keeps the raw frames.
+    Signals in vl, vl_all and ts_nanos are decoded when they're read, which is much cheaper
+    for messages with many signals when only a few are used.
+
+    With history > 0, the last history frames of every message are kept in preallocated NumPy buffers,
+    see MessageHistory and self.history. vl_all then holds array views of the current update's frames
+    instead of lists, bounded by the history depth.
+    """
+    assert not (lazy and history), "lazy and history are mutually exclusive"
     self.dbc_name: str = dbc_name
     self.bus: int = bus
-    self.dbc: DBC = DBC(dbc_name)
+    self.lazy: bool = lazy
+    self.history_depth: int = history
+    self.dbc: DBC = get_dbc(dbc_name)
 
     self.vl: dict[int | str, dict[str, float]] = VLDict(self)
     self.vl_all: dict[int | str, dict[str, list[float]]] = {}
     self.ts_nanos: dict[int | str, dict[str, int]] = {}
+    self.history: dict[int | str, MessageHistory] = {}
     self.addresses: set[int] = set()
     self.message_states: dict[int, MessageState] = {}
 
@@ -162,22 +429,34 @@ class CANParser:
     assert msg.address not in self.addresses
 
     self.addresses.add(msg.address)
-    signal_names = list(msg.sigs.keys())
-    signals_dict = {s: 0.0 for s in signal_names}
-    dict.__setitem__(self.vl, msg.address, signals_dict)
-    dict.__setitem__(self.vl, msg.name, signals_dict)
-    self.vl_all[msg.address] = defaultdict(list)
-    self.vl_all[msg.name] = self.vl_all[msg.address]
-    self.ts_nanos[msg.address] = {s: 0 for s in signal_names}
-    self.ts_nanos[msg.name] = self.ts_nanos[msg.address]
-
     state = MessageState(
       address=msg.address,
       name=msg.name,
       size=msg.size,
       signals=list(msg.sigs.values()),
       ignore_alive=freq is not None and math.isnan(freq),
+      lazy=self.lazy,
     )
+    if self.history_depth:
+      state.history = self.history[msg.address] = self.history[msg.name] = MessageHistory(state.signals, self.history_depth)
+
+    if self.lazy:
+      signals_dict = LazySignalDict(state, lambda i: state.decode_value(i, state.last_dat) if state.last_dat else 0.0)
+      self.vl_all[msg.address] = LazySignalDict(state, lambda i: [state.decode_value(i, dat) for dat in state.all_dats])
+      self.ts_nanos[msg.address] = LazySignalDict(state, lambda i: state.timestamps[-1] if state.timestamps else 0)
+    elif state.history is not None:
+      signals_dict = {s: 0.0 for s in msg.sigs}
+      self.vl_all[msg.address] = LazySignalDict(state, state.history.new_vals)
+      self.ts_nanos[msg.address] = {s: 0 for s in msg.sigs}
+    else:
+      signal_names = list(msg.sigs.keys())
+      signals_dict = {s: 0.0 for s in signal_names}
+      self.vl_all[msg.address] = defaultdict(list)
+      self.ts_nanos[msg.address] = {s: 0 for s in signal_names}
+    dict.__setitem__(self.vl, msg.address, signals_dict)
+    dict.__setitem__(self.vl, msg.name, signals_dict)
+    self.vl_all[msg.name] = self.vl_all[msg.address]
+    self.ts_nanos[msg.name] = self.ts_nanos[msg.address]
     if freq is not None and freq > 0:
       state.frequency = freq
     else:
@@ -213,13 +492,57 @@ class CANParser:
     self.can_invalid_cnt = 0 if valid else min(self.can_invalid_cnt + 1, CAN_INVALID_CNT)
     return self.can_invalid_cnt < CAN_INVALID_CNT and counters_valid
 
+  def _begin_update(self) -> None:
+    if self.lazy:
+      for state in self.message_states.values():
+        if state.all_dats:
+          state.all_dats.clear()
+          state.generation += 1
+    elif self.history_depth:
+      for state in self.message_states.values():
+        if state.history.num_new:
+          state.history.num_new = 0
+          state.generation += 1
+    else:
+      for addr in self.addresses:
+        for k in self.vl_all[addr]:
+          self.vl_all[addr][k].clear()
+
+  def _parse_frame(self, t: int, address: int, state: MessageState, dat: bytes | memoryview, updated_addrs: set[int]) -> None:
+    if len(dat) > 64:
+      return
+    if state.parse(t, dat):
+      updated_addrs.add(address)
+      if self.lazy:
+        return
+
+      vl_addr = self.vl[address]
+      vl_all_addr = self.vl_all[address]
+      ts_addr = self.ts_nanos[address]
+
+      if state.history is not None:
+        # vl_all reads its views from the history
+        for i, sig in enumerate(state.signals):
+          vl_addr[sig.name] = state.vals[i]
+          ts_addr[sig.name] = state.timestamps[-1]
+        return
+
+      for i, sig in enumerate(state.signals):
+        vl_addr[sig.name] = state.vals[i]
+        vl_all_addr[sig.name] = state.all_vals[i]
+        ts_addr[sig.name] = state.timestamps[-1]
+
+  def _wanted(self, addresses: np.ndarray) -> np.ndarray:
+    """Mask of the frames in addresses that belong to this parser's messages"""
+    known = np.array(sorted(self.addresses), dtype=addresses.dtype)
+    idx = np.minimum(np.searchsorted(known, addresses), max(len(known) - 1, 0))
+    return known[idx] == addresses if len(known) else np.zeros(len(addresses), dtype=bool)
+
   def update(self, strings, sendcan: bool = False):
     if strings and not isinstance(strings[0], list | tuple):
       strings = [strings]
 
-    for addr in self.addresses:
-      for k in self.vl_all[addr]:
-        self.vl_all[addr][k].clear()
+    self._begin_update()
 
     updated_addrs: set[int] = set()
     for entry in strings:
@@ -231,19 +554,8 @@ class CANParser:
           continue
         bus_empty = False
         state = self.message_states.get(address)
-        if state is None or len(dat) > 64:
-          continue
-        if state.parse(t, dat):
-          updated_addrs.add(address)
-
-          vl_addr = self.vl[address]
-          vl_all_addr = self.vl_all[address]
-          ts_addr = self.ts_nanos[address]
-
-          for i, sig in enumerate(state.signals):
-            vl_addr[sig.name] = state.vals[i]
-            vl_all_addr[sig.name] = state.all_vals[i]
-            ts_addr[sig.name] = state.timestamps[-1]
+        if state is not None:
+          self._parse_frame(t, address, state, dat, updated_addrs)
 
       if not bus_empty:
         self.last_nonempty_nanos = t
@@ -252,10 +564,158 @@ class CANParser:
 
     return updated_addrs
 
+  def update_array(self, frames: np.ndarray) -> set[int]:
+    """
+    Like update, for a CAN_FRAME_DTYPE array in time order. Frames for other buses and messages are
+    filtered out with NumPy, so only this parser's frames are ever turned into Python objects.
+    Each frame counts as its own update() entry for bus timeout tracking. An empty array carries no
+    timestamp, so like update([]) it leaves the time of the last update unchanged.
+    """
+    self._begin_update()
+    updated_addrs: set[int] = set()
+    if len(frames) == 0:
+      return updated_addrs
+
+    on_bus = np.flatnonzero(frames["bus"] == self.bus)
+    wanted = on_bus[self._wanted(frames["address"][on_bus])]
+
+    # one copy of the wanted payloads, sliced per frame
+    payloads = frames["dat"][wanted].tobytes()
+    message_states = self.message_states
+    for start, t, address, size in zip(range(0, len(payloads), 64), frames["nanos"][wanted].tolist(), frames["address"][wanted].tolist(),
+                                       frames["size"][wanted].tolist(), strict=True):
+      self._parse_frame(t, address, message_states[address], payloads[start:start + size], updated_addrs)
+
+    if len(on_bus):
+      self.last_nonempty_nanos = int(frames["nanos"][on_bus[-1]])
+    self._last_update_nanos = int(frames["nanos"][-1])
+    return updated_addrs
+
+  def update_packets(self, nanos: int | Sequence[int], buf: bytes | bytearray | memoryview, offsets: Sequence[int] = None) -> set[int]:
+    """
+    Like update, for packed CANPacket_t frames (6 byte header followed by the payload, as sent by the panda)
+    in one contiguous buffer. offsets are the start of each packet; when omitted, packets are read back to back.
+    nanos is one timestamp for the whole buffer or one per packet. Headers are read in place, and only
+    the payloads of this parser's messages are sliced out of buf. An empty buffer with one timestamp
+    counts as an update at that time, like update([nanos, []]).
+    """
+    self._begin_update()
+    updated_addrs: set[int] = set()
+
+    if offsets is None:
+      offsets = []
+      offset = 0
+      while offset + CANPACKET_HEAD_SIZE <= len(buf):
+        offsets.append(offset)
+        offset += CANPACKET_HEAD_SIZE + DLC_TO_LEN[buf[offset] >> 4]
+    if isinstance(nanos, numbers.Integral):
+      self._last_update_nanos = int(nanos)
+      nanos = [int(nanos)] * len(offsets)
+    if len(offsets) == 0:
+      return updated_addrs
+
+    bus_bits = self.bus << 1
+    message_states = self.message_states
+    unpack_header = CANPACKET_HEADER.unpack_from
+    for t, offset in zip(nanos, offsets, strict=True):
+      header, address = unpack_header(buf, offset)
+      if (header & 0xE) != bus_bits:
+        continue
+      self.last_nonempty_nanos = t
+      state = message_states.get(address >> 3)
+      if state is not None:
+        start = offset + CANPACKET_HEAD_SIZE
+        self._parse_frame(t, address >> 3, state, buf[start:start + DLC_TO_LEN[header >> 4]], updated_addrs)
+
+    self._last_update_nanos = nanos[-1]
+    return updated_addrs
+
+  def decode_batch(self, frames: np.ndarray) -> dict[int | str, MessageBatch]:
+    """
+    Decode a whole log at once. frames is a CAN_FRAME_DTYPE array, see frames_to_array.
+    Returns a MessageBatch per message on this parser's bus, keyed by address and name like vl.
+    Unlike update, this doesn't touch the parser's state. The first frame of each message has a valid
+    counter, after that a counter is valid when it increments by exactly one from the previous frame.
+    """
+    frames = frames[(frames["bus"] == self.bus) & (frames["size"] <= 64)]
+    ret: dict[int | str, MessageBatch] = {}
+    for address, state in self.message_states.items():
+      msg_frames = frames[frames["address"] == address]
+      sizes = msg_frames["size"].astype(np.int64)
+      dat = msg_frames["dat"] * (np.arange(64) < sizes[:, None])
+
+      vals = {}
+      checksum_valid = np.ones(len(msg_frames), dtype=bool)
+      counter_valid = np.ones(len(msg_frames), dtype=bool)
+      for sig in state.signals:
+        raw = batch_raw_values(dat, sizes, sig)
+        vals[sig.name] = raw * sig.factor + sig.offset
+
+        if not state.ignore_checksum and sig.calc_checksum is not None:
+          for size in np.unique(sizes):
+            size_mask = sizes == size
+            checksum_valid[size_mask] &= batch_checksum(address, sig, dat[size_mask, :size]) == raw[size_mask]
+
+        if not state.ignore_counter and sig.type == 1:  # COUNTER
+          counter_valid[1:] &= raw[1:] == ((raw[:-1] + 1) & ((1 << sig.size) - 1))
+
+      ret[address] = ret[state.name] = MessageBatch(msg_frames["nanos"].astype(np.int64), vals, checksum_valid, counter_valid)
+    return ret
+
+
+class CANParserGroup:
+  """
+  Feeds one list of CAN frames to several CANParsers in a single pass. Frames are routed by address
+  straight to the parsers that want them, instead of every parser scanning every frame.
+  Bus timeout bookkeeping stays per parser, so each parser ends up in the same state as after its own update().
+  """
+  def __init__(self, parsers: Iterable[CANParser | None]):
+    self.parsers: list[CANParser] = [cp for cp in parsers if cp is not None]
+    self._routes: dict[int, list[tuple[int, CANParser, MessageState]]] = {}
+    self._num_messages = -1
+
+  def _build_routes(self) -> None:
+    # parsers add messages when unknown ones are read from vl, so rebuild whenever that happens
+    self._routes = {}
+    for cp in self.parsers:
+      for address, state in cp.message_states.items():
+        self._routes.setdefault(address, []).append((cp.bus, cp, state))
+    self._num_messages = sum(len(cp.message_states) for cp in self.parsers)
+
+  def update(self, strings) -> list[set[int]]:
+    """Same as calling update(strings) on every parser, returns each parser's updated addresses"""
+    if strings and not isinstance(strings[0], list | tuple):
+      strings = [strings]
+    if self._num_messages != sum(len(cp.message_states) for cp in self.parsers):
+      self._build_routes()
+
+    for cp in self.parsers:
+      cp._begin_update()
+
+    routes = self._routes
+    updated_addrs: dict[CANParser, set[int]] = {cp: set() for cp in self.parsers}
+    for entry in strings:
+      t = entry[0]
+      frames = entry[1]
+      for address, dat, src in frames:
+        owners = routes.get(address)
+        if owners is not None:
+          for bus, cp, state in owners:
+            if bus == src:
+              cp._parse_frame(t, address, state, dat, updated_addrs[cp])
+
+      nonempty_buses = set(map(itemgetter(2), frames))
+      for cp in self.parsers:
+        if cp.bus in nonempty_buses:
+          cp.last_nonempty_nanos = t
+        cp._last_update_nanos = t
+
+    return [updated_addrs[cp] for cp in self.parsers]
+
 
 class CANDefine:
   def __init__(self, dbc_name: str):
-    dbc = DBC(dbc_name)
+    dbc = get_dbc(dbc_name)
 
     dv = defaultdict(dict)
     for val in dbc.vals:
@@ -1,6 +1,16 @@
 #!/usr/bin/env python3
+import glob
+import os
+import tempfile
 import time
-from opendbc.can import CANPacker, CANParser
+import numpy as np
+from opendbc.can import CANPacker, CANParser, CANParserGroup
+import opendbc.can.dbc as dbc_module
+from opendbc import DBC_PATH
+from opendbc.can.dbc import DBC
+from opendbc.can.parser import compile_decode_plan, decode_raw_values, frames_to_array, get_raw_value
+from opendbc.can.tests.test_packer_parser import reference_pack
+from opendbc.safety import DLC_TO_LEN
 
 
 def _benchmark(checks, n):
@@ -39,8 +49,244 @@ def _benchmark(checks, n):
   print('[%d] %.1fms to pack, %.1fms to parse %s messages, avg: %dns' % (n, pack_dt/1e6, et/1e6, len(can_msgs), avg_nanos))
 
 
+def _benchmark_decode(dbc_name, msg_name, n=10000):
+  msg = DBC(dbc_name).name_to_msg[msg_name]
+  signals = list(msg.sigs.values())
+  frames = [os.urandom(msg.size) for _ in range(n)]
+
+  t1 = time.process_time_ns()
+  for dat in frames:
+    [get_raw_value(dat, sig) for sig in signals]
+  t2 = time.process_time_ns()
+  raw_dt = (t2 - t1) / n
+
+  t1 = time.process_time_ns()
+  plan = compile_decode_plan(signals, msg.size)
+  t2 = time.process_time_ns()
+  compile_dt = t2 - t1
+
+  t1 = time.process_time_ns()
+  for dat in frames:
+    decode_raw_values(signals, plan, dat)
+  t2 = time.process_time_ns()
+  plan_dt = (t2 - t1) / n
+
+  print('[%s %s, %d signals] get_raw_value: %dns/frame, decode plan: %dns/frame (%.1fx, %dus to compile)' %
+        (dbc_name, msg_name, len(signals), raw_dt, plan_dt, raw_dt / plan_dt, compile_dt / 1e3))
+
+
+def _benchmark_batch(n=100000):
+  parser = CANParser('toyota_new_mc_pt_generated', [('ACC_CONTROL', 10)], 0)
+  packer = CANPacker('toyota_new_mc_pt_generated')
+  can_msgs = [(int(0.01 * i * 1e9), [packer.make_can_msg('ACC_CONTROL', 0, {"ACC_TYPE": 1, "ACCEL_CMD": i % 100 / 100})]) for i in range(n)]
+  frames = frames_to_array(can_msgs)
+
+  t1 = time.process_time_ns()
+  parser.update(can_msgs)
+  t2 = time.process_time_ns()
+  update_dt = t2 - t1
+
+  t1 = time.process_time_ns()
+  parser.decode_batch(frames)
+  t2 = time.process_time_ns()
+  batch_dt = t2 - t1
+
+  print('[batch] update: %.1fms, decode_batch: %.1fms for %d messages (%.1fx)' % (update_dt / 1e6, batch_dt / 1e6, n, update_dt / batch_dt))
+
+
+def _benchmark_lazy(dbc_name, msg_name, sig_names, n=10000):
+  packer = CANPacker(dbc_name)
+  can_msgs = [(int(0.01 * i * 1e9), [packer.make_can_msg(msg_name, 0, {})]) for i in range(n)]
+
+  for lazy in (False, True):
+    parser = CANParser(dbc_name, [(msg_name, 100)], 0, lazy=lazy)
+    t1 = time.process_time_ns()
+    for m in can_msgs:
+      parser.update([m])
+      for sig in sig_names:
+        parser.vl[msg_name][sig]
+    t2 = time.process_time_ns()
+    print('[%s %s, lazy=%s] %dns/frame reading %d signals' % (dbc_name, msg_name, lazy, (t2 - t1) / n, len(sig_names)))
+
+
+def _unpack_packets(buf):
+  # what a caller has to do to feed update() from a packed CANPacket_t buffer
+  frames = []
+  offset = 0
+  while offset < len(buf):
+    length = DLC_TO_LEN[buf[offset] >> 4]
+    address = int.from_bytes(buf[offset + 1:offset + 5], 'little') >> 3
+    frames.append((address, buf[offset + 6:offset + 6 + length], (buf[offset] >> 1) & 0x7))
+    offset += 6 + length
+  return frames
+
+
+def _benchmark_ingest(n=2000, chunk=100):
+  # a typical 10ms panda batch: a few messages this parser wants among many it doesn't
+  dbc_name = 'toyota_new_mc_pt_generated'
+  packer = CANPacker(dbc_name)
+  parser_msgs = [("ACC_CONTROL", 100), ("STEERING_LKA", 100)]
+  frames = [packer.make_can_msg(name, 0, {}) for name, _ in parser_msgs]
+  frames += [(0x700 + i, bytes(8), 0) for i in range(30)] + [(0x100 + i, bytes(8), 1) for i in range(30)]
+  buf = b''.join(bytes([(src << 1) | (DLC_TO_LEN.index(len(dat)) << 4)]) + (address << 3).to_bytes(4, 'little') + b'\x00' + dat
+                 for address, dat, src in frames)
+  nanos = [int(0.01 * i * 1e9) for i in range(n)]
+  arrays = [frames_to_array([(t, frames)]) for t in nanos]
+  log = frames_to_array([(t, frames) for t in nanos])
+
+  parser = CANParser(dbc_name, parser_msgs, 0)
+  t1 = time.process_time_ns()
+  for t in nanos:
+    parser.update([(t, _unpack_packets(buf))])
+  t2 = time.process_time_ns()
+  update_dt = (t2 - t1) / n
+
+  t1 = time.process_time_ns()
+  for t in nanos:
+    parser.update_packets(t, buf)
+  t2 = time.process_time_ns()
+  packets_dt = (t2 - t1) / n
+
+  t1 = time.process_time_ns()
+  for a in arrays:
+    parser.update_array(a)
+  t2 = time.process_time_ns()
+  array_dt = (t2 - t1) / n
+
+  step = chunk * len(frames)
+  t1 = time.process_time_ns()
+  for i in range(0, len(log), step):
+    parser.update_array(log[i:i + step])
+  t2 = time.process_time_ns()
+  log_dt = (t2 - t1) / n
+
+  print('[%d frames/10ms] unpack + update: %dns, update_packets: %dns, update_array: %dns, update_array %d at a time: %dns' %
+        (len(frames), update_dt, packets_dt, array_dt, chunk, log_dt))
+
+
+def _benchmark_group(n=2000):
+  # pt, cam and radar parsers on three busy buses, as in CarInterfaceBase.update
+  dbc_name = 'toyota_new_mc_pt_generated'
+  packer = CANPacker(dbc_name)
+  configs = [([("ACC_CONTROL", 100), ("STEERING_LKA", 100)], 0), ([("ACC_CONTROL", 100)], 1), ([("STEERING_LKA", 100)], 2)]
+  frames = []
+  for bus in range(3):
+    frames += [packer.make_can_msg("ACC_CONTROL", bus, {}), packer.make_can_msg("STEERING_LKA", bus, {})]
+    frames += [(0x600 + i, bytes(8), bus) for i in range(100)]
+  can_strings = [(int(0.01 * i * 1e9), frames) for i in range(n)]
+
+  parsers = [CANParser(dbc_name, msgs, bus) for msgs, bus in configs]
+  t1 = time.process_time_ns()
+  for m in can_strings:
+    for cp in parsers:
+      cp.update([m])
+  t2 = time.process_time_ns()
+  separate_dt = (t2 - t1) / n
+
+  group = CANParserGroup(CANParser(dbc_name, msgs, bus) for msgs, bus in configs)
+  t1 = time.process_time_ns()
+  for m in can_strings:
+    group.update([m])
+  t2 = time.process_time_ns()
+  group_dt = (t2 - t1) / n
+
+  print('[%d parsers, %d frames/10ms] separate updates: %dns, CANParserGroup: %dns' % (len(configs), len(frames), separate_dt, group_dt))
+
+
+def _benchmark_history(dbc_name, msg_name, n=20000, chunk=500):
+  # log replay: many frames of one message per update
+  packer = CANPacker(dbc_name)
+  can_msgs = [(int(0.01 * i * 1e9), [packer.make_can_msg(msg_name, 0, {})]) for i in range(n)]
+
+  for history in (0, chunk):
+    parser = CANParser(dbc_name, [(msg_name, 100)], 0, history=history)
+    t1 = time.process_time_ns()
+    for i in range(0, n, chunk):
+      parser.update(can_msgs[i:i + chunk])
+      for vals in parser.vl_all[msg_name].values():
+        np.asarray(vals).mean()
+    t2 = time.process_time_ns()
+    print('[%s %s, history=%d] %dns/frame, %d frames per update' % (dbc_name, msg_name, history, (t2 - t1) / n, chunk))
+
+
+def _benchmark_dbc_load():
+  # every DBC, including the generated ones, parsed from scratch and then loaded from a warm cache
+  paths = sorted(glob.glob(os.path.join(DBC_PATH, '*.dbc')))
+  cache_dir = dbc_module.DBC_CACHE_DIR
+  try:
+    dbc_module.DBC_CACHE_DIR = ''
+    t1 = time.process_time_ns()
+    dbcs = [DBC(p) for p in paths]
+    t2 = time.process_time_ns()
+    parse_dt = (t2 - t1) / len(paths)
+
+    with tempfile.TemporaryDirectory() as tmp:
+      dbc_module.DBC_CACHE_DIR = tmp
+      for p in paths:
+        DBC(p)
+      t1 = time.process_time_ns()
+      for p in paths:
+        DBC(p)
+      t2 = time.process_time_ns()
+      cached_dt = (t2 - t1) / len(paths)
+  finally:
+    dbc_module.DBC_CACHE_DIR = cache_dir
+
+  n_sigs = sum(len(m.sigs) for d in dbcs for m in d.msgs.values())
+  print('[%d DBCs, %d signals] parse: %dus/DBC, cached: %dus/DBC' % (len(paths), n_sigs, parse_dt / 1e3, cached_dt / 1e3))
+
+
+def _benchmark_pack(dbc_name, msg_name, values, n=20000):
+  packer = CANPacker(dbc_name)
+  plan = packer.get_plan(packer.dbc.name_to_msg[msg_name].address)
+  template = packer.get_template(msg_name, list(values))
+  ordered_values = list(values.values())
+
+  msg = packer.dbc.name_to_msg[msg_name]
+  t1 = time.process_time_ns()
+  for _ in range(n):
+    reference_pack(msg, values, 0)
+  t2 = time.process_time_ns()
+  slow_dt = (t2 - t1) / n
+
+  t1 = time.process_time_ns()
+  for _ in range(n):
+    packer.pack(plan.address, values)
+  t2 = time.process_time_ns()
+  pack_dt = (t2 - t1) / n
+
+  t1 = time.process_time_ns()
+  for _ in range(n):
+    packer.pack_template(template, ordered_values)
+  t2 = time.process_time_ns()
+  template_dt = (t2 - t1) / n
+
+  print('[%s %s] set_value: %dns, pack plan: %dns (%.1fx), template: %dns (%.1fx)' %
+        (dbc_name, msg_name, slow_dt, pack_dt, slow_dt / pack_dt, template_dt, slow_dt / template_dt))
+
+
 if __name__ == "__main__":
   # python -m cProfile -s cumulative  benchmark.py
   _benchmark([('ACC_CONTROL', 10)], 1)
   _benchmark([('ACC_CONTROL', 10)], 5)
   _benchmark([('ACC_CONTROL', 10)], 10)
+
+  _benchmark_decode('toyota_new_mc_pt_generated', 'ACC_CONTROL')
+  _benchmark_decode('hyundai_canfd_generated', 'SCC_CONTROL')
+  _benchmark_decode('tesla_model3_party', 'DI_systemStatus')
+  _benchmark_batch()
+  _benchmark_dbc_load()
+  _benchmark_ingest()
+  _benchmark_group()
+  _benchmark_history('hyundai_canfd_generated', 'SCC_CONTROL')
+  _benchmark_lazy('hyundai_canfd_generated', 'SCC_CONTROL', ['aReqValue', 'ACCMode'])
+  # steering and longitudinal messages sent every frame by the Hyundai CAN FD, Toyota and VW MQB car controllers
+  _benchmark_pack('hyundai_canfd_generated', 'LFA', {"LKA_MODE": 2, "LKA_ICON": 2, "TORQUE_REQUEST": 120, "LKA_ASSIST": 0, "STEER_REQ": 1,
+                                                     "STEER_MODE": 0, "HAS_LANE_SAFETY": 0, "NEW_SIGNAL_2": 0, "DAMP_FACTOR": 100, "NEW_SIGNAL_1": 0})
+  _benchmark_pack('hyundai_canfd_generated', 'SCC_CONTROL', {"ACCMode": 1, "aReqRaw": -0.5, "aReqValue": -0.5, "JerkLowerLimit": 1.0,
+                                                             "JerkUpperLimit": 3.0, "ObjValid": 1, "OBJ_STATUS": 2, "SET_ME_2": 0x4, "SET_ME_TMP_64": 0x64})
+  _benchmark_pack('toyota_nodsu_pt_generated', 'STEERING_LKA', {"STEER_REQUEST": 1, "STEER_TORQUE_CMD": 250, "SET_ME_1": 1})
+  _benchmark_pack('toyota_nodsu_pt_generated', 'ACC_CONTROL', {"ACCEL_CMD": -0.5, "ACC_TYPE": 1, "DISTANCE": 0, "MINI_CAR": 1, "PERMIT_BRAKING": 1,
+                                                               "RELEASE_STANDSTILL": 1, "CANCEL_REQ": 0, "ALLOW_LONG_PRESS": 1, "ACC_CUT_IN": 0})
+  _benchmark_pack('vw_mqb', 'HCA_01', {"HCA_01_Status_HCA": 5, "HCA_01_LM_Offset": 120, "HCA_01_LM_OffSign": 1, "HCA_01_Vib_Freq": 18,
+                                       "HCA_01_Sendestatus": 1, "EA_ACC_Wunschgeschwindigkeit": 327.36})
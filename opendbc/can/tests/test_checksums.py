@@ -1,9 +1,85 @@
 import copy
+import random
+
+import numpy as np
+
 from opendbc.can import CANPacker, CANParser
+from opendbc.can import checksums
+from opendbc.can.checksums import batch_checksum
+from opendbc.can.dbc import DBC
+from opendbc.can.tests import ALL_DBCS
+from opendbc.car.body.bodycan import body_checksum
+from opendbc.car.chrysler.chryslercan import chrysler_checksum, fca_giorgio_checksum
+from opendbc.car.honda.hondacan import honda_checksum
+from opendbc.car.hyundai.hyundaicanfd import hkg_can_fd_checksum
+from opendbc.car.psa.psacan import psa_checksum
+from opendbc.car.subaru.subarucan import subaru_checksum
+from opendbc.car.tesla.teslacan import tesla_checksum
+from opendbc.car.toyota.toyotacan import toyota_checksum
+from opendbc.car.volkswagen.mqbcan import volkswagen_mqb_meb_checksum, xor_checksum
+
+# the original byte-loop implementations, which the table-driven ones must match
+REFERENCE_CHECKSUMS = {
+  checksums.body_checksum: body_checksum,
+  checksums.chrysler_checksum: chrysler_checksum,
+  checksums.fca_giorgio_checksum: fca_giorgio_checksum,
+  checksums.honda_checksum: honda_checksum,
+  checksums.hkg_can_fd_checksum: hkg_can_fd_checksum,
+  checksums.psa_checksum: psa_checksum,
+  checksums.subaru_checksum: subaru_checksum,
+  checksums.tesla_checksum: tesla_checksum,
+  checksums.toyota_checksum: toyota_checksum,
+  checksums.volkswagen_mqb_meb_checksum: volkswagen_mqb_meb_checksum,
+  checksums.xor_checksum: xor_checksum,
+}
 
 
 class TestCanChecksums:
 
+  def test_table_checksum(self, subtests):
+    """Table-driven checksums must match the original per-car implementations for every message with a checksum"""
+    rng = random.Random(0)
+    for dbc_name in ALL_DBCS:
+      for msg in DBC(dbc_name).msgs.values():
+        for sig in msg.sigs.values():
+          if sig.calc_checksum is None:
+            continue
+          with subtests.test(dbc=dbc_name, msg=msg.name):
+            reference = REFERENCE_CHECKSUMS[sig.calc_checksum]
+            for length in {msg.size, msg.size + 1}:
+              for _ in range(20):
+                dat = rng.randbytes(length)
+                expected = reference(msg.address, sig, bytearray(dat))
+                assert sig.calc_checksum(msg.address, sig, dat) == expected
+                assert sig.calc_checksum(msg.address, sig, memoryview(dat)) == expected
+
+  def test_checksum_no_copy(self):
+    """Checksums must not modify the frame, the parser passes it without copying"""
+    dbc = DBC("psa_aee2010_r3")
+    msg = dbc.name_to_msg["LANE_KEEP_ASSIST"]
+    dat = bytearray(b"\xff" * msg.size)
+    msg.sigs["CHECKSUM"].calc_checksum(msg.address, msg.sigs["CHECKSUM"], dat)
+    assert dat == b"\xff" * msg.size
+
+  def test_batch_checksum(self, subtests):
+    """Vectorized checksums must match the per-frame functions for every message with a checksum"""
+    rng = random.Random(0)
+    for dbc_name in ALL_DBCS:
+      for msg in DBC(dbc_name).msgs.values():
+        for sig in msg.sigs.values():
+          if sig.calc_checksum is None:
+            continue
+          with subtests.test(dbc=dbc_name, msg=msg.name):
+            frames = [bytearray(rng.randbytes(msg.size)) for _ in range(20)]
+            expected = [sig.calc_checksum(msg.address, sig, bytearray(d)) for d in frames]
+            dat = np.array(frames, dtype=np.uint8).reshape(len(frames), msg.size)
+            assert batch_checksum(msg.address, sig, dat).tolist() == expected
+
+            # empty frames, for the checksums defined on them
+            if sig.calc_checksum is checksums.honda_checksum:
+              expected = sig.calc_checksum(msg.address, sig, b"")
+              assert batch_checksum(msg.address, sig, np.zeros((3, 0), dtype=np.uint8)).tolist() == [expected] * 3
+
   def verify_checksum(self, subtests, dbc_file: str, msg_name: str, msg_addr: int, test_messages: list[bytes],
                       checksum_field: str = 'CHECKSUM', counter_field = 'COUNTER'):
     """
@@ -1,5 +1,13 @@
-from opendbc.can import CANParser
-from opendbc.can.tests import ALL_DBCS
+import json
+import os
+import random
+import shutil
+
+import opendbc.can.dbc as dbc_module
+from opendbc.can import CANDefine, CANPacker, CANParser
+from opendbc.can.dbc import DBC
+from opendbc.can.parser import compile_decode_plan, decode_raw_values, get_raw_value
+from opendbc.can.tests import ALL_DBCS, TEST_DBC
 
 
 class TestDBCParser:
@@ -19,3 +27,173 @@ class TestDBCParser:
     for dbc in ALL_DBCS:
       with subtests.test(dbc=dbc):
         CANParser(dbc, [], 0)
+
+  def test_dbc_cache(self, tmp_path, monkeypatch):
+    monkeypatch.setattr(dbc_module, "DBC_CACHE_DIR", str(tmp_path / "cache"))
+    dbc_path = str(tmp_path / "test.dbc")
+    shutil.copy(TEST_DBC, dbc_path)
+
+    parsed = DBC(dbc_path)
+    assert len(os.listdir(tmp_path / "cache")) == 1
+    cached = DBC(dbc_path)
+    assert cached == parsed
+    assert cached.msgs[245] is cached.addr_to_msg[245] is cached.name_to_msg["CAN_FD_MESSAGE"]
+
+    # editing the file invalidates the cache
+    with open(dbc_path, "a") as f:
+      f.write('\nBO_ 1 NEW_MESSAGE: 8 XXX\n SG_ NEW_SIGNAL : 0|8@1+ (1,0) [0|255] "" XXX\n')
+    assert "NEW_MESSAGE" in DBC(dbc_path).name_to_msg
+
+  def test_dbc_cache_contents(self, tmp_path, monkeypatch, subtests):
+    # the cache is plain data, every DBC comes back with the same dataclasses and checksum functions
+    monkeypatch.setattr(dbc_module, "DBC_CACHE_DIR", str(tmp_path / "cache"))
+    for dbc in ALL_DBCS:
+      with subtests.test(dbc=dbc):
+        dbc_path = dbc_module.get_dbc_path(dbc)
+        parsed = DBC(dbc_path)
+        cached = DBC(dbc_path)
+        assert cached == parsed
+        assert not any(isinstance(v, bytes) for v in cached.__dict__.values())
+
+  def test_dbc_cache_untrusted(self, tmp_path, monkeypatch):
+    # caches others could have written are ignored, and parsing doesn't touch any cache unless one is configured
+    assert os.environ.get("OPENDBC_CACHE_DIR") or dbc_module.DBC_CACHE_DIR == ""
+    cache_dir = tmp_path / "cache"
+    monkeypatch.setattr(dbc_module, "DBC_CACHE_DIR", str(cache_dir))
+    dbc_path = str(tmp_path / "test.dbc")
+    shutil.copy(TEST_DBC, dbc_path)
+    DBC(dbc_path)
+    cache_path = dbc_module._cache_path(dbc_path)
+
+    with open(cache_path) as f:
+      key, state = json.load(f)
+    state["msgs"][0][0] = "PLANTED"
+
+    def plant(file_mode, dir_mode):
+      with open(cache_path, "w") as f:
+        json.dump([key, state], f)
+      os.chmod(cache_path, file_mode)
+      os.chmod(cache_dir, dir_mode)
+      dbc = DBC(dbc_path)
+      os.chmod(cache_dir, 0o700)
+      return "PLANTED" in dbc.name_to_msg
+
+    assert plant(0o600, 0o700)
+    assert not plant(0o666, 0o700)
+    assert not plant(0o600, 0o777)
+
+  def test_dbc_statements(self, tmp_path, monkeypatch):
+    monkeypatch.setattr(dbc_module, "DBC_CACHE_DIR", "")
+    dbc_path = str(tmp_path / "test.dbc")
+    with open(dbc_path, "w") as f:
+      f.write("""NS_ :
+    CM_
+    BA_DEF_
+    BA_
+    SG_MUL_VAL_
+
+BO_ 100 CYCLIC: 8 XXX
+ SG_ MUX M : 0|8@1+ (1,0) [0|255] "" XXX
+ SG_ MUXED m1 : 8|8@1+ (1,0) [0|255] "" XXX
+ SG_ BIG : 23|12@0+ (0.5,-10) [0|255] "" XXX
+
+BO_ 200 EVENT: 8 XXX
+ SG_ SIG : 0|8@1+ (1,0) [0|255] "" XXX
+
+CM_ "the network";
+CM_ BO_ 100 "a message";
+CM_ SG_ 100 BIG "a comment
+spanning lines";
+BA_DEF_ BO_ "GenMsgCycleTime" INT 0 65535;
+BA_DEF_ SG_ "GenSigStartValue" INT 0 10000;
+BA_DEF_ "BusType" STRING ;
+BA_DEF_DEF_ "GenMsgCycleTime" 0;
+BA_DEF_DEF_ "BusType" "CAN";
+BA_ "BusType" "CAN FD";
+BA_ "GenMsgCycleTime" BO_ 100 20;
+BA_ "GenSigStartValue" SG_ 100 BIG 40;
+BA_ "GenMsgCycleTime" BO_ 999 10;
+SG_MUL_VAL_ 100 MUXED MUX 1-1, 3-4;
+""")
+
+    dbc = DBC(dbc_path)
+    cyclic, event = dbc.name_to_msg["CYCLIC"], dbc.name_to_msg["EVENT"]
+    assert list(cyclic.sigs) == ["MUX", "MUXED", "BIG"]
+    assert (cyclic.sigs["BIG"].msb, cyclic.sigs["BIG"].lsb) == (23, 28)
+    assert dbc.comment == "the network"
+    assert cyclic.comment == "a message"
+    assert cyclic.sigs["BIG"].comment == "a comment\nspanning lines"
+    assert dbc.attribute_defs["GenMsgCycleTime"].object_type == "BO_"
+    assert dbc.attribute_defs["GenMsgCycleTime"].default == 0
+    assert dbc.attribute_defs["BusType"].default == "CAN"
+    assert dbc.attributes == {"BusType": "CAN FD"}
+    assert cyclic.attributes == {"GenMsgCycleTime": 20}
+    assert cyclic.signal_attributes == {"BIG": {"GenSigStartValue": 40}}
+    assert (cyclic.cycle_time, event.cycle_time) == (20, None)
+    assert [(m.address, m.signal, m.switch, m.ranges) for m in dbc.mux_vals] == [(100, "MUXED", "MUX", [(1, 1), (3, 4)])]
+
+  def test_dbc_statements_spacing(self, tmp_path, monkeypatch):
+    """Single-line CM_ and BA_ take a regex fast path, extra spaces fall back to the tokenizer. Both must agree"""
+    monkeypatch.setattr(dbc_module, "DBC_CACHE_DIR", "")
+    statements = [
+      'CM_ "the network";',
+      'CM_ BO_ 100 "a message";',
+      'CM_ SG_ 100 SIG "a comment";',
+      'CM_ SG_ 999 SIG "unknown message";',
+      'BA_ "BusType" "CAN FD";',
+      'BA_ "GenMsgCycleTime" BO_ 100 20;',
+      'BA_ "GenSigStartValue" SG_ 100 SIG 0.5;',
+      'BA_ "GenSigStartValue" SG_ 100 MISSING 1;',
+      'BA_ "GenMsgCycleTime" BO_ 100 bogus;',
+    ]
+    dbcs = []
+    for spacing in (" ", "  "):
+      dbc_path = str(tmp_path / f"test{len(spacing)}.dbc")
+      with open(dbc_path, "w") as f:
+        f.write('BO_ 100 MSG: 8 XXX\n SG_ SIG : 0|8@1+ (1,0) [0|255] "" XXX\n\n')
+        # respace outside of the quoted strings only
+        for s in statements:
+          parts = s.split('"')
+          parts[::2] = [p.replace(" ", spacing).replace(";", spacing + ";") for p in parts[::2]]
+          f.write('"'.join(parts) + "\n")
+      dbcs.append(DBC(dbc_path))
+
+    fast, slow = dbcs
+    assert fast.comment == slow.comment == "the network"
+    assert fast.attributes == slow.attributes == {"BusType": "CAN FD"}
+    msgs = [dbc.name_to_msg["MSG"] for dbc in dbcs]
+    assert msgs[0] == msgs[1]
+    assert msgs[0].comment == "a message"
+    assert msgs[0].sigs["SIG"].comment == "a comment"
+    assert msgs[0].attributes == {"GenMsgCycleTime": 20}
+    assert msgs[0].signal_attributes == {"SIG": {"GenSigStartValue": 0.5}}
+
+  def test_shared_dbc(self):
+    dbc_name = "honda_civic_touring_2016_can_generated"
+    parser = CANParser(dbc_name, [], 0)
+    assert parser.dbc is CANPacker(dbc_name).dbc
+    assert parser.dbc is CANParser(dbc_name, [], 1).dbc
+    assert CANDefine(dbc_name).dv == CANDefine(dbc_name).dv
+
+  def test_decode_plan_all_dbcs(self, subtests):
+    """
+      Compiled decode plans must match get_raw_value for every signal in every DBC,
+      including frames shorter or longer than the DBC message size
+    """
+    rng = random.Random(0)
+    for dbc_name in ALL_DBCS:
+      with subtests.test(dbc=dbc_name):
+        dbc = DBC(dbc_name)
+        for msg in dbc.msgs.values():
+          signals = list(msg.sigs.values())
+          for length in {msg.size, max(msg.size - 1, 0), msg.size + 1}:
+            plan = compile_decode_plan(signals, length)
+            for _ in range(3):
+              dat = rng.randbytes(length)
+              expected = []
+              for sig in signals:
+                tmp = get_raw_value(dat, sig)
+                if sig.is_signed:
+                  tmp -= ((tmp >> (sig.size - 1)) & 0x1) * (1 << sig.size)
+                expected.append(tmp)
+              assert decode_raw_values(signals, plan, dat) == expected, (msg.name, length, dat.hex())
@@ -1,12 +1,41 @@
+import copy
+import math
+import numpy as np
+import pickle
 import pytest
 import random
 
-from opendbc.can import CANPacker, CANParser
-from opendbc.can.tests import TEST_DBC
+from opendbc.can import CANPacker, CANParser, CANParserGroup
+from opendbc.can.dbc import DBC, SignalType
+from opendbc.can.packer import set_value
+from opendbc.can.parser import frames_to_array
+from opendbc.can.tests import ALL_DBCS, TEST_DBC
+from opendbc.safety import DLC_TO_LEN
 
 MAX_BAD_COUNTER = 5
 
 
+def reference_pack(msg, values, counter):
+  """CANPacker.pack before pack plans, one set_value per signal"""
+  dat = bytearray(msg.size)
+  counter_set = False
+  for name, value in values.items():
+    sig = msg.sigs[name]
+    ival = int(math.floor((value - sig.offset) / sig.factor + 0.5))
+    if ival < 0:
+      ival = (1 << sig.size) + ival
+    set_value(dat, sig, ival)
+    if sig.type == SignalType.COUNTER or sig.name == "COUNTER":
+      counter_set = True
+  sig_counter = next((s for s in msg.sigs.values() if s.type == SignalType.COUNTER or s.name == "COUNTER"), None)
+  if sig_counter and not counter_set:
+    set_value(dat, sig_counter, counter)
+  sig_checksum = next((s for s in msg.sigs.values() if s.type > SignalType.COUNTER), None)
+  if sig_checksum and sig_checksum.calc_checksum:
+    set_value(dat, sig_checksum, sig_checksum.calc_checksum(msg.address, sig_checksum, dat))
+  return dat
+
+
 class TestCanParserPacker:
   def test_packer(self):
     packer = CANPacker(TEST_DBC)
@@ -19,6 +48,35 @@ class TestCanParserPacker:
         assert bus == b
         assert dat[0] == i
 
+  def test_pack_plan_all_dbcs(self, subtests):
+    """Pack plans and templates must produce the same bytes as packing one signal at a time"""
+    rng = random.Random(0)
+    for dbc_name in ALL_DBCS:
+      with subtests.test(dbc=dbc_name):
+        packer = CANPacker(dbc_name)
+        for msg in DBC(dbc_name).msgs.values():
+          for _ in range(3):
+            sigs = rng.sample(list(msg.sigs.values()), rng.randint(0, len(msg.sigs)))
+            values = {s.name: rng.randint(-(1 << s.size), (1 << s.size) - 1) * s.factor + s.offset for s in sigs}
+            counter = packer.counters.get(msg.address, 0)
+            expected = reference_pack(msg, values, counter)
+            assert packer.pack(msg.address, values) == expected, (msg.name, values)
+
+            template = packer.get_template(msg.name, list(values))
+            packer.counters[msg.address] = counter
+            assert packer.pack_template(template, list(values.values())) == expected, (msg.name, values)
+
+  def test_pack_template_other_packer(self):
+    # templates work with any packer of the same DBC, and are rejected by packers of other DBCs
+    template = CANPacker(TEST_DBC).get_template("CAN_FD_MESSAGE", ["COUNTER"])
+    packer = CANPacker(TEST_DBC)
+    assert packer.pack_template(template, [3]) == packer.pack(245, {"COUNTER": 3})
+
+    other = CANPacker("volvo_v40_2017_pt")
+    assert template.address in other.dbc.addr_to_msg
+    with pytest.raises(ValueError):
+      other.pack_template(template, [3])
+
   def test_packer_counter(self):
     msgs = [("CAN_FD_MESSAGE", 0), ]
     packer = CANPacker(TEST_DBC)
@@ -175,6 +233,238 @@ class TestCanParserPacker:
         for sig in ("STEER_TORQUE", "STEER_TORQUE_REQUEST", "COUNTER", "CHECKSUM"):
           assert parser.vl["STEERING_CONTROL"][sig] == parser.vl[228][sig]
 
+  def test_decode_batch(self):
+    """decode_batch should match update's vl_all and flag the same bad checksums and counters"""
+    dbc_file = "honda_civic_touring_2016_can_generated"
+    msgs = [("STEERING_CONTROL", 0), ("VSA_STATUS", 50)]
+    packer = CANPacker(dbc_file)
+    packer_other_bus = CANPacker(dbc_file)
+    parser = CANParser(dbc_file, msgs, 0)
+
+    can_strings = []
+    for i in range(200):
+      steer = packer.make_can_msg("STEERING_CONTROL", 0, {"STEER_TORQUE": random.randint(-3840, 3840)})
+      brake = packer.make_can_msg("VSA_STATUS", 0, {"USER_BRAKE": random.randrange(100)})
+      other_bus = packer_other_bus.make_can_msg("VSA_STATUS", 1, {"USER_BRAKE": 1})
+      can_strings.append((int(i * 1e7), [steer, brake, other_bus]))
+
+    parser.update(can_strings)
+    batch = parser.decode_batch(frames_to_array(can_strings))
+    for msg in ("STEERING_CONTROL", "VSA_STATUS"):
+      assert batch[msg] is batch[parser.dbc.name_to_msg[msg].address]
+      assert batch[msg].valid.all()
+      assert batch[msg].nanos.tolist() == [int(i * 1e7) for i in range(200)]
+      for sig, vals in parser.vl_all[msg].items():
+        assert batch[msg].vals[sig].tolist() == pytest.approx(vals)
+
+    # corrupt a checksum and skip a counter
+    dat = bytearray(can_strings[10][1][0][1])
+    dat[4] ^= 0x01
+    can_strings[10][1][0] = (can_strings[10][1][0][0], bytes(dat), 0)
+    del can_strings[20][1][0]
+    batch = parser.decode_batch(frames_to_array(can_strings))
+    assert np.flatnonzero(~batch["STEERING_CONTROL"].checksum_valid).tolist() == [10]
+    assert np.flatnonzero(~batch["STEERING_CONTROL"].counter_valid).tolist() == [20]
+    assert batch["VSA_STATUS"].valid.all()
+
+  def test_update_array_packets(self):
+    """update_array and update_packets should give the same result as update for the same frames"""
+    dbc_file = "honda_civic_touring_2016_can_generated"
+    msgs = [("STEERING_CONTROL", 0), ("VSA_STATUS", 50)]
+    packer = CANPacker(dbc_file)
+    parsers = [CANParser(dbc_file, msgs, 0), CANParser(dbc_file, msgs, 0), CANParser(dbc_file, msgs, 0), CANParser(dbc_file, msgs, 0, lazy=True)]
+
+    for i in range(50):
+      frames = [
+        packer.make_can_msg("STEERING_CONTROL", 0, {"STEER_TORQUE": random.randint(-3840, 3840)}),
+        packer.make_can_msg("VSA_STATUS", 0, {"USER_BRAKE": random.randrange(100)}),
+        packer.make_can_msg("VSA_STATUS", 1, {"USER_BRAKE": 1}),
+        (0x123, b"\x00" * 8, 0),
+      ]
+      frames = random.sample(frames, random.randint(0, len(frames)))
+      can_strings = [(int(i * 1e7), frames)]
+
+      # packed CANPacket_t: fd, bus and dlc in byte 0, address << 3 in bytes 1-4, checksum, then the payload
+      buf = bytearray()
+      for address, dat, src in frames:
+        buf += bytes([(src << 1) | (DLC_TO_LEN.index(len(dat)) << 4)]) + (address << 3).to_bytes(4, "little") + b"\x00" + dat
+
+      expected = parsers[0].update(can_strings)
+      assert parsers[1].update_array(frames_to_array(can_strings)) == expected
+      assert parsers[2].update_packets(int(i * 1e7), buf) == expected
+      assert parsers[3].update_packets(int(i * 1e7), bytes(buf)) == expected
+      buf[:] = b"\xff" * len(buf)  # the lazy parser must not keep views into a reused buffer
+
+      for parser in parsers[1:]:
+        assert parser.can_valid == parsers[0].can_valid
+        for msg in ("STEERING_CONTROL", "VSA_STATUS"):
+          assert parser.vl[msg] == parsers[0].vl[msg]
+          assert parser.ts_nanos[msg] == parsers[0].ts_nanos[msg]
+          for sig in parser.vl[msg]:
+            assert parser.vl_all[msg][sig] == parsers[0].vl_all[msg][sig]
+
+  def test_update_array_packets_empty(self):
+    """Empty input to update_packets still counts as an update at its timestamp, an empty array has none"""
+    dbc_file = "honda_civic_touring_2016_can_generated"
+    msgs = [("VSA_STATUS", 100)]
+    packer = CANPacker(dbc_file)
+    parsers = [CANParser(dbc_file, msgs, 0) for _ in range(4)]
+
+    frame = packer.make_can_msg("VSA_STATUS", 0, {})
+    buf = bytes([DLC_TO_LEN.index(len(frame[1])) << 4]) + (frame[0] << 3).to_bytes(4, "little") + b"\x00" + frame[1]
+    parsers[0].update([0, [frame]])
+    parsers[1].update_packets(np.int64(0), buf)
+    parsers[2].update_array(frames_to_array([(0, [frame])]))
+    parsers[3].update([0, [frame]])
+
+    for i in range(1, 100):
+      t = i * 10_000_000
+      parsers[0].update([t, []])
+      assert parsers[1].update_packets(np.int64(t), b"") == set()
+      assert parsers[2].update_array(frames_to_array([(t, [])])) == set()
+      parsers[3].update([])
+
+      assert parsers[1].bus_timeout == parsers[0].bus_timeout
+      assert parsers[2].bus_timeout == parsers[3].bus_timeout is False
+    assert parsers[1].bus_timeout
+
+  def test_parser_group(self):
+    """A CANParserGroup should leave every parser in the same state as updating each one on its own"""
+    dbc_file = "honda_civic_touring_2016_can_generated"
+    packer = CANPacker(dbc_file)
+    configs = [
+      ([("STEERING_CONTROL", 0), ("VSA_STATUS", 50)], 0, False),
+      ([("VSA_STATUS", 50)], 0, True),  # same bus and message as the first parser
+      ([("STEERING_CONTROL", 0)], 1, False),
+      ([("VSA_STATUS", 50)], 2, False),
+    ]
+    parsers = [CANParser(dbc_file, msgs, bus, lazy=lazy) for msgs, bus, lazy in configs]
+    group_parsers = [CANParser(dbc_file, msgs, bus, lazy=lazy) for msgs, bus, lazy in configs]
+    group = CANParserGroup(group_parsers + [None])
+
+    for i in range(200):
+      can_strings = []
+      for j in range(random.randrange(3)):
+        frames = []
+        for bus in range(3):
+          if i < 100 or bus != 2:  # bus 2 goes quiet halfway through
+            frames.append(packer.make_can_msg("STEERING_CONTROL", bus, {"STEER_TORQUE": random.randint(-3840, 3840)}))
+            frames.append(packer.make_can_msg("VSA_STATUS", bus, {"USER_BRAKE": random.randrange(100)}))
+        can_strings.append((int((i * 3 + j) * 1e7), random.sample(frames, random.randint(0, len(frames)))))
+
+      expected = [cp.update(can_strings) for cp in parsers]
+      assert group.update(can_strings) == expected
+      for cp, group_cp in zip(parsers, group_parsers, strict=True):
+        assert group_cp.last_nonempty_nanos == cp.last_nonempty_nanos
+        assert group_cp.bus_timeout == cp.bus_timeout
+        assert group_cp.can_valid == cp.can_valid
+        for addr in cp.message_states:
+          assert group_cp.vl[addr] == cp.vl[addr]
+          assert group_cp.ts_nanos[addr] == cp.ts_nanos[addr]
+
+    # messages added by reading vl are picked up too
+    parsers[2].vl["VSA_STATUS"]
+    group_parsers[2].vl["VSA_STATUS"]
+    can_strings = [(int(1e10), [packer.make_can_msg("VSA_STATUS", 1, {"USER_BRAKE": 42})])]
+    assert group.update(can_strings) == [cp.update(can_strings) for cp in parsers]
+    assert group_parsers[2].vl["VSA_STATUS"]["USER_BRAKE"] == pytest.approx(42)
+
+  def test_history_parser(self):
+    """Parsers with a history should match eager parsers, with vl_all bounded by the history depth"""
+    dbc_file = "honda_civic_touring_2016_can_generated"
+    msgs = [("STEERING_CONTROL", 0), ("VSA_STATUS", 50)]
+    depth = 16
+    packer = CANPacker(dbc_file)
+    parser = CANParser(dbc_file, msgs, 0)
+    history_parser = CANParser(dbc_file, msgs, 0, history=depth)
+
+    all_torques, all_nanos = [], []
+    for i in range(100):
+      can_strings = []
+      for j in range(random.choice([0, 1, 3, depth + 5])):
+        t = int((i * 100 + j) * 1e7)
+        torque = random.randint(-3840, 3840)
+        steer = packer.make_can_msg("STEERING_CONTROL", 0, {"STEER_TORQUE": torque})
+        brake = packer.make_can_msg("VSA_STATUS", 0, {"USER_BRAKE": random.randrange(100)})
+        can_strings.append((t, [steer, brake]))
+        all_torques.append(torque)
+        all_nanos.append(t)
+
+      assert history_parser.update(can_strings) == parser.update(can_strings)
+      assert history_parser.can_valid == parser.can_valid
+      for msg in ("STEERING_CONTROL", "VSA_STATUS"):
+        assert history_parser.vl[msg] == parser.vl[msg]
+        assert history_parser.ts_nanos[msg] == parser.ts_nanos[msg]
+        for sig, vals in history_parser.vl_all[msg].items():
+          assert isinstance(vals, np.ndarray)
+          assert vals.tolist() == parser.vl_all[msg][sig][-depth:]
+
+      history = history_parser.history["STEERING_CONTROL"]
+      assert history is history_parser.history[history_parser.dbc.name_to_msg["STEERING_CONTROL"].address]
+      assert history["STEER_TORQUE"].tolist() == all_torques[-depth:]
+      assert history.nanos.tolist() == all_nanos[-depth:]
+      assert history.vals.shape == (len(history.idxs), min(len(all_nanos), depth))
+
+    with pytest.raises(AssertionError):
+      CANParser(dbc_file, msgs, 0, lazy=True, history=depth)
+
+  def test_lazy_parser(self):
+    """Lazy parsers should give the same vl, vl_all and ts_nanos as eager parsers"""
+    dbc_file = "honda_civic_touring_2016_can_generated"
+    msgs = [("STEERING_CONTROL", 0), ("VSA_STATUS", 50)]
+    packer = CANPacker(dbc_file)
+    parser = CANParser(dbc_file, msgs, 0)
+    lazy_parser = CANParser(dbc_file, msgs, 0, lazy=True)
+
+    for msg in ("STEERING_CONTROL", "VSA_STATUS"):
+      assert lazy_parser.vl[msg] == parser.vl[msg]
+      assert lazy_parser.vl_all[msg]["STEER_TORQUE" if msg == "STEERING_CONTROL" else "USER_BRAKE"] == []
+
+    for i in range(100):
+      can_strings = []
+      for j in range(random.randrange(3)):
+        steer = packer.make_can_msg("STEERING_CONTROL", 0, {"STEER_TORQUE": random.randint(-3840, 3840)})
+        brake = packer.make_can_msg("VSA_STATUS", 0, {"USER_BRAKE": random.randrange(100)})
+        can_strings.append((int((i * 3 + j) * 1e7), random.sample([steer, brake], random.randint(0, 2))))
+      if i == 50:
+        # bad checksum, must not update either parser
+        dat = bytearray(can_strings[0][1][0][1]) if can_strings and can_strings[0][1] else None
+        if dat is not None:
+          dat[-1] ^= 0x1
+          can_strings[0][1][0] = (can_strings[0][1][0][0], bytes(dat), 0)
+
+      assert lazy_parser.update(can_strings) == parser.update(can_strings)
+      for msg in ("STEERING_CONTROL", "VSA_STATUS"):
+        # check a single signal before the whole dict to exercise the memoization
+        assert lazy_parser.vl[msg]["COUNTER"] == parser.vl[msg]["COUNTER"]
+        assert lazy_parser.vl[msg] == parser.vl[msg]
+        assert lazy_parser.ts_nanos[msg] == parser.ts_nanos[msg]
+        for sig, vals in parser.vl_all[msg].items():
+          assert lazy_parser.vl_all[msg][sig] == vals
+      assert lazy_parser.can_valid == parser.can_valid
+
+  def test_lazy_parser_copies(self):
+    """Copies of a lazy parser's dicts should see the latest values, however they're made"""
+    dbc_file = "honda_civic_touring_2016_can_generated"
+    packer = CANPacker(dbc_file)
+    parser = CANParser(dbc_file, [("STEERING_CONTROL", 0)], 0, lazy=True)
+
+    for t, torque in enumerate((100, 200)):
+      parser.update([(t, [packer.make_can_msg("STEERING_CONTROL", 0, {"STEER_TORQUE": torque})])])
+      if torque == 100:
+        assert parser.vl["STEERING_CONTROL"]["STEER_TORQUE"] == 100
+
+    vl = parser.vl["STEERING_CONTROL"]
+    updated = {}
+    updated.update(vl)
+    for copied in (dict(vl), {**vl}, updated, vl.copy(), copy.copy(vl), pickle.loads(pickle.dumps(vl))):
+      assert type(copied) is dict
+      assert copied["STEER_TORQUE"] == 200
+      assert copied == vl
+    assert list(vl) == list(vl.keys()) == list(dict(vl))
+    with pytest.raises(KeyError):
+      vl["NOT_A_SIGNAL"]
+
   def test_scale_offset(self):
     """Test that both scale and offset are correctly preserved"""
     dbc_file = "honda_civic_touring_2016_can_generated"
@@ -1,11 +1,15 @@
 import os
 import time
+from collections.abc import Iterator, Mapping
+from functools import cache
 
 from opendbc.car import gen_empty_fingerprint
 from opendbc.car.can_definitions import CanRecvCallable, CanSendCallable
 from opendbc.car.carlog import carlog
 from opendbc.car.structs import CarParams, CarParamsT
-from opendbc.car.fingerprints import eliminate_incompatible_cars, all_legacy_fingerprint_cars
+from opendbc.car.fingerprints import get_fingerprint_index
+from opendbc.car.ecu_latency import EcuLatencyModel
+from opendbc.car.interfaces import CarInterfaceBase
 from opendbc.car.fw_versions import ObdCallback, get_fw_versions_ordered, get_present_ecus, match_fw_to_car
 from opendbc.car.mock.values import CAR as MOCK
 from opendbc.car.values import BRANDS
@@ -16,16 +20,36 @@ from opendbc.sunnypilot.car.interfaces import setup_interfaces as sunnypilot_int
 FRAME_FINGERPRINT = 100  # 1s
 
 
+@cache
+def load_interface(brand_name: str) -> type[CarInterfaceBase]:
+  # imports the brand's interface, which imports its carstate and carcontroller
+  return __import__(f'opendbc.car.{brand_name}.interface', fromlist=['CarInterface']).CarInterface
+
+
 def load_interfaces(brand_names):
   ret = {}
   for brand_name in brand_names:
-    path = f'opendbc.car.{brand_name}'
-    CarInterface = __import__(path + '.interface', fromlist=['CarInterface']).CarInterface
+    CarInterface = load_interface(brand_name)
     for model_name in brand_names[brand_name]:
       ret[model_name] = CarInterface
   return ret
 
 
+class LazyInterfaces(Mapping[str, type[CarInterfaceBase]]):
+  """Platform -> CarInterface like load_interfaces, importing a brand's modules the first time one of its platforms is looked up"""
+  def __init__(self, brand_names: dict[str, list[str]]):
+    self.platform_brands = {model_name: brand_name for brand_name, model_names in brand_names.items() for model_name in model_names}
+
+  def __getitem__(self, platform: str) -> type[CarInterfaceBase]:
+    return load_interface(self.platform_brands[platform])
+
+  def __iter__(self) -> Iterator[str]:
+    return iter(self.platform_brands)
+
+  def __len__(self) -> int:
+    return len(self.platform_brands)
+
+
 def _get_interface_names() -> dict[str, list[str]]:
   # returns a dict of brand name and its respective models
   brand_names = {}
@@ -38,12 +62,13 @@ def _get_interface_names() -> dict[str, list[str]]:
 
 # imports from directory opendbc/car/<name>/
 interface_names = _get_interface_names()
-interfaces = load_interfaces(interface_names)
+interfaces = LazyInterfaces(interface_names)
 
 
 def can_fingerprint(can_recv: CanRecvCallable) -> tuple[str | None, dict[int, dict]]:
   finger = gen_empty_fingerprint()
-  candidate_cars = {i: all_legacy_fingerprint_cars() for i in [0, 1]}  # attempt fingerprint on both bus 0 and 1
+  index = get_fingerprint_index()
+  candidate_cars = {i: index.all_mask for i in [0, 1]}  # attempt fingerprint on both bus 0 and 1, as bitmasks of index.cars
   frame = 0
   car_fingerprint = None
   done = False
@@ -63,17 +88,18 @@ def can_fingerprint(can_recv: CanRecvCallable) -> tuple[str | None, dict[int, di
         for b in candidate_cars:
           # Ignore extended messages and VIN query response.
           if can.src == b and can.address < 0x800 and can.address not in (0x7df, 0x7e0, 0x7e8):
-            candidate_cars[b] = eliminate_incompatible_cars(can, candidate_cars[b])
+            candidate_cars[b] &= index.compatible_mask(can.address, len(can.dat))
 
       # if we only have one car choice and the time since we got our first
       # message has elapsed, exit
       for b in candidate_cars:
-        if len(candidate_cars[b]) == 1 and frame > FRAME_FINGERPRINT:
+        mask = candidate_cars[b]
+        if mask and not mask & (mask - 1) and frame > FRAME_FINGERPRINT:
           # fingerprint done
-          car_fingerprint = candidate_cars[b][0]
+          car_fingerprint = index.cars[mask.bit_length() - 1]
 
       # bail if no cars left or we've been waiting for more than 2s
-      failed = (all(len(cc) == 0 for cc in candidate_cars.values()) and frame > FRAME_FINGERPRINT) or frame > 200
+      failed = (not any(candidate_cars.values()) and frame > FRAME_FINGERPRINT) or frame > 200
       succeeded = car_fingerprint is not None
       done = failed or succeeded
 
@@ -84,8 +110,9 @@ def can_fingerprint(can_recv: CanRecvCallable) -> tuple[str | None, dict[int, di
 
 # **** for use live only ****
 def fingerprint(can_recv: CanRecvCallable, can_send: CanSendCallable, set_obd_multiplexing: ObdCallback, num_pandas: int,
-                cached_params: CarParamsT | None,
-                fixed_fingerprint: str | None) -> tuple[str | None, dict, str, list[CarParams.CarFw], CarParams.FingerprintSource, bool]:
+                cached_params: CarParamsT | None, fixed_fingerprint: str | None,
+                latency_model: EcuLatencyModel | None = None,
+                stop_on_exact_match: bool = False) -> tuple[str | None, dict, str, list[CarParams.CarFw], CarParams.FingerprintSource, bool]:
   fixed_fingerprint = fixed_fingerprint or os.environ.get('FINGERPRINT', "")
   skip_fw_query = os.environ.get('SKIP_FW_QUERY', False)
   disable_fw_cache = os.environ.get('DISABLE_FW_CACHE', False)
@@ -106,8 +133,13 @@ def fingerprint(can_recv: CanRecvCallable, can_send: CanSendCallable, set_obd_mu
       set_obd_multiplexing(True)
       # VIN query only reliably works through OBDII
       vin_rx_addr, vin_rx_bus, vin = get_vin(can_recv, can_send, (0, 1))
-      ecu_rx_addrs = get_present_ecus(can_recv, can_send, set_obd_multiplexing, num_pandas=num_pandas)
-      car_fw = get_fw_versions_ordered(can_recv, can_send, set_obd_multiplexing, vin, ecu_rx_addrs, num_pandas=num_pandas)
+      # response latencies learned on a previous start only apply to the same car
+      if latency_model is not None:
+        latency_model = latency_model.for_vin(vin)
+      ecu_rx_addrs = get_present_ecus(can_recv, can_send, set_obd_multiplexing, num_pandas=num_pandas, latency_model=latency_model)
+      # stop_on_exact_match shortens the query once the match is certain, but leaves the skipped ECUs' FW versions out of carFw
+      car_fw = get_fw_versions_ordered(can_recv, can_send, set_obd_multiplexing, vin, ecu_rx_addrs, num_pandas=num_pandas,
+                                       latency_model=latency_model, stop_on_exact_match=stop_on_exact_match)
       cached = False
 
     exact_fw_match, fw_candidates = match_fw_to_car(car_fw, vin)
@@ -153,9 +185,10 @@ def fingerprint(can_recv: CanRecvCallable, can_send: CanSendCallable, set_obd_mu
 
 def get_car(can_recv: CanRecvCallable, can_send: CanSendCallable, set_obd_multiplexing: ObdCallback, alpha_long_allowed: bool,
             is_release: bool, num_pandas: int = 1, cached_params: CarParamsT | None = None,
-            fixed_fingerprint: str | None = None, init_params_list_sp: list[dict[str, str]] = None):
+            fixed_fingerprint: str | None = None, init_params_list_sp: list[dict[str, str]] = None,
+            latency_model: EcuLatencyModel | None = None, stop_on_exact_match: bool = False):
   candidate, fingerprints, vin, car_fw, source, exact_match = fingerprint(can_recv, can_send, set_obd_multiplexing, num_pandas, cached_params,
-                                                                          fixed_fingerprint)
+                                                                          fixed_fingerprint, latency_model, stop_on_exact_match)
 
   if candidate is None:
     carlog.error({"event": "car doesn't match any fingerprints", "fingerprints": repr(fingerprints)})
@@ -5,6 +5,9 @@ from opendbc.car.can_definitions import CanData, CanRecvCallable, CanSendCallabl
 from opendbc.car.carlog import carlog
 from opendbc.car.fw_query_definitions import EcuAddrBusType
 
+# Sub-addressed ECUs share a gateway, which gets their tester present probes one at a time this far apart
+SUB_ADDR_PROBE_SPACING = 0.01
+
 
 def _is_tester_present_response(msg: CanData, subaddr: int = None) -> bool:
   # ISO-TP messages may use CAN frame optimization (not always 8 bytes)
@@ -28,16 +31,37 @@ def get_all_ecu_addrs(can_recv: CanRecvCallable, can_send: CanSendCallable, bus:
   return get_ecu_addrs(can_recv, can_send, queries, responses, timeout=timeout)
 
 
-def get_ecu_addrs(can_recv: CanRecvCallable, can_send: CanSendCallable, queries: set[EcuAddrBusType],
-                  responses: set[EcuAddrBusType], timeout: float = 1) -> set[EcuAddrBusType]:
+def get_ecu_addrs(can_recv: CanRecvCallable, can_send: CanSendCallable, queries: set[EcuAddrBusType], responses: set[EcuAddrBusType],
+                  timeout: float = 1, response_times: dict[EcuAddrBusType, float] = None,
+                  query_responses: dict[EcuAddrBusType, set[EcuAddrBusType]] = None) -> set[EcuAddrBusType]:
+  """Finds the ECUs responding to tester present. If given, response_times is filled with the time of each ECU's last response,
+  so an ECU that first replies response pending is timed by its final response.
+  Sub-addressed queries go out SUB_ADDR_PROBE_SPACING apart, each waiting timeout from its own send. If query_responses maps
+  each query to the responses it can get, the scan ends as soon as every query got one of them"""
   ecu_responses: set[EcuAddrBusType] = set()  # set((addr, subaddr, bus),)
   try:
-    msgs = [make_tester_present_msg(addr, bus, subaddr) for addr, subaddr, bus in queries]
+    parallel_queries = [q for q in queries if q[1] is None]
+    sub_addr_queries = sorted(q for q in queries if q[1] is not None)
+    pending = set(queries) if query_responses is not None else None
+
+    # send times by (subaddr, bus), to time responses from their own probe
+    sent_times: dict[tuple[int | None, int], float] = {}
+
+    def send(query: list[EcuAddrBusType]) -> None:
+      can_send([make_tester_present_msg(addr, bus, subaddr) for addr, subaddr, bus in query])
+      for _, subaddr, bus in query:
+        sent_times[(subaddr, bus)] = time.monotonic()
 
     can_recv()
-    can_send(msgs)
+    send(parallel_queries + sub_addr_queries[:1])
     start_time = time.monotonic()
-    while time.monotonic() - start_time < timeout:
+    end_time = start_time + max(len(sub_addr_queries) - 1, 0) * SUB_ADDR_PROBE_SPACING + timeout
+    sub_addr_idx = 1
+    while time.monotonic() < end_time and (pending is None or len(pending)):
+      while sub_addr_idx < len(sub_addr_queries) and time.monotonic() - start_time >= sub_addr_idx * SUB_ADDR_PROBE_SPACING:
+        send([sub_addr_queries[sub_addr_idx]])
+        sub_addr_idx += 1
+
       can_packets = can_recv(wait_for_one=True)
       for packet in can_packets:
         for msg in packet:
@@ -50,7 +74,11 @@ def get_ecu_addrs(can_recv: CanRecvCallable, can_send: CanSendCallable, queries:
             carlog.debug(f"CAN-RX: {hex(msg.address)} - 0x{bytes.hex(msg.dat)}")
             if (msg.address, subaddr, msg.src) in ecu_responses:
               carlog.debug(f"Duplicate ECU address: {hex(msg.address)}")
+            if response_times is not None:
+              response_times[(msg.address, subaddr, msg.src)] = time.monotonic() - sent_times.get((subaddr, msg.src), start_time)
             ecu_responses.add((msg.address, subaddr, msg.src))
+            if pending is not None:
+              pending = {q for q in pending if (msg.address, subaddr, msg.src) not in query_responses[q]}
   except Exception:
     carlog.exception("ECU addr scan exception")
   return ecu_responses
@@ -0,0 +1,90 @@
+"""
+Per-ECU response latencies learned from previous FW and present ECU queries.
+
+Cold starts query every ECU any brand could have, each with the full timeout. With a model from a previous start of the
+same car, ECUs that answered get a deadline close to their slowest seen response, and ECUs that never answer are mostly skipped.
+The model is only valid for the car it was learned on: callers persist it next to the cached CarParams with to_json,
+and EcuLatencyModel.for_vin starts over when the VIN changes. Without a readable VIN there's no telling which car it is,
+so no model is used.
+"""
+import json
+from dataclasses import dataclass, field
+
+from opendbc.car.vin import VIN_UNKNOWN, is_valid_vin
+
+# (bus, tx_addr, sub_addr, request), where request is every step of the request joined
+LatencyKey = tuple[int, int, int | None, bytes]
+
+# An ECU that never responded to this many queries is assumed absent, and its queries are skipped.
+# ECUs that responded before are always queried: a miss is a dropped request, and gets the full timeout next time
+ABSENT_AFTER_MISSES = 2
+# An absent ECU is still queried instead of skipped every this many times, about once per this many starts,
+# in case it was asleep or has been installed since
+REPROBE_ABSENT_EVERY = 10
+# Deadline for an ECU that responded before: its slowest response times LATENCY_MARGIN plus LATENCY_SLACK.
+# The queries ask ECUs that miss it again with the full timeout, so a slow response costs time but is never dropped
+LATENCY_MARGIN = 2.
+LATENCY_SLACK = 0.01
+
+
+@dataclass
+class EcuLatency:
+  latency: float | None = None  # slowest response seen, None if it never responded
+  misses: int = 0  # queries without a response since the last one
+  skips: int = 0  # queries skipped since the last one, while assumed absent
+
+
+@dataclass
+class EcuLatencyModel:
+  vin: str = ''
+  ecus: dict[LatencyKey, EcuLatency] = field(default_factory=dict)
+
+  def for_vin(self, vin: str) -> 'EcuLatencyModel | None':
+    """Forgets everything learned on another car. None if the VIN is unknown or malformed, and the model is left as is"""
+    if vin == VIN_UNKNOWN or not is_valid_vin(vin):
+      return None
+    if vin != self.vin:
+      self.vin = vin
+      self.ecus = {}
+    return self
+
+  def skip_query(self, key: LatencyKey) -> bool:
+    """True if the ECU is assumed absent and this query is skipped. Every REPROBE_ABSENT_EVERY-th query is sent anyway"""
+    ecu = self.ecus.get(key)
+    if ecu is None or ecu.latency is not None or ecu.misses < ABSENT_AFTER_MISSES:
+      return False
+    ecu.skips += 1
+    if ecu.skips >= REPROBE_ABSENT_EVERY:
+      ecu.skips = 0
+      return False
+    return True
+
+  def timeout(self, key: LatencyKey, timeout: float) -> float:
+    """Deadline for the ECU to respond, timeout if it never did or missed its last query"""
+    ecu = self.ecus.get(key)
+    if ecu is None or ecu.latency is None or ecu.misses > 0:
+      return timeout
+    return min(timeout, ecu.latency * LATENCY_MARGIN + LATENCY_SLACK)
+
+  def record(self, key: LatencyKey, latency: float | None) -> None:
+    """Records a response after latency seconds, or no response if latency is None"""
+    ecu = self.ecus.setdefault(key, EcuLatency())
+    ecu.skips = 0
+    if latency is None:
+      ecu.misses += 1
+    else:
+      ecu.misses = 0
+      ecu.latency = latency if ecu.latency is None else max(ecu.latency, latency)
+
+  def to_json(self) -> str:
+    return json.dumps({
+      'vin': self.vin,
+      'ecus': [[bus, addr, sub_addr, request.hex(), ecu.latency, ecu.misses, ecu.skips] for (bus, addr, sub_addr, request), ecu in self.ecus.items()],
+    })
+
+  @classmethod
+  def from_json(cls, dat: str | bytes) -> 'EcuLatencyModel':
+    model = json.loads(dat)
+    ecus = {(bus, addr, sub_addr, bytes.fromhex(request)): EcuLatency(latency, misses, skips)
+            for bus, addr, sub_addr, request, latency, misses, skips in model['ecus']}
+    return cls(model['vin'], ecus)
@@ -1,3 +1,5 @@
+from functools import cache
+
 from opendbc.car.interfaces import get_interface_attr
 from opendbc.car.body.values import CAR as BODY
 from opendbc.car.chrysler.values import CAR as CHRYSLER
@@ -24,6 +26,40 @@ def is_valid_for_fingerprint(msg, car_fingerprint: dict[int, int]):
   return (adr in car_fingerprint and car_fingerprint[adr] == len(msg.dat)) or adr >= 0x800
 
 
+class FingerprintIndex:
+  """
+  Candidate cars as bits of an int, and per (address, length) the mask of cars with a fingerprint
+  containing it, so eliminating the cars that could not have sent a frame is one lookup and one AND.
+  """
+  def __init__(self, fingerprints: dict[str, list[dict[int, int]]]):
+    self.cars: tuple[str, ...] = tuple(fingerprints)
+    self.all_mask = (1 << len(self.cars)) - 1
+    self.car_bits = {car: 1 << i for i, car in enumerate(self.cars)}
+
+    masks: dict[tuple[int, int], int] = {}
+    for car, car_fingerprints in fingerprints.items():
+      bit = self.car_bits[car]
+      for fingerprint in car_fingerprints:
+        # add alien debug address
+        for key in (fingerprint | _DEBUG_ADDRESS).items():
+          masks[key] = masks.get(key, 0) | bit
+    self.masks = masks
+
+  def compatible_mask(self, address: int, length: int) -> int:
+    # ignore addresses that are more than 11 bits
+    if address >= 0x800:
+      return self.all_mask
+    return self.masks.get((address, length), 0)
+
+  def to_cars(self, mask: int) -> list[str]:
+    return [car for i, car in enumerate(self.cars) if mask >> i & 1]
+
+
+@cache
+def get_fingerprint_index() -> FingerprintIndex:
+  return FingerprintIndex(_FINGERPRINTS)
+
+
 def eliminate_incompatible_cars(msg, candidate_cars):
   """Removes cars that could not have sent msg.
 
@@ -34,18 +70,9 @@ def eliminate_incompatible_cars(msg, candidate_cars):
      Returns:
       A list containing the subset of candidate_cars that could have sent msg.
   """
-  compatible_cars = []
-
-  for car_name in candidate_cars:
-    car_fingerprints = _FINGERPRINTS[car_name]
-
-    for fingerprint in car_fingerprints:
-      # add alien debug address
-      if is_valid_for_fingerprint(msg, fingerprint | _DEBUG_ADDRESS):
-        compatible_cars.append(car_name)
-        break
-
-  return compatible_cars
+  index = get_fingerprint_index()
+  mask = index.compatible_mask(msg.address, len(msg.dat))
+  return [car_name for car_name in candidate_cars if index.car_bits[car_name] & mask]
 
 
 def all_legacy_fingerprint_cars():
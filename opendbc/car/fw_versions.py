@@ -1,5 +1,7 @@
 from collections import defaultdict
 from collections.abc import Callable, Iterator
+from dataclasses import dataclass, field
+from functools import cache
 from typing import Protocol, TypeVar
 
 from tqdm import tqdm
@@ -9,13 +11,17 @@ from opendbc.car.can_definitions import CanRecvCallable, CanSendCallable
 from opendbc.car.carlog import carlog
 from opendbc.car.structs import CarParams
 from opendbc.car.ecu_addrs import get_ecu_addrs
+from opendbc.car.ecu_latency import EcuLatencyModel, LatencyKey
 from opendbc.car.fingerprints import FW_VERSIONS
-from opendbc.car.fw_query_definitions import ESSENTIAL_ECUS, AddrType, EcuAddrBusType, FwQueryConfig, LiveFwVersions, OfflineFwVersions
+from opendbc.car.fw_query_definitions import ESSENTIAL_ECUS, AddrType, EcuAddrBusType, EcuAddrSubAddr, FwQueryConfig, LiveFwVersions, OfflineFwVersions, \
+                                              Request, StdQueries
 from opendbc.car.interfaces import get_interface_attr
 from opendbc.car.isotp_parallel_query import IsoTpParallelQuery
 
 Ecu = CarParams.Ecu
 FUZZY_EXCLUDE_ECUS = [Ecu.fwdCamera, Ecu.fwdRadar, Ecu.eps, Ecu.debug]
+# The 10Hz blocking params loop in pandad adds on average 50ms for each OBD multiplexing change
+OBD_MULTIPLEXING_TOGGLE_TIME = 0.05
 
 FW_QUERY_CONFIGS: dict[str, FwQueryConfig] = get_interface_attr('FW_QUERY_CONFIG', ignore_none=True)
 VERSIONS = get_interface_attr('FW_VERSIONS', ignore_none=True)
@@ -51,29 +57,138 @@ class MatchFwToCar(Protocol):
     ...
 
 
+class FwVersionIndex:
+  """
+  Inverted index over the FW versions of one brand (or all brands), for the exact and fuzzy matchers.
+  Candidate sets are int bitmasks over self.candidates, so exact matching is a few ANDs per ECU
+  instead of a scan over every candidate. Built once per brand by get_fw_version_index, treat it as read-only.
+  """
+  def __init__(self, fw_versions: OfflineFwVersions, extra_fw_versions: dict | None = None):
+    self.candidates: tuple[str, ...] = tuple(fw_versions)
+    self.all_mask = (1 << len(self.candidates)) - 1
+
+    # (ecu_type, addr, sub_addr) -> version -> candidates with that version
+    self.version_masks: dict[EcuAddrSubAddr, dict[bytes, int]] = defaultdict(dict)
+    # (ecu_type, addr, sub_addr) -> candidates that list the ECU, which must match if it responds
+    self.listed_masks: dict[EcuAddrSubAddr, int] = defaultdict(int)
+    # (ecu_type, addr, sub_addr) -> candidates that can't be matched if the ECU doesn't respond
+    self.essential_masks: dict[EcuAddrSubAddr, int] = defaultdict(int)
+    # (addr, sub_addr, version) -> candidates, skipping FUZZY_EXCLUDE_ECUS
+    self.fuzzy_candidates: dict[tuple[int, int | None, bytes], list[str]] = defaultdict(list)
+    # (addr, sub_addr) -> ECUs in listed_masks on the address
+    self.addr_ecus: dict[AddrType, list[EcuAddrSubAddr]] = defaultdict(list)
+
+    extra_fw_versions = extra_fw_versions or {}
+    for i, (candidate, fw_by_addr) in enumerate(fw_versions.items()):
+      bit = 1 << i
+      config = FW_QUERY_CONFIGS[MODEL_TO_BRAND[candidate]]
+      for ecu, fws in fw_by_addr.items():
+        ecu_type = ecu[0]
+
+        # These ECUs are known to be shared between models (EPS only between hybrid/ICE version)
+        # Getting this exactly right isn't crucial, but excluding camera and radar makes it almost
+        # impossible to get 3 matching versions, even if two models with shared parts are released at the same
+        # time and only one is in our database.
+        if ecu_type not in FUZZY_EXCLUDE_ECUS:
+          for f in fws:
+            self.fuzzy_candidates[(ecu[1], ecu[2], f)].append(candidate)
+
+        # Virtual debug ecu doesn't need to match the database
+        if ecu_type == Ecu.debug:
+          continue
+
+        if ecu not in self.listed_masks:
+          self.addr_ecus[ecu[1:]].append(ecu)
+        self.listed_masks[ecu] |= bit
+        # Some models can sometimes miss an ecu, or show on two different addresses
+        # FIXME: this logic can be improved to be more specific, should require one of the two addresses
+        if ecu_type in ESSENTIAL_ECUS and candidate not in config.non_essential_ecus.get(ecu_type, []):
+          self.essential_masks[ecu] |= bit
+
+        version_masks = self.version_masks[ecu]
+        for f in fws + extra_fw_versions.get(candidate, {}).get(ecu, []):
+          version_masks[f] = version_masks.get(f, 0) | bit
+
+    self.version_masks = dict(self.version_masks)
+    self.listed_masks = dict(self.listed_masks)
+    self.essential_masks = dict(self.essential_masks)
+    self.fuzzy_candidates = dict(self.fuzzy_candidates)
+    self.addr_ecus = dict(self.addr_ecus)
+
+  def ecu_valid_mask(self, ecu: EcuAddrSubAddr, found_versions: set[bytes] | None) -> int:
+    """Candidates the responses of one ECU are compatible with"""
+    if not found_versions:
+      return ~self.essential_masks.get(ecu, 0)
+    version_masks = self.version_masks[ecu]
+    matched = 0
+    for found_version in found_versions:
+      matched |= version_masks.get(found_version, 0)
+    # candidates that list this ECU need one of the responses to match
+    return matched | ~self.listed_masks[ecu]
+
+  def match_exact(self, live_fw_versions: LiveFwVersions) -> set[str]:
+    valid = self.all_mask
+    for ecu in self.listed_masks:
+      valid &= self.ecu_valid_mask(ecu, live_fw_versions.get(ecu[1:]))
+      if not valid:
+        return set()
+
+    return {candidate for i, candidate in enumerate(self.candidates) if valid >> i & 1}
+
+
+class ExactFwMatcher:
+  """
+  Exact match of FwVersionIndex.match_exact, narrowed as FW versions arrive during the query.
+  Addresses are pending until their last query is done. A pending ECU that responded can only match more candidates
+  with more responses, and one that didn't can at worst drop every candidate listing it, which bounds the final match.
+  Once both bounds are the same single candidate, no pending response can change it.
+  """
+  def __init__(self, index: FwVersionIndex, pending: set[AddrType]):
+    self.index = index
+    self.pending = set(pending)
+    self.live_fw_versions: dict[AddrType, set[bytes]] = defaultdict(set)
+    # candidates compatible with every ECU that is done
+    self.done_valid = index.all_mask
+    for addr, ecus in index.addr_ecus.items():
+      if addr not in self.pending:
+        for ecu in ecus:
+          self.done_valid &= index.ecu_valid_mask(ecu, None)
+    self.match: str | None = None
+
+  def update(self, addr: AddrType, version: bytes) -> None:
+    self.live_fw_versions[addr].add(version)
+
+  def finish(self, addrs: set[AddrType]) -> str | None:
+    """Marks addrs done, returns the exact match once it's certain"""
+    for addr in addrs & self.pending:
+      self.pending.discard(addr)
+      for ecu in self.index.addr_ecus.get(addr, []):
+        self.done_valid &= self.index.ecu_valid_mask(ecu, self.live_fw_versions.get(addr))
+
+    lower, upper = self.done_valid, self.done_valid
+    for addr in self.pending:
+      found_versions = self.live_fw_versions.get(addr)
+      for ecu in self.index.addr_ecus.get(addr, []):
+        lower &= self.index.ecu_valid_mask(ecu, found_versions) if found_versions else ~self.index.listed_masks[ecu]
+
+    # a single candidate, that stays valid whatever the pending ECUs respond
+    if upper and not upper & (upper - 1) and lower == upper:
+      self.match = self.index.candidates[upper.bit_length() - 1]
+    return self.match
+
+
+@cache
+def get_fw_version_index(brand: str | None) -> FwVersionIndex:
+  return FwVersionIndex({c: f for c, f in FW_VERSIONS.items() if is_brand(MODEL_TO_BRAND[c], brand)})
+
+
 def match_fw_to_car_fuzzy(live_fw_versions: LiveFwVersions, match_brand: str = None, log: bool = True, exclude: str = None) -> set[str]:
   """Do a fuzzy FW match. This function will return a match, and the number of firmware version
   that were matched uniquely to that specific car. If multiple ECUs uniquely match to different cars
   the match is rejected."""
 
-  # Build lookup table from (addr, sub_addr, fw) to list of candidate cars
-  all_fw_versions = defaultdict(list)
-  for candidate, fw_by_addr in FW_VERSIONS.items():
-    if not is_brand(MODEL_TO_BRAND[candidate], match_brand):
-      continue
-
-    if candidate == exclude:
-      continue
-
-    for addr, fws in fw_by_addr.items():
-      # These ECUs are known to be shared between models (EPS only between hybrid/ICE version)
-      # Getting this exactly right isn't crucial, but excluding camera and radar makes it almost
-      # impossible to get 3 matching versions, even if two models with shared parts are released at the same
-      # time and only one is in our database.
-      if addr[0] in FUZZY_EXCLUDE_ECUS:
-        continue
-      for f in fws:
-        all_fw_versions[(addr[1], addr[2], f)].append(candidate)
+  # Lookup table from (addr, sub_addr, fw) to list of candidate cars
+  all_fw_versions = get_fw_version_index(match_brand).fuzzy_candidates
 
   matched_ecus = set()
   match: str | None = None
@@ -81,7 +196,9 @@ def match_fw_to_car_fuzzy(live_fw_versions: LiveFwVersions, match_brand: str = N
     ecu_key = (addr[0], addr[1])
     for version in versions:
       # All cars that have this FW response on the specified address
-      candidates = all_fw_versions[(*ecu_key, version)]
+      candidates = all_fw_versions.get((*ecu_key, version), [])
+      if exclude is not None:
+        candidates = [c for c in candidates if c != exclude]
 
       if len(candidates) == 1:
         matched_ecus.add(ecu_key)
@@ -106,40 +223,11 @@ def match_fw_to_car_exact(live_fw_versions: LiveFwVersions, match_brand: str = N
   FW versions for a list of "essential" ECUs. If an ECU is not considered
   essential the FW version can be missing to get a fingerprint, but if it's present it
   needs to match the database."""
-  if extra_fw_versions is None:
-    extra_fw_versions = {}
-
-  invalid = set()
-  candidates = {c: f for c, f in FW_VERSIONS.items() if
-                is_brand(MODEL_TO_BRAND[c], match_brand)}
-
-  for candidate, fws in candidates.items():
-    config = FW_QUERY_CONFIGS[MODEL_TO_BRAND[candidate]]
-    for ecu, expected_versions in fws.items():
-      expected_versions = expected_versions + extra_fw_versions.get(candidate, {}).get(ecu, [])
-      ecu_type = ecu[0]
-      addr = ecu[1:]
-
-      found_versions = live_fw_versions.get(addr, set())
-      if not len(found_versions):
-        # Some models can sometimes miss an ecu, or show on two different addresses
-        # FIXME: this logic can be improved to be more specific, should require one of the two addresses
-        if candidate in config.non_essential_ecus.get(ecu_type, []):
-          continue
-
-        # Ignore non essential ecus
-        if ecu_type not in ESSENTIAL_ECUS:
-          continue
-
-      # Virtual debug ecu doesn't need to match the database
-      if ecu_type == Ecu.debug:
-        continue
-
-      if not any(found_version in expected_versions for found_version in found_versions):
-        invalid.add(candidate)
-        break
-
-  return set(candidates.keys()) - invalid
+  if extra_fw_versions:
+    index = FwVersionIndex({c: f for c, f in FW_VERSIONS.items() if is_brand(MODEL_TO_BRAND[c], match_brand)}, extra_fw_versions)
+  else:
+    index = get_fw_version_index(match_brand)
+  return index.match_exact(live_fw_versions)
 
 
 def match_fw_to_car(fw_versions: list[CarParams.CarFw], vin: str, allow_exact: bool = True,
@@ -169,11 +257,12 @@ def match_fw_to_car(fw_versions: list[CarParams.CarFw], vin: str, allow_exact: b
   return True, set()
 
 
-def get_present_ecus(can_recv: CanRecvCallable, can_send: CanSendCallable, set_obd_multiplexing: ObdCallback, num_pandas: int = 1) -> set[EcuAddrBusType]:
-  # queries are split by OBD multiplexing mode
-  queries: dict[bool, list[list[EcuAddrBusType]]] = {True: [], False: []}
-  parallel_queries: dict[bool, list[EcuAddrBusType]] = {True: [], False: []}
+def get_present_ecus(can_recv: CanRecvCallable, can_send: CanSendCallable, set_obd_multiplexing: ObdCallback, num_pandas: int = 1,
+                     latency_model: EcuLatencyModel = None) -> set[EcuAddrBusType]:
+  # queries are split by OBD multiplexing mode, None for the buses it doesn't switch
+  queries: dict[bool | None, list[EcuAddrBusType]] = {True: [], False: [], None: []}
   responses: set[EcuAddrBusType] = set()
+  query_responses: dict[EcuAddrBusType, set[EcuAddrBusType]] = defaultdict(set)
 
   for brand, config, r in REQUESTS:
     # Skip query if no panda available
@@ -184,26 +273,54 @@ def get_present_ecus(can_recv: CanRecvCallable, can_send: CanSendCallable, set_o
       # Only query ecus in whitelist if whitelist is not empty
       if len(r.whitelist_ecus) == 0 or ecu_type in r.whitelist_ecus:
         a = (addr, sub_addr, r.bus)
-        # Build set of queries
-        if sub_addr is None:
-          if a not in parallel_queries[r.obd_multiplexing]:
-            parallel_queries[r.obd_multiplexing].append(a)
-        else:  # subaddresses must be queried one by one
-          if [a] not in queries[r.obd_multiplexing]:
-            queries[r.obd_multiplexing].append([a])
+        # Build set of queries, every bus and sub-address of a mode is probed in the same window
+        obd_multiplexing = r.obd_multiplexing if r.bus % 4 == 1 else None
+        if a not in queries[obd_multiplexing]:
+          queries[obd_multiplexing].append(a)
 
         # Build set of expected responses to filter
         response_addr = uds.get_rx_addr_for_tx_addr(addr, r.rx_offset)
         responses.add((response_addr, sub_addr, r.bus))
+        query_responses[a].add((response_addr, sub_addr, r.bus))
+
+  def latency_key(a: EcuAddrBusType) -> LatencyKey:
+    return a[2], a[0], a[1], StdQueries.TESTER_PRESENT_REQUEST
 
-  for obd_multiplexing in queries:
-    queries[obd_multiplexing].insert(0, parallel_queries[obd_multiplexing])
+  if latency_model is not None:
+    # Skip ECUs that never respond to this car
+    queries = {obd_multiplexing: [a for a in query if not latency_model.skip_query(latency_key(a))] for obd_multiplexing, query in queries.items()}
+
+  # Buses OBD multiplexing doesn't switch are probed along with the first mode that is queried
+  first_obd_multiplexing = len(queries[True]) > 0 or len(queries[False]) == 0
+  queries[first_obd_multiplexing] += queries.pop(None)
 
   ecu_responses = set()
-  for obd_multiplexing in queries:
-    set_obd_multiplexing(obd_multiplexing)
-    for query in queries[obd_multiplexing]:
-      ecu_responses.update(get_ecu_addrs(can_recv, can_send, set(query), responses, timeout=0.1))
+  for obd_multiplexing, query in queries.items():
+    if not len(query):
+      continue
+
+    if any(bus % 4 == 1 for _, _, bus in query):
+      set_obd_multiplexing(obd_multiplexing)
+
+    timeout = 0.1
+    query_timeout = timeout
+    if latency_model is not None:
+      query_timeout = max(latency_model.timeout(latency_key(a), timeout) for a in query)
+
+    response_times: dict[EcuAddrBusType, float] = {}
+    ecu_responses.update(get_ecu_addrs(can_recv, can_send, set(query), responses, timeout=query_timeout, response_times=response_times,
+                                       query_responses={a: query_responses[a] for a in query}))
+
+    # ECUs that answered before but not within the shortened deadline are probed again with the full timeout
+    retry = {a for a in query if query_timeout < timeout and not (query_responses[a] & response_times.keys())}
+    if len(retry):
+      ecu_responses.update(get_ecu_addrs(can_recv, can_send, retry, responses, timeout=timeout, response_times=response_times,
+                                         query_responses={a: query_responses[a] for a in retry}))
+
+    if latency_model is not None:
+      for a in query:
+        latencies = [response_times[r] for r in query_responses[a] if r in response_times]
+        latency_model.record(latency_key(a), min(latencies) if len(latencies) else None)
   return ecu_responses
 
 
@@ -228,7 +345,8 @@ def get_brand_ecu_matches(ecu_rx_addrs: set[EcuAddrBusType]) -> dict[str, list[b
 
 
 def get_fw_versions_ordered(can_recv: CanRecvCallable, can_send: CanSendCallable, set_obd_multiplexing: ObdCallback, vin: str,
-                            ecu_rx_addrs: set[EcuAddrBusType], timeout: float = 0.1, num_pandas: int = 1, progress: bool = False) -> list[CarParams.CarFw]:
+                            ecu_rx_addrs: set[EcuAddrBusType], timeout: float = 0.1, num_pandas: int = 1, progress: bool = False,
+                            latency_model: EcuLatencyModel = None, stop_on_exact_match: bool = False) -> list[CarParams.CarFw]:
   """Queries for FW versions ordering brands by likelihood, breaks when exact match is found"""
 
   all_car_fw = []
@@ -241,7 +359,8 @@ def get_fw_versions_ordered(can_recv: CanRecvCallable, can_send: CanSendCallable
     if True not in brand_matches[brand]:
       continue
 
-    car_fw = get_fw_versions(can_recv, can_send, set_obd_multiplexing, query_brand=brand, timeout=timeout, num_pandas=num_pandas, progress=progress)
+    car_fw = get_fw_versions(can_recv, can_send, set_obd_multiplexing, query_brand=brand, timeout=timeout, num_pandas=num_pandas, progress=progress,
+                             latency_model=latency_model, stop_on_exact_match=stop_on_exact_match)
     all_car_fw.extend(car_fw)
 
     # If there is a match using this brand's FW alone, finish querying early
@@ -252,16 +371,47 @@ def get_fw_versions_ordered(can_recv: CanRecvCallable, can_send: CanSendCallable
   return all_car_fw
 
 
-def get_fw_versions(can_recv: CanRecvCallable, can_send: CanSendCallable, set_obd_multiplexing: ObdCallback, query_brand: str = None,
-                    extra: OfflineFwVersions = None, timeout: float = 0.1, num_pandas: int = 1, progress: bool = False) -> list[CarParams.CarFw]:
-  versions = VERSIONS.copy()
-
-  if query_brand is not None:
-    versions = {query_brand: versions[query_brand]}
-
-  if extra is not None:
-    versions.update(extra)
-
+@dataclass
+class FwQuery:
+  """
+  One IsoTpParallelQuery of a FwQueryPlan. Brand requests sending the same bytes on the same bus share it,
+  each address is queried once and its response is fanned out to every brand request that wanted it.
+  """
+  bus: int
+  rx_offset: int
+  request: list[bytes]
+  response: list[bytes]
+  # OBD multiplexing state the query needs, None if it isn't on the OBD port
+  obd_multiplexing: bool | None
+  # (addr, sub_addr) -> brand requests receiving the response, with the brand's ECU type for the address
+  targets: dict[AddrType, list[tuple[str, FwQueryConfig, Request, CarParams.Ecu]]] = field(default_factory=dict)
+
+  def latency_key(self, addr: AddrType) -> LatencyKey:
+    return self.bus, addr[0], addr[1], b''.join(self.request)
+
+
+@dataclass
+class FwQueryPlan:
+  queries: list[FwQuery]
+
+  def num_obd_toggles(self, obd_multiplexing: bool = True) -> int:
+    toggles = 0
+    for query in self.queries:
+      if query.obd_multiplexing is not None and query.obd_multiplexing != obd_multiplexing:
+        obd_multiplexing = query.obd_multiplexing
+        toggles += 1
+    return toggles
+
+  def expected_time(self, timeout: float, obd_multiplexing: bool = True) -> float:
+    """Wall-clock time of the plan when some ECU never responds to each query, starting from obd_multiplexing"""
+    return len(self.queries) * timeout + self.num_obd_toggles(obd_multiplexing) * OBD_MULTIPLEXING_TOGGLE_TIME
+
+
+def plan_fw_queries(versions: dict[str, OfflineFwVersions], num_pandas: int = 1) -> FwQueryPlan:
+  """
+  Plans the queries for the FW versions of every brand in versions. Requests with the same bytes, bus and rx offset are merged
+  across brands, and queries are grouped by OBD multiplexing state, starting with it on (as left by the VIN query).
+  """
   # Extract ECU addresses to query from fingerprints
   # ECUs using a subaddress need be queried one by one, the rest can be done in parallel
   addrs = []
@@ -284,44 +434,123 @@ def get_fw_versions(can_recv: CanRecvCallable, can_send: CanSendCallable, set_ob
 
   addrs.insert(0, parallel_addrs)
 
-  # Get versions and build capnp list to put into CarParams
-  car_fw = []
-  requests = [(brand, config, r) for brand, config, r in REQUESTS if is_brand(brand, query_brand)]
-  for addr_group in tqdm(addrs, disable=not progress):  # split by subaddr, if any
+  queries: list[FwQuery] = []
+  requests = [(brand, config, r) for brand, config, r in REQUESTS if brand in versions]
+  for addr_group in addrs:  # split by subaddr, if any
     for addr_chunk in chunks(addr_group):
+      chunk_queries: dict[tuple, FwQuery] = {}
       for brand, config, r in requests:
         # Skip query if no panda available
         if r.bus > num_pandas * 4 - 1:
           continue
 
-        # Toggle OBD multiplexing for each request
-        if r.bus % 4 == 1:
-          set_obd_multiplexing(r.obd_multiplexing)
-
-        try:
-          query_addrs = [(a, s) for (b, a, s) in addr_chunk if b in (brand, 'any') and
-                         (len(r.whitelist_ecus) == 0 or ecu_types[(b, a, s)] in r.whitelist_ecus)]
-
-          if query_addrs:
-            query = IsoTpParallelQuery(can_send, can_recv, r.bus, query_addrs, r.request, r.response, r.rx_offset)
-            for (tx_addr, sub_addr), version in query.get_data(timeout).items():
-              f = CarParams.CarFw()
-
-              f.ecu = ecu_types.get((brand, tx_addr, sub_addr), Ecu.unknown)
-              f.fwVersion = version
-              f.address = tx_addr
-              f.responseAddress = uds.get_rx_addr_for_tx_addr(tx_addr, r.rx_offset)
-              f.request = r.request
-              f.brand = brand
-              f.bus = r.bus
-              f.logging = r.logging or (f.ecu, tx_addr, sub_addr) in config.extra_ecus
-              f.obdMultiplexing = r.obd_multiplexing
-
-              if sub_addr is not None:
-                f.subAddress = sub_addr
-
-              car_fw.append(f)
-        except Exception:
-          carlog.exception("FW query exception")
+        # OBD multiplexing is only toggled for the OBD port
+        obd_multiplexing = r.obd_multiplexing if r.bus % 4 == 1 else None
+        key = (tuple(r.request), tuple(r.response), r.bus, r.rx_offset, obd_multiplexing)
+        for b, a, s in addr_chunk:
+          if b in (brand, 'any') and (len(r.whitelist_ecus) == 0 or ecu_types[(b, a, s)] in r.whitelist_ecus):
+            if key not in chunk_queries:
+              chunk_queries[key] = FwQuery(r.bus, r.rx_offset, r.request, r.response, obd_multiplexing)
+            chunk_queries[key].targets.setdefault((a, s), []).append((brand, config, r, ecu_types.get((brand, a, s), Ecu.unknown)))
+      queries.extend(chunk_queries.values())
+
+  # stable sort keeps the query order within each OBD multiplexing state
+  queries.sort(key=lambda q: q.obd_multiplexing is False)
+  return FwQueryPlan(queries)
+
+
+def get_fw_versions(can_recv: CanRecvCallable, can_send: CanSendCallable, set_obd_multiplexing: ObdCallback, query_brand: str = None,
+                    extra: OfflineFwVersions = None, timeout: float = 0.1, num_pandas: int = 1, progress: bool = False,
+                    latency_model: EcuLatencyModel = None, stop_on_exact_match: bool = False) -> list[CarParams.CarFw]:
+  """
+  Queries the FW versions of every brand, or only query_brand. With stop_on_exact_match and a query_brand, queries stop
+  once the brand's exact match is certain, except for logging ECUs. The skipped responses couldn't change the exact match,
+  but aren't in the returned FW versions, so it's off by default: interfaces and logs expect every ECU's FW version.
+  """
+  versions = VERSIONS.copy()
+
+  if query_brand is not None:
+    versions = {query_brand: versions[query_brand]}
+
+  if extra is not None:
+    versions.update(extra)
+
+  plan = plan_fw_queries(versions, num_pandas=num_pandas)
+
+  def is_logging(addr: AddrType, config: FwQueryConfig, r: Request, ecu_type: CarParams.Ecu) -> bool:
+    return r.logging or (ecu_type, *addr) in config.extra_ecus
+
+  # index of the last query each address gets a matched (not logging) response from
+  last_queries: dict[AddrType, int] = {}
+  for i, query in enumerate(plan.queries):
+    for addr, targets in query.targets.items():
+      if not all(is_logging(addr, *target[1:]) for target in targets):
+        last_queries[addr] = i
+
+  matcher = None
+  if stop_on_exact_match and query_brand is not None and extra is None:
+    matcher = ExactFwMatcher(get_fw_version_index(query_brand), set(last_queries))
+
+  # Get versions and build capnp list to put into CarParams
+  car_fw = []
+  for i, query in enumerate(tqdm(plan.queries, disable=not progress)):
+    query_addrs = list(query.targets)
+    if matcher is not None and matcher.match is not None:
+      # The exact match is certain, only logging ECUs are left to query
+      query_addrs = [a for a in query_addrs if any(is_logging(a, *target[1:]) for target in query.targets[a])]
+      if not len(query_addrs):
+        continue
+
+    addr_timeouts = None
+    if latency_model is not None:
+      # Skip ECUs that never respond to this car, and give the rest a deadline based on how fast they responded before
+      query_addrs = [a for a in query_addrs if not latency_model.skip_query(query.latency_key(a))]
+      addr_timeouts = {a: latency_model.timeout(query.latency_key(a), timeout) for a in query_addrs}
+      if not len(query_addrs):
+        continue
+
+    if query.obd_multiplexing is not None:
+      set_obd_multiplexing(query.obd_multiplexing)
+
+    try:
+      iso_tp_query = IsoTpParallelQuery(can_send, can_recv, query.bus, query_addrs, query.request, query.response, query.rx_offset)
+      results = iso_tp_query.get_data(timeout, timeouts=addr_timeouts)
+      if latency_model is not None:
+        # A response slower than its shortened deadline would be missing from carFw, ask those ECUs again with the full timeout
+        response_times = iso_tp_query.response_times
+        retry_addrs = [a for a in query_addrs if a not in results and addr_timeouts[a] < timeout]
+        if len(retry_addrs):
+          iso_tp_query = IsoTpParallelQuery(can_send, can_recv, query.bus, retry_addrs, query.request, query.response, query.rx_offset)
+          results |= iso_tp_query.get_data(timeout)
+          response_times = response_times | iso_tp_query.response_times
+
+        for a in query_addrs:
+          latency_model.record(query.latency_key(a), response_times.get(a))
+
+      for (tx_addr, sub_addr), version in results.items():
+        for brand, config, r, ecu_type in query.targets[(tx_addr, sub_addr)]:
+          f = CarParams.CarFw()
+
+          f.ecu = ecu_type
+          f.fwVersion = version
+          f.address = tx_addr
+          f.responseAddress = uds.get_rx_addr_for_tx_addr(tx_addr, r.rx_offset)
+          f.request = r.request
+          f.brand = brand
+          f.bus = r.bus
+          f.logging = r.logging or (f.ecu, tx_addr, sub_addr) in config.extra_ecus
+          f.obdMultiplexing = r.obd_multiplexing
+
+          if sub_addr is not None:
+            f.subAddress = sub_addr
+
+          car_fw.append(f)
+          if matcher is not None and not f.logging:
+            matcher.update((tx_addr, sub_addr), version)
+    except Exception:
+      carlog.exception("FW query exception")
+
+    if matcher is not None and matcher.match is None:
+      matcher.finish({a for a in query.targets if last_queries.get(a) == i})
 
   return car_fw
@@ -1,9 +1,11 @@
+import importlib
 import os
 import numpy as np
 import time
 import tomllib
 from abc import abstractmethod, ABC
 from enum import StrEnum
+from types import ModuleType
 from typing import Any
 from collections.abc import Callable
 from functools import cache
@@ -14,8 +16,8 @@ from opendbc.car.can_definitions import CanData, CanRecvCallable, CanSendCallabl
 from opendbc.car.common.basedir import BASEDIR
 from opendbc.car.common.conversions import Conversions as CV
 from opendbc.car.common.simple_kalman import KF1D, get_kalman_gain
-from opendbc.car.values import PLATFORMS
-from opendbc.can import CANParser
+from opendbc.car.values import BRANDS, PLATFORMS
+from opendbc.can import CANParser, CANParserGroup
 from opendbc.car.carlog import carlog
 
 from opendbc.sunnypilot.car.interfaces import CarInterfaceBaseSP
@@ -109,6 +111,7 @@ class CarInterfaceBase(ABC, CarInterfaceBaseSP):
 
     self.CS: CarStateBase = self.CarState(CP, CP_SP)
     self.can_parsers: dict[StrEnum, CANParser] = self.CS.get_can_parsers(CP, CP_SP)
+    self.can_parser_group = CANParserGroup(self.can_parsers.values())
 
     dbc_names = {bus: cp.dbc_name for bus, cp in self.can_parsers.items()}
     self.CC: CarControllerBase = self.CarController(dbc_names, CP, CP_SP)
@@ -270,10 +273,8 @@ class CarInterfaceBase(ABC, CarInterfaceBaseSP):
     tune.torque.steeringAngleDeadzoneDeg = steering_angle_deadzone_deg
 
   def update(self, can_packets: list[tuple[int, list[CanData]]]) -> tuple[structs.CarState, structs.CarStateSP]:
-    # parse can
-    for cp in self.can_parsers.values():
-      if cp is not None:
-        cp.update(can_packets)
+    # parse can, one pass over the packets for all parsers
+    self.can_parser_group.update(can_packets)
 
     # get CarState
     ret, ret_sp = self.CS.update(self.can_parsers)
@@ -420,28 +421,38 @@ INTERFACE_ATTR_FILE = {
 
 # interface-specific helpers
 
+# brand packages in opendbc/car, one per platform enum
+BRAND_NAMES: tuple[str, ...] = tuple(sorted({brand.__module__.split('.')[-2] for brand in BRANDS}))
+
+
+@cache
+def _get_brand_module(brand_name: str, module_name: str) -> ModuleType | None:
+  try:
+    return importlib.import_module(f'opendbc.car.{brand_name}.{module_name}')
+  except (ImportError, OSError):
+    return None
+
 
 def get_interface_attr(attr: str, combine_brands: bool = False, ignore_none: bool = False) -> dict[str | StrEnum, Any]:
-  # read all the folders in opendbc/car and return a dict where:
+  # read all the brands in opendbc/car and return a dict where:
   # - keys are all the car models or brand names
-  # - values are attr values from all car folders
+  # - values are attr values from all brands
   result = {}
-  for car_folder in sorted([x[0] for x in os.walk(BASEDIR)]):
-    try:
-      brand_name = car_folder.split('/')[-1]
-      brand_values = __import__(f'opendbc.car.{brand_name}.{INTERFACE_ATTR_FILE.get(attr, "values")}', fromlist=[attr])
-      if hasattr(brand_values, attr) or not ignore_none:
-        attr_data = getattr(brand_values, attr, None)
-      else:
-        continue
-
-      if combine_brands:
-        if isinstance(attr_data, dict):
-          for f, v in attr_data.items():
-            result[f] = v
-      else:
-        result[brand_name] = attr_data
-    except (ImportError, OSError):
-      pass
+  for brand_name in BRAND_NAMES:
+    brand_values = _get_brand_module(brand_name, INTERFACE_ATTR_FILE.get(attr, "values"))
+    if brand_values is None:
+      continue
+
+    if hasattr(brand_values, attr) or not ignore_none:
+      attr_data = getattr(brand_values, attr, None)
+    else:
+      continue
+
+    if combine_brands:
+      if isinstance(attr_data, dict):
+        for f, v in attr_data.items():
+          result[f] = v
+    else:
+      result[brand_name] = attr_data
 
   return result
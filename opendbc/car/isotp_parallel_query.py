@@ -1,5 +1,6 @@
+import heapq
 import time
-from collections import defaultdict
+from collections import defaultdict, deque
 from functools import partial
 
 from opendbc.car import uds
@@ -7,6 +8,9 @@ from opendbc.car.can_definitions import CanData, CanRecvCallable, CanSendCallabl
 from opendbc.car.carlog import carlog
 from opendbc.car.fw_query_definitions import AddrType
 
+# longest to wait for frames between consecutive frames of a query, so other queries' responses are handled quickly
+TX_POLL_INTERVAL = 0.005
+
 
 class IsoTpParallelQuery:
   def __init__(self, can_send: CanSendCallable, can_recv: CanRecvCallable, bus: int, addrs: list[int] | list[AddrType],
@@ -25,16 +29,74 @@ class IsoTpParallelQuery:
       assert tx_addr not in uds.FUNCTIONAL_ADDRS, f"Functional address should be defined in functional_addrs: {hex(tx_addr)}"
 
     self.msg_addrs = {tx_addr: uds.get_rx_addr_for_tx_addr(tx_addr[0], rx_offset=response_offset) for tx_addr in real_addrs}
-    self.msg_buffer: dict[int, list[CanData]] = defaultdict(list)
+    # (rx_addr, sub_addr) -> tx_addr, to dispatch each received frame to its query in one lookup
+    self.rx_keys: dict[AddrType, AddrType] = {(rx_addr, tx_addr[1]): tx_addr for tx_addr, rx_addr in self.msg_addrs.items()}
+    self.rx_addrs = set(self.msg_addrs.values())
+    self.rx_sub_addrs = {rx_addr for rx_addr, sub_addr in self.rx_keys if sub_addr is not None}
+    self.msg_buffer: dict[AddrType, list[CanData]] = defaultdict(list)
+    self.rx_ready: dict[AddrType, None] = {}  # tx_addrs with new frames, in order of arrival
+
+    # consecutive frames waiting on a flow control separation time, per query: (client, frames, delay)
+    self.tx_pending: dict[AddrType | None, tuple[uds.CanClient, deque[bytes], float]] = {}
+    self.tx_queue: list[tuple[float, int, AddrType | None]] = []  # (deadline, sequence, tx_addr) of each query's next frame
+    self.tx_count = 0
+
+    # tx_addr -> seconds from the first request to the final response, of the last get_data
+    self.response_times: dict[AddrType, float] = {}
 
   def rx(self) -> None:
-    """Drain can socket and sort messages into buffers based on address"""
-    can_packets = self.can_recv(wait_for_one=True)
+    """Drain can socket and sort messages into buffers based on address and sub-address"""
+    # don't block on the socket while there are consecutive frames to send, sleep until the next one is due instead of polling
+    if self.tx_queue:
+      time.sleep(min(max(self.tx_queue[0][0] - time.monotonic(), 0.), TX_POLL_INTERVAL))
+    can_packets = self.can_recv(wait_for_one=not self.tx_queue)
 
     for packet in can_packets:
       for msg in packet:
-        if msg.src == self.bus and msg.address in self.msg_addrs.values():
-          self.msg_buffer[msg.address].append(CanData(msg.address, msg.dat, msg.src))
+        if msg.src != self.bus or msg.address not in self.rx_addrs:
+          continue
+
+        keys: tuple[AddrType, ...] = ((msg.address, None),)
+        if msg.address in self.rx_sub_addrs and len(msg.dat):
+          keys += ((msg.address, msg.dat[0]),)
+        for key in keys:
+          tx_addr = self.rx_keys.get(key)
+          if tx_addr is not None:
+            self.msg_buffer[key].append(CanData(msg.address, msg.dat, msg.src))
+            self.rx_ready[tx_addr] = None
+
+  def tx(self) -> None:
+    """Send queued consecutive frames whose separation time has passed"""
+    cur_time = time.monotonic()
+    while self.tx_queue and self.tx_queue[0][0] <= cur_time:
+      _, _, tx_addr = heapq.heappop(self.tx_queue)
+      can_client, frames, delay = self.tx_pending[tx_addr]
+      uds.CanClient.send(can_client, [frames.popleft()])
+      if len(frames):
+        # separation time counts from when the previous frame was actually sent
+        self._push_tx(time.monotonic() + delay, tx_addr)
+      else:
+        del self.tx_pending[tx_addr]
+
+  def _push_tx(self, deadline: float, tx_addr: AddrType | None) -> None:
+    self.tx_count += 1
+    heapq.heappush(self.tx_queue, (deadline, self.tx_count, tx_addr))
+
+  def _schedule_tx(self, tx_addr: AddrType | None, can_client: uds.CanClient, msgs: list[bytes], delay: float) -> None:
+    """Queue msgs delay seconds apart instead of sleeping, so other queries keep running"""
+    if tx_addr in self.tx_pending:
+      self.tx_pending[tx_addr][1].extend(msgs)
+    else:
+      self.tx_pending[tx_addr] = (can_client, deque(msgs), delay)
+      self._push_tx(time.monotonic(), tx_addr)
+    self.tx()
+
+  def tx_pending_until(self, tx_addr: AddrType) -> float | None:
+    """Estimated time the last queued frame of a query goes out"""
+    if tx_addr not in self.tx_pending:
+      return None
+    _, frames, delay = self.tx_pending[tx_addr]
+    return time.monotonic() + len(frames) * delay
 
   def _can_tx(self, tx_addr: int, dat: bytes, bus: int):
     """Helper function to send single message"""
@@ -43,66 +105,81 @@ class IsoTpParallelQuery:
 
   def _can_rx(self, addr, sub_addr=None):
     """Helper function to retrieve message with specified address and subaddress from buffer"""
-    keep_msgs = []
-
-    if sub_addr is None:
-      msgs = self.msg_buffer[addr]
-    else:
-      # Filter based on subaddress
-      msgs = []
-      for m in self.msg_buffer[addr]:
-        first_byte = m[1][0]
-        if first_byte == sub_addr:
-          msgs.append(m)
-        else:
-          keep_msgs.append(m)
-
-    self.msg_buffer[addr] = keep_msgs
-    return msgs
+    return self.msg_buffer.pop((addr, sub_addr), [])
 
   def _drain_rx(self) -> None:
     self.can_recv()
     self.msg_buffer = defaultdict(list)
+    self.rx_ready = {}
+    self.tx_pending = {}
+    self.tx_queue = []
 
   def _create_isotp_msg(self, tx_addr: int, sub_addr: int | None, rx_addr: int):
-    can_client = uds.CanClient(self._can_tx, partial(self._can_rx, rx_addr, sub_addr=sub_addr), tx_addr, rx_addr,
-                               self.bus, sub_addr=sub_addr)
+    can_client = ScheduledCanClient(self, self._can_tx, partial(self._can_rx, rx_addr, sub_addr=sub_addr), tx_addr, rx_addr,
+                                    self.bus, sub_addr=sub_addr)
 
     # uses iso-tp frame separation time of 10 ms
     # TODO: use single_frame_mode so ECUs can send as fast as they want,
     # as well as reduces chances we process messages from previous queries
     return uds.IsoTpMessage(can_client, timeout=0, separation_time=0.01)
 
-  def get_data(self, timeout: float, total_timeout: float = 60.) -> dict[AddrType, bytes]:
+  def get_data(self, timeout: float, total_timeout: float = 60., timeouts: dict[AddrType, float] | None = None) -> dict[AddrType, bytes]:
+    """
+    Queries every address, giving each timeout seconds to respond to each request, or its own deadline from timeouts.
+    Sets response_times to the time each address took to respond to the whole request.
+    """
     self._drain_rx()
+    self.response_times = {}
+    addr_timeouts = {tx_addr: timeout for tx_addr in self.msg_addrs} | (timeouts or {})
+
+    # With functional addrs, the physical addrs only handle responses. Their sessions are started when a first frame arrives,
+    # so the cost scales with the number of responding ECUs instead of every address an ECU could respond from
+    lazy_sessions = len(self.functional_addrs) > 0
 
-    # Create message objects
     msgs = {}
     request_counter = {}
     request_done = {}
-    for tx_addr, rx_addr in self.msg_addrs.items():
-      msgs[tx_addr] = self._create_isotp_msg(*tx_addr, rx_addr)
+
+    def start_session(tx_addr: AddrType) -> None:
+      msgs[tx_addr] = self._create_isotp_msg(*tx_addr, self.msg_addrs[tx_addr])
+      # If querying functional addrs, only set up physical IsoTpMessages to send consecutive frames
+      msgs[tx_addr].send(self.request[0], setup_only=lazy_sessions)
       request_counter[tx_addr] = 0
       request_done[tx_addr] = False
 
     # Send first request to functional addrs, subsequent responses are handled on physical addrs
-    if len(self.functional_addrs):
+    if lazy_sessions:
       for addr in self.functional_addrs:
         self._create_isotp_msg(addr, None, -1).send(self.request[0])
-
-    # Send first frame (single or first) to all addresses and receive asynchronously in the loop below.
-    # If querying functional addrs, only set up physical IsoTpMessages to send consecutive frames
-    for msg in msgs.values():
-      msg.send(self.request[0], setup_only=len(self.functional_addrs) > 0)
+    else:
+      # Send first frame (single or first) to all addresses and receive asynchronously in the loop below
+      for tx_addr in self.msg_addrs:
+        start_session(tx_addr)
 
     results = {}
     start_time = time.monotonic()
     addrs_responded = set()  # track addresses that have ever sent a valid iso-tp frame for timeout logging
-    response_timeouts = {tx_addr: start_time + timeout for tx_addr in self.msg_addrs}
+    response_timeouts = {tx_addr: start_time + addr_timeouts[tx_addr] for tx_addr in msgs}
+    # physical addrs without a session can start one until then
+    lazy_deadline = start_time + max(addr_timeouts.values(), default=timeout)
+    cur_time = start_time
     while True:
+      self.tx()
       self.rx()
 
-      for tx_addr, msg in msgs.items():
+      # only queries that received frames have anything to process
+      rx_ready, self.rx_ready = self.rx_ready, {}
+      for tx_addr in rx_ready:
+        if tx_addr not in msgs:
+          if cur_time > start_time + addr_timeouts[tx_addr]:
+            continue
+          start_session(tx_addr)
+          response_timeouts[tx_addr] = start_time + addr_timeouts[tx_addr]
+
+        if request_done[tx_addr]:
+          continue
+
+        msg = msgs[tx_addr]
         try:
           dat, rx_in_progress = msg.recv()
         except Exception:
@@ -130,11 +207,12 @@ class IsoTpParallelQuery:
 
         if response_valid:
           if counter + 1 < len(self.request):
-            response_timeouts[tx_addr] = time.monotonic() + timeout
+            response_timeouts[tx_addr] = time.monotonic() + addr_timeouts[tx_addr]
             msg.send(self.request[counter + 1])
             request_counter[tx_addr] += 1
           else:
             results[tx_addr] = dat[len(expected_response):]
+            self.response_times[tx_addr] = time.monotonic() - start_time
             request_done[tx_addr] = True
         else:
           error_code = dat[2] if len(dat) > 2 else -1
@@ -145,6 +223,12 @@ class IsoTpParallelQuery:
             request_done[tx_addr] = True
             carlog.error(f"iso-tp query bad response: {tx_addr} - 0x{dat.hex()}")
 
+      # The ECU can't respond before our last consecutive frame is sent
+      for tx_addr in self.tx_pending:
+        pending_until = self.tx_pending_until(tx_addr)
+        if tx_addr in response_timeouts and pending_until is not None:
+          response_timeouts[tx_addr] = max(response_timeouts[tx_addr], pending_until + timeout)
+
       # Mark request done if address timed out
       cur_time = time.monotonic()
       for tx_addr in response_timeouts:
@@ -159,8 +243,8 @@ class IsoTpParallelQuery:
             #   carlog.error(f"iso-tp query timeout with no response: {tx_addr}")
           request_done[tx_addr] = True
 
-      # Break if all requests are done (finished or timed out)
-      if all(request_done.values()):
+      # Break if all requests are done (finished or timed out), and no other physical addr can start responding
+      if all(request_done.values()) and (not lazy_sessions or cur_time > lazy_deadline):
         break
 
       if cur_time - start_time > total_timeout:
@@ -168,3 +252,17 @@ class IsoTpParallelQuery:
         break
 
     return results
+
+
+class ScheduledCanClient(uds.CanClient):
+  """CanClient that hands delayed consecutive frames to its IsoTpParallelQuery instead of sleeping between them"""
+  def __init__(self, query: IsoTpParallelQuery, *args, **kwargs):
+    super().__init__(*args, **kwargs)
+    self.query = query
+    self.query_addr: AddrType | None = (self.tx_addr, self.sub_addr) if (self.tx_addr, self.sub_addr) in query.msg_addrs else None
+
+  def send(self, msgs: list[bytes], delay: float = 0) -> None:
+    if (delay and len(msgs) > 1) or self.query_addr in self.query.tx_pending:
+      self.query._schedule_tx(self.query_addr, self, msgs, delay)
+    else:
+      super().send(msgs)
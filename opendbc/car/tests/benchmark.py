@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+import logging
+import os
+import random
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+from opendbc.car.can_definitions import CanData
+from opendbc.car.car_helpers import FRAME_FINGERPRINT, can_fingerprint
+from opendbc.car.carlog import carlog
+from opendbc.car.common.basedir import BASEDIR
+from opendbc.car.ecu_latency import EcuLatencyModel
+from opendbc.car.fingerprints import _FINGERPRINTS
+from opendbc.car.structs import CarParams
+from opendbc.car.fw_versions import VERSIONS, get_fw_version_index, get_fw_versions_ordered, get_present_ecus, match_fw_to_car
+from opendbc.car.tests.ecu_sim import SimulatedCanNetwork, simulated_time
+from opendbc.car.vin import get_vin
+
+CarFw = CarParams.CarFw
+
+
+def _fingerprints(seed: int = 0) -> list[tuple[str, list[CarParams.CarFw]]]:
+  # the same FW responses test_fw_fingerprint.py builds: every car, one random version per ECU
+  rng = random.Random(seed)
+  fingerprints = []
+  for brand, cars in VERSIONS.items():
+    for car_model, ecus in cars.items():
+      fw = [CarFw(ecu=ecu, fwVersion=rng.choice(versions), brand=brand, address=addr, subAddress=0 if sub_addr is None else sub_addr)
+            for (ecu, addr, sub_addr), versions in ecus.items()]
+      fingerprints.append((car_model, fw))
+  return fingerprints
+
+
+def _benchmark_fw_matching(n: int = 5):
+  fingerprints = _fingerprints()
+
+  get_fw_version_index.cache_clear()
+  t1 = time.process_time_ns()
+  for brand in VERSIONS:
+    get_fw_version_index(brand)
+  t2 = time.process_time_ns()
+  print(f'{(t2 - t1) / 1e6:.1f}ms to build the FW version index of {len(VERSIONS)} brands')
+
+  for name, args in (('exact', {'allow_fuzzy': False}), ('fuzzy', {'allow_exact': False})):
+    ets = []
+    for _ in range(n):
+      t1 = time.process_time_ns()
+      for _, fw in fingerprints:
+        match_fw_to_car(fw, '', log=False, **args)
+      t2 = time.process_time_ns()
+      ets.append(t2 - t1)
+
+    et = min(ets)
+    print(f'{name} FW match over {len(fingerprints)} fingerprints: {et / 1e6:.1f}ms, avg: {et / len(fingerprints) / 1e3:.1f}us')
+
+
+def _benchmark_can_fingerprint(n: int = 5):
+  # every CAN fingerprint, received on both buses for the full FRAME_FINGERPRINT frames
+  cans = [[CanData(address=address, dat=b'\x00' * length, src=src) for address, length in fingerprint.items() for src in (0, 1)]
+          for fingerprints in _FINGERPRINTS.values() for fingerprint in fingerprints]
+
+  ets = []
+  for _ in range(n):
+    t1 = time.process_time_ns()
+    for can in cans:
+      can_fingerprint(lambda **kwargs: [can])  # noqa: B023
+    t2 = time.process_time_ns()
+    ets.append(t2 - t1)
+
+  et = min(ets)
+  frames = sum(len(can) for can in cans) * (FRAME_FINGERPRINT + 2)
+  print(f'CAN fingerprinted {len(cans)} fingerprints: {et / 1e6:.1f}ms, avg: {et / frames:.0f}ns per frame')
+
+
+def _benchmark_import_time(module: str = 'opendbc.car.car_helpers', n: int = 5, top: int = 15):
+  # cold import of module in a fresh interpreter, with the modules it imports directly by cumulative time from -X importtime
+  runs = []
+  for _ in range(n):
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'], capture_output=True, text=True, check=True,
+                          cwd=os.path.dirname(os.path.dirname(BASEDIR)))
+    imports = []  # (cumulative us, depth, name), each module after the modules it imports
+    for line in proc.stderr.splitlines():
+      if not line.startswith('import time:') or 'cumulative' in line:
+        continue
+      _, cumulative, name = line[len('import time:'):].split('|')
+      imports.append((int(cumulative), (len(name) - len(name.lstrip()) - 1) // 2, name.strip()))
+
+    idx = next(i for i, (_, depth, name) in enumerate(imports) if depth == 0 and name == module)
+    start = next((i + 1 for i in range(idx - 1, -1, -1) if imports[i][1] == 0), 0)
+    runs.append((imports[idx][0], [(t, name) for t, depth, name in imports[start:idx] if depth == 1]))
+
+  total, children = min(runs)
+  print(f'import {module}: {total / 1e3:.1f}ms, top imports:')
+  for cumulative, name in sorted(children, reverse=True)[:top]:
+    print(f'  {name:<45} {cumulative / 1e3:6.1f}ms')
+
+
+def _benchmark_vin_query(n: int = 5):
+  # CPU time of the VIN query on simulated cars, with and without an ECU answering the functional VIN requests
+  carlog.setLevel(logging.CRITICAL)
+  platforms = [next(iter(cars)) for cars in VERSIONS.values() if len(cars)]
+  ets = []
+  for _ in range(n):
+    t1 = time.process_time_ns()
+    for platform in platforms:
+      for functional in (True, False):
+        network = SimulatedCanNetwork.from_platform(platform)
+        for ecu in network.ecus:
+          ecu.functional &= functional
+        with simulated_time(network):
+          get_vin(network.can_recv, network.can_send, (0, 1))
+    t2 = time.process_time_ns()
+    ets.append(t2 - t1)
+  carlog.setLevel(logging.INFO)
+
+  et = min(ets)
+  print(f'VIN query on {len(platforms)} simulated cars, with and without a VIN: {et / 1e6:.1f}ms, avg: {et / len(platforms) / 2e6:.2f}ms')
+
+
+def simulate_fingerprinting(network: SimulatedCanNetwork, num_pandas: int = 1, latency_model: EcuLatencyModel = None,
+                            stop_on_exact_match: bool = False) -> dict[str, float]:
+  """Runs the VIN, present ECU and FW version queries of card's fingerprinting against a simulated car, returns their simulated times"""
+  times = {}
+  with simulated_time(network):
+    network.set_obd_multiplexing(True)
+    _, _, vin = get_vin(network.can_recv, network.can_send, (0, 1))
+    times['vin'] = network.now
+    if latency_model is not None:
+      latency_model = latency_model.for_vin(vin)
+    ecu_rx_addrs = get_present_ecus(network.can_recv, network.can_send, network.set_obd_multiplexing, num_pandas=num_pandas,
+                                    latency_model=latency_model)
+    times['present_ecus'] = network.now - times['vin']
+    car_fw = get_fw_versions_ordered(network.can_recv, network.can_send, network.set_obd_multiplexing, vin, ecu_rx_addrs, num_pandas=num_pandas,
+                                     latency_model=latency_model, stop_on_exact_match=stop_on_exact_match)
+    times['fw_versions'] = network.now - times['vin'] - times['present_ecus']
+  times['total'] = network.now
+
+  exact_match, matches = match_fw_to_car(car_fw, vin, log=False)
+  times['exact_match'] = float(exact_match and len(matches) == 1)
+  return times
+
+
+def _benchmark_simulated_fingerprinting(warm_starts: int = 0, stop_on_exact_match: bool = False, **ecu_kwargs):
+  # simulated wall time and CAN frames of fingerprinting every platform with FW versions, by brand.
+  # with warm_starts, the times of the start after that many others that learned an ECU latency model
+  carlog.setLevel(logging.CRITICAL)
+  stats: dict[str, dict[str, float]] = defaultdict(lambda: defaultdict(float))
+  counts: dict[str, int] = defaultdict(int)
+  for brand, cars in VERSIONS.items():
+    for seed, car_model in enumerate(cars):
+      latency_model = EcuLatencyModel() if warm_starts else None
+      for _ in range(warm_starts):
+        simulate_fingerprinting(SimulatedCanNetwork.from_platform(car_model, seed=seed, **ecu_kwargs), latency_model=latency_model)
+
+      network = SimulatedCanNetwork.from_platform(car_model, seed=seed, **ecu_kwargs)
+      for name, value in simulate_fingerprinting(network, latency_model=latency_model, stop_on_exact_match=stop_on_exact_match).items():
+        stats[brand][name] += value
+      stats[brand]['tx_frames'] += network.tx_frames
+      stats[brand]['rx_frames'] += network.rx_frames
+      stats[brand]['obd_toggles'] += network.obd_toggles
+      counts[brand] += 1
+
+  print(f'simulated fingerprinting {ecu_kwargs or ""}{f" after {warm_starts} starts" if warm_starts else ""}' +
+        f'{" stopping on exact match" if stop_on_exact_match else ""}, averages per platform:')
+  for brand, brand_stats in stats.items():
+    avg = {name: value / counts[brand] for name, value in brand_stats.items()}
+    print(f'  {brand:>10} ({counts[brand]:>2} platforms): {avg["total"]:.2f}s (vin {avg["vin"]:.2f}s, present ECUs {avg["present_ecus"]:.2f}s, ' +
+          f'FW {avg["fw_versions"]:.2f}s), {avg["tx_frames"]:.0f} tx / {avg["rx_frames"]:.0f} rx frames, {avg["obd_toggles"]:.1f} OBD toggles, ' +
+          f'{avg["exact_match"]:.0%} exact matches')
+  total = sum(brand_stats['total'] for brand_stats in stats.values()) / sum(counts.values())
+  print(f'  all platforms: {total:.2f}s')
+  carlog.setLevel(logging.INFO)
+
+
+if __name__ == "__main__":
+  _benchmark_import_time()
+  _benchmark_fw_matching()
+  _benchmark_can_fingerprint()
+  _benchmark_vin_query()
+  _benchmark_simulated_fingerprinting()
+  _benchmark_simulated_fingerprinting(warm_starts=2)
+  _benchmark_simulated_fingerprinting(stop_on_exact_match=True)
+  _benchmark_simulated_fingerprinting(latency=0.02, separation_time=5, response_pending=1, dropout=0.05)
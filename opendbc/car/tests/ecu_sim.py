@@ -0,0 +1,227 @@
+"""
+A simulated CAN network of diagnostic ECUs, to run the VIN, present ECU and FW version queries without a car.
+
+SimulatedCanNetwork implements CanSendCallable/CanRecvCallable and set_obd_multiplexing on a virtual clock:
+receiving frames advances the clock, so a query's timeouts pass instantly and every run is reproducible.
+Patch time.monotonic and time.sleep with SimulatedCanNetwork.monotonic and sleep (see simulated_time) while querying.
+SimulatedEcu answers requests over ISO-TP (single, first, consecutive and flow control frames, with optional
+sub-addressing) with configurable latency, separation time, response pending (0x78) replies and dropped requests.
+"""
+import heapq
+import random
+from collections.abc import Generator
+from contextlib import contextmanager
+from unittest import mock
+
+from opendbc.car import uds
+from opendbc.car.can_definitions import CanData
+from opendbc.car.fw_query_definitions import FwQueryConfig, StdQueries
+from opendbc.car.fw_versions import FW_QUERY_CONFIGS, MODEL_TO_BRAND, OBD_MULTIPLEXING_TOGGLE_TIME, VERSIONS
+
+# (bus, OBD multiplexing state or None if not on the OBD port, request) -> (response, rx_offset)
+EcuResponses = dict[tuple[int, bool | None, bytes], tuple[bytes, int]]
+
+FUNCTIONAL_ADDR_11_BIT, FUNCTIONAL_ADDR_29_BIT = uds.FUNCTIONAL_ADDRS
+VIN_ECU_ADDR = 0x7e0  # OBD-II engine
+
+
+def _separation_time(st: int) -> float:
+  # 0x00-0x7F milliseconds, 0xF1-0xF9 100-900 microseconds
+  return (st - 0xF0) / 10000. if 0xF1 <= st <= 0xF9 else st / 1000.
+
+
+def _obd_key(bus: int, obd_multiplexing: bool) -> bool | None:
+  return obd_multiplexing if bus % 4 == 1 else None
+
+
+class SimulatedEcu:
+  def __init__(self, tx_addr: int, responses: EcuResponses, sub_addr: int | None = None, functional: bool = False,
+               latency: float = 0.005, separation_time: int = 0, response_pending: int = 0, pending_time: float = 0.05,
+               dropout: float = 0.):
+    self.tx_addr = tx_addr
+    self.sub_addr = sub_addr
+    self.responses = responses
+    self.functional = functional  # also answers requests to the OBD functional address
+    self.latency = latency
+    self.separation_time = separation_time  # STmin the ECU asks for, in ISO-TP encoding
+    self.response_pending = response_pending  # number of 0x78 replies before each response
+    self.pending_time = pending_time
+    self.dropout = dropout  # probability a request is ignored
+
+    self.max_len = 8 if sub_addr is None else 7
+    self.buses = {bus for bus, _, _ in responses}
+    # per bus: the request being received, and the response frames waiting on flow control
+    self.rx: dict[int, tuple[int, bytes]] = {}
+    self.tx: dict[int, tuple[int, list[bytes]]] = {}
+
+  @property
+  def functional_addr(self) -> int:
+    return FUNCTIONAL_ADDR_11_BIT if self.tx_addr < 0x800 else FUNCTIONAL_ADDR_29_BIT
+
+  def _send(self, network: 'SimulatedCanNetwork', t: float, rx_addr: int, bus: int, dat: bytes) -> None:
+    if self.sub_addr is not None:
+      dat = bytes([self.sub_addr]) + dat
+    network.deliver(t, CanData(rx_addr, dat.ljust(8, b'\x00'), bus))
+
+  def recv(self, network: 'SimulatedCanNetwork', msg: CanData) -> None:
+    dat = msg.dat
+    functional = msg.address == self.functional_addr
+    if self.sub_addr is not None and not functional:
+      if not len(dat) or dat[0] != self.sub_addr:
+        return
+      dat = dat[1:]
+    if not len(dat):
+      return
+
+    bus = msg.src
+    frame_type = dat[0] >> 4
+    t = network.now + self.latency
+    if frame_type == 0:
+      self._handle_request(network, bus, dat[1:1 + (dat[0] & 0xF)], functional)
+    elif frame_type == 1 and not functional:
+      self.rx[bus] = (((dat[0] & 0xF) << 8) + dat[1], dat[2:])
+      self._send(network, t, self._rx_addr(bus), bus, bytes([0x30, 0, self.separation_time]))
+    elif frame_type == 2 and bus in self.rx:
+      rx_len, rx_dat = self.rx[bus]
+      rx_dat += dat[1:]
+      if len(rx_dat) >= rx_len:
+        del self.rx[bus]
+        self._handle_request(network, bus, rx_dat[:rx_len], False)
+      else:
+        self.rx[bus] = (rx_len, rx_dat)
+    elif frame_type == 3 and bus in self.tx and dat[0] == 0x30:
+      # tester is ready, send a block of consecutive frames honoring its separation time
+      rx_addr, frames = self.tx.pop(bus)
+      block_size = dat[1] or len(frames)
+      for i, frame in enumerate(frames[:block_size]):
+        self._send(network, t + i * _separation_time(dat[2]), rx_addr, bus, frame)
+      if len(frames) > block_size:
+        self.tx[bus] = (rx_addr, frames[block_size:])
+
+  def _rx_addr(self, bus: int, rx_offset: int | None = None) -> int:
+    if rx_offset is None:
+      # the offset of the first request on this bus
+      rx_offset = next((offset for (b, _, _), (_, offset) in self.responses.items() if b == bus), 0x8)
+    return uds.get_rx_addr_for_tx_addr(self.tx_addr, rx_offset)
+
+  def _lookup(self, network: 'SimulatedCanNetwork', bus: int, request: bytes) -> tuple[bytes | None, int]:
+    response, rx_offset = self.responses.get((bus, _obd_key(bus, network.obd_multiplexing), request), (None, None))
+    # every ECU answers tester present on the buses it's on
+    if response is None and request == StdQueries.TESTER_PRESENT_REQUEST and bus in self.buses:
+      response = StdQueries.TESTER_PRESENT_RESPONSE
+    return response, self._rx_addr(bus, rx_offset)
+
+  def _handle_request(self, network: 'SimulatedCanNetwork', bus: int, request: bytes, functional: bool) -> None:
+    response, rx_addr = self._lookup(network, bus, request)
+    if response is None or (functional and not self.functional) or network.rng.random() < self.dropout:
+      return
+
+    t = network.now + self.latency
+    for _ in range(self.response_pending):
+      self._send(network, t, rx_addr, bus, bytes([0x03, 0x7F, request[0], 0x78]))
+      t += self.pending_time
+
+    if len(response) < self.max_len:
+      self._send(network, t, rx_addr, bus, bytes([len(response)]) + response)
+    else:
+      ff_len, cf_len = self.max_len - 2, self.max_len - 1
+      frames = [bytes([0x20 | (i + 1) & 0xF]) + response[j:j + cf_len] for i, j in enumerate(range(ff_len, len(response), cf_len))]
+      self.tx[bus] = (rx_addr, frames)
+      self._send(network, t, rx_addr, bus, bytes([0x10 | len(response) >> 8, len(response) & 0xFF]) + response[:ff_len])
+
+
+class SimulatedCanNetwork:
+  def __init__(self, ecus: list[SimulatedEcu], seed: int = 0, recv_timeout: float = 0.01, poll_time: float = 0.0001):
+    self.ecus = ecus
+    self.listeners: dict[int, list[SimulatedEcu]] = {}
+    for ecu in ecus:
+      self.listeners.setdefault(ecu.tx_addr, []).append(ecu)
+      if ecu.functional:
+        self.listeners.setdefault(ecu.functional_addr, []).append(ecu)
+
+    self.rng = random.Random(seed)
+    self.recv_timeout = recv_timeout  # longest a blocking receive waits for a frame
+    self.poll_time = poll_time  # time a non-blocking receive takes
+    self.now = 0.
+    self.obd_multiplexing = True
+    self.events: list[tuple[float, int, CanData]] = []
+    self.num_events = 0
+
+    # counters for benchmarks
+    self.tx_frames = 0
+    self.rx_frames = 0
+    self.obd_toggles = 0
+
+  def monotonic(self) -> float:
+    return self.now
+
+  def sleep(self, seconds: float) -> None:
+    self.now += seconds
+
+  def deliver(self, t: float, msg: CanData) -> None:
+    self.num_events += 1
+    heapq.heappush(self.events, (t, self.num_events, msg))
+
+  def can_send(self, msgs: list[CanData]) -> None:
+    for msg in msgs:
+      self.tx_frames += 1
+      for ecu in self.listeners.get(msg.address, []):
+        ecu.recv(self, msg)
+
+  def can_recv(self, wait_for_one: bool = False) -> list[list[CanData]]:
+    if wait_for_one and not (self.events and self.events[0][0] <= self.now):
+      next_event = self.events[0][0] if self.events else float('inf')
+      self.now = min(next_event, self.now + self.recv_timeout)
+    else:
+      self.now += self.poll_time
+
+    msgs = []
+    while self.events and self.events[0][0] <= self.now:
+      msgs.append(heapq.heappop(self.events)[2])
+    self.rx_frames += len(msgs)
+    return [msgs] if msgs else []
+
+  def set_obd_multiplexing(self, obd_multiplexing: bool) -> None:
+    if obd_multiplexing != self.obd_multiplexing:
+      self.obd_multiplexing = obd_multiplexing
+      self.obd_toggles += 1
+      self.now += OBD_MULTIPLEXING_TOGGLE_TIME
+
+  @classmethod
+  def from_platform(cls, platform: str, vin: str = '1FAKEVN0000000000', fw_index: int = 0, seed: int = 0, **ecu_kwargs) -> 'SimulatedCanNetwork':
+    """The diagnostic ECUs of a platform answering its brand's FW queries from FW_VERSIONS, plus an OBD-II engine answering VIN queries"""
+    brand = MODEL_TO_BRAND[platform]
+    ecus = []
+    for (ecu_type, addr, sub_addr), versions in VERSIONS[brand][platform].items():
+      responses = platform_ecu_responses(FW_QUERY_CONFIGS[brand], ecu_type, versions[min(fw_index, len(versions) - 1)])
+      ecus.append(SimulatedEcu(addr, responses, sub_addr=sub_addr, **ecu_kwargs))
+
+    vin_ecu = next((ecu for ecu in ecus if ecu.tx_addr == VIN_ECU_ADDR and ecu.sub_addr is None), None)
+    if vin_ecu is None:
+      vin_ecu = SimulatedEcu(VIN_ECU_ADDR, {}, **ecu_kwargs)
+      ecus.append(vin_ecu)
+    vin_ecu.functional = True
+    for bus, obd_multiplexing in ((0, None), (1, True)):
+      vin_ecu.responses[(bus, obd_multiplexing, StdQueries.UDS_VIN_REQUEST)] = (StdQueries.UDS_VIN_RESPONSE + vin.encode(), 0x8)
+      vin_ecu.responses[(bus, obd_multiplexing, StdQueries.OBD_VIN_REQUEST)] = (StdQueries.OBD_VIN_RESPONSE + vin.encode(), 0x8)
+    vin_ecu.buses = {bus for bus, _, _ in vin_ecu.responses}
+    return cls(ecus, seed=seed)
+
+
+def platform_ecu_responses(config: FwQueryConfig, ecu_type, fw_version: bytes) -> EcuResponses:
+  """Answers to every step of each of the brand's requests the ECU is whitelisted for, the last step with fw_version"""
+  responses: EcuResponses = {}
+  for r in config.requests:
+    if len(r.whitelist_ecus) and ecu_type not in r.whitelist_ecus:
+      continue
+    for i, (request, response) in enumerate(zip(r.request, r.response, strict=True)):
+      if i == len(r.request) - 1:
+        response += fw_version
+      responses.setdefault((r.bus, _obd_key(r.bus, r.obd_multiplexing), request), (response, r.rx_offset))
+  return responses
+
+
+@contextmanager
+def simulated_time(network: SimulatedCanNetwork) -> Generator[SimulatedCanNetwork, None, None]:
+  with mock.patch("time.monotonic", network.monotonic), mock.patch("time.sleep", network.sleep):
+    yield network
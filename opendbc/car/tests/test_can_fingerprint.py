@@ -1,7 +1,7 @@
 import pytest
 from opendbc.car.can_definitions import CanData
 from opendbc.car.car_helpers import FRAME_FINGERPRINT, can_fingerprint
-from opendbc.car.fingerprints import _FINGERPRINTS as FINGERPRINTS
+from opendbc.car.fingerprints import _DEBUG_ADDRESS, _FINGERPRINTS as FINGERPRINTS, eliminate_incompatible_cars, is_valid_for_fingerprint
 
 
 class TestCanFingerprint:
@@ -21,6 +21,17 @@ class TestCanFingerprint:
       assert finger[1] == fingerprint
       assert finger[2] == {}
 
+  def test_eliminate_incompatible_cars(self):
+    # the fingerprint index must eliminate exactly the cars a scan over every fingerprint does
+    all_cars = list(FINGERPRINTS)
+    keys = {key for fingerprints in FINGERPRINTS.values() for fingerprint in fingerprints for key in fingerprint.items()}
+    keys |= {(address, length + 1) for address, length in keys} | {(1880, 8), (1880, 5), (0x800, 3)}
+    for address, length in sorted(keys):
+      msg = CanData(address=address, dat=b'\x00' * length, src=0)
+      expected = [car for car in all_cars if any(is_valid_for_fingerprint(msg, fp | _DEBUG_ADDRESS) for fp in FINGERPRINTS[car])]
+      assert eliminate_incompatible_cars(msg, all_cars) == expected
+      assert eliminate_incompatible_cars(msg, all_cars[::-1]) == expected[::-1]
+
   def test_timing(self, subtests):
     # just pick any CAN fingerprinting car
     car_model = "CHEVROLET_BOLT_EUV"
@@ -1,5 +1,8 @@
+import json
 import os
 import math
+import subprocess
+import sys
 import hypothesis.strategies as st
 import pytest
 from hypothesis import Phase, given, settings
@@ -7,7 +10,8 @@ from collections.abc import Callable
 from typing import Any
 
 from opendbc.car import DT_CTRL, CanData, structs
-from opendbc.car.car_helpers import interfaces
+from opendbc.car.car_helpers import interface_names, interfaces, load_interfaces
+from opendbc.car.common.basedir import BASEDIR
 from opendbc.car.fingerprints import FW_VERSIONS
 from opendbc.car.fw_versions import FW_QUERY_CONFIGS
 from opendbc.car.interfaces import CarInterfaceBase, get_interface_attr
@@ -157,3 +161,14 @@ class TestCarInterfaces:
     ret = get_interface_attr('FINGERPRINTS', ignore_none=True)
     none_brands_in_ret = none_brands.intersection(ret)
     assert len(none_brands_in_ret) == 0, f'Brands with None values in ignore_none=True result: {none_brands_in_ret}'
+
+  def test_lazy_interfaces(self):
+    """Asserts brand interfaces are only imported once one of their platforms is looked up"""
+    assert dict(interfaces) == load_interfaces(interface_names)
+
+    code = "import json, sys; from opendbc.car.car_helpers import interfaces; " + \
+           "loaded = lambda: sorted(m for m in sys.modules if m.startswith('opendbc.car.') and m.endswith('.interface')); " + \
+           "before = loaded(); interfaces['TOYOTA_RAV4']; print(json.dumps([before, loaded()]))"
+    before, after = json.loads(subprocess.check_output([sys.executable, '-c', code], cwd=os.path.dirname(os.path.dirname(BASEDIR))))
+    assert before == []
+    assert after == ['opendbc.car.toyota.interface']
@@ -4,12 +4,17 @@ import time
 from collections import defaultdict
 
 from opendbc.car.can_definitions import CanData
-from opendbc.car.car_helpers import interfaces
+from opendbc.car.car_helpers import fingerprint, interfaces
+from opendbc.car.ecu_addrs import SUB_ADDR_PROBE_SPACING, get_ecu_addrs
 from opendbc.car.structs import CarParams
+from opendbc.car.ecu_latency import ABSENT_AFTER_MISSES, REPROBE_ABSENT_EVERY, EcuLatencyModel
 from opendbc.car.fingerprints import FW_VERSIONS
-from opendbc.car.fw_versions import FW_QUERY_CONFIGS, FUZZY_EXCLUDE_ECUS, VERSIONS, build_fw_dict, \
-                                    match_fw_to_car, get_brand_ecu_matches, get_fw_versions, get_present_ecus
-from opendbc.car.vin import get_vin
+from opendbc.car.fw_versions import FW_QUERY_CONFIGS, FUZZY_EXCLUDE_ECUS, VERSIONS, ExactFwMatcher, build_fw_dict, get_fw_version_index, \
+                                    match_fw_to_car, match_fw_to_car_exact, get_brand_ecu_matches, get_fw_versions, get_fw_versions_ordered, \
+                                    get_present_ecus, plan_fw_queries
+from opendbc.car.tests.benchmark import simulate_fingerprinting
+from opendbc.car.tests.ecu_sim import SimulatedCanNetwork, simulated_time
+from opendbc.car.vin import VIN_UNKNOWN, get_vin
 
 CarFw = CarParams.CarFw
 Ecu = CarParams.Ecu
@@ -48,6 +53,39 @@ class TestFwFingerprint:
         if len(matches) != 0:
           self.assertFingerprints(matches, car_model)
 
+  def test_exact_match_extra_fw_versions(self):
+    # extra FW versions are matched without leaking into the cached index
+    brand, car_model = 'toyota', 'TOYOTA_RAV4_TSS2'
+    ecus = VERSIONS[brand][car_model]
+    live_fw_versions = {ecu[1:]: {b'\x01unknown'} for ecu in ecus}
+    extra_fw_versions = {car_model: {ecu: [b'\x01unknown'] for ecu in ecus}}
+
+    assert match_fw_to_car_exact(live_fw_versions, brand) == set()
+    assert match_fw_to_car_exact(live_fw_versions, brand, extra_fw_versions=extra_fw_versions) == {car_model}
+    assert match_fw_to_car_exact(live_fw_versions, brand) == set()
+
+  @pytest.mark.parametrize("brand", VERSIONS.keys())
+  def test_exact_fw_matcher(self, brand):
+    # the streaming matcher only reports a match that the responses still pending can't change
+    rng = random.Random(0)
+    index = get_fw_version_index(brand)
+    addrs = sorted({ecu[1:] for ecus in VERSIONS[brand].values() for ecu in ecus}, key=str)
+    for ecus in VERSIONS[brand].values():
+      live_fw_versions: dict = defaultdict(set)
+      for (_, addr, sub_addr), versions in ecus.items():
+        if rng.random() > 0.1:
+          live_fw_versions[(addr, sub_addr)].add(rng.choice(versions))
+
+      expected = index.match_exact(live_fw_versions)
+      matcher = ExactFwMatcher(index, set(addrs))
+      for addr in rng.sample(addrs, len(addrs)):
+        for version in live_fw_versions.get(addr, set()):
+          matcher.update(addr, version)
+        if matcher.finish({addr}) is not None:
+          assert expected == {matcher.match}
+      assert matcher.match is None or expected == {matcher.match}
+      assert matcher.match is not None or len(expected) != 1
+
   @pytest.mark.parametrize("brand, car_model, ecus", [(b, c, e[c]) for b, e in VERSIONS.items() for c in e])
   def test_custom_fuzzy_match(self, brand, car_model, ecus):
     # Assert brand-specific fuzzy fingerprinting function doesn't disagree with standard fuzzy function
@@ -188,6 +226,161 @@ class TestFwFingerprint:
     assert True in brand_matches['toyota']
     assert not any(any(e) for b, e in brand_matches.items() if b != 'toyota')
 
+  def test_fw_query_plan(self, mocker):
+    # body and psa send the same request on the same bus, which should be one query answered for both brands
+    plan = plan_fw_queries({brand: VERSIONS[brand] for brand in ('body', 'psa')})
+    assert len(plan.queries) == 1
+    assert {t[0] for targets in plan.queries[0].targets.values() for t in targets} == {'body', 'psa'}
+
+    responses = {addr: b'version' for addr in plan.queries[0].targets}
+    mocker.patch("opendbc.car.isotp_parallel_query.IsoTpParallelQuery.get_data", lambda *args, **kwargs: responses)
+    car_fw = get_fw_versions(lambda **kwargs: [], lambda msgs: None, lambda obd: None, extra={'psa': VERSIONS['psa']}, query_brand='body')
+    assert {(fw.brand, fw.address) for fw in car_fw} == {(t[0], addr[0]) for addr, targets in plan.queries[0].targets.items() for t in targets}
+
+    # merging across brands is faster than querying brand by brand, and toggles OBD multiplexing at most once
+    for num_pandas in (1, 2):
+      all_brands = plan_fw_queries(VERSIONS, num_pandas)
+      brand_by_brand = sum(plan_fw_queries({brand: versions}, num_pandas).expected_time(0.1) for brand, versions in VERSIONS.items())
+      assert all_brands.expected_time(0.1) < brand_by_brand
+      assert all_brands.num_obd_toggles() <= 1
+
+  @pytest.mark.parametrize("car_model, ecu_kwargs", [(next(iter(cars)), kwargs) for cars in VERSIONS.values() if len(cars)
+                                                      for kwargs in ({}, {'latency': 0.02, 'separation_time': 5, 'response_pending': 1})])
+  def test_simulated_fingerprint(self, car_model, ecu_kwargs):
+    # the full VIN, present ECU and FW query sequence ends in an exact match on a simulated car
+    network = SimulatedCanNetwork.from_platform(car_model, **ecu_kwargs)
+    times = simulate_fingerprinting(network)
+    assert times['exact_match']
+    assert 0 < times['total'] < 10
+
+  def test_present_ecus_early_exit(self):
+    # sub-addressed ECUs are probed in the same window, which ends once every queried ECU answered
+    network = SimulatedCanNetwork.from_platform('TOYOTA_RAV4_TSS2')
+    queries = {(ecu.tx_addr, ecu.sub_addr, 0) for ecu in network.ecus}
+    query_responses = {(addr, sub_addr, bus): {(addr + 8, sub_addr, bus)} for addr, sub_addr, bus in queries}
+    responses = set().union(*query_responses.values())
+    assert any(sub_addr is not None for _, sub_addr, _ in queries)
+
+    with simulated_time(network):
+      assert get_ecu_addrs(network.can_recv, network.can_send, queries, responses, timeout=0.1, query_responses=query_responses) == responses
+      assert network.now < 0.05
+
+      # without knowing which responses to expect, every probe waits out the timeout
+      start_time = network.now
+      assert get_ecu_addrs(network.can_recv, network.can_send, queries, responses, timeout=0.1) == responses
+      assert network.now - start_time >= 0.1
+
+  @pytest.mark.parametrize("car_model", [next(iter(cars)) for cars in VERSIONS.values() if len(cars)])
+  def test_latency_model(self, car_model):
+    # a latency model learned on previous starts speeds up fingerprinting the same car, and is forgotten on another
+    ecu_kwargs = {'latency': 0.02, 'separation_time': 5}
+    latency_model = EcuLatencyModel()
+    cold = simulate_fingerprinting(SimulatedCanNetwork.from_platform(car_model, **ecu_kwargs), latency_model=latency_model)
+    simulate_fingerprinting(SimulatedCanNetwork.from_platform(car_model, **ecu_kwargs), latency_model=latency_model)
+
+    latency_model = EcuLatencyModel.from_json(latency_model.to_json())
+    warm = simulate_fingerprinting(SimulatedCanNetwork.from_platform(car_model, **ecu_kwargs), latency_model=latency_model)
+    assert cold['exact_match'] and warm['exact_match']
+    assert warm['present_ecus'] < cold['present_ecus']
+    assert warm['total'] < cold['total']
+
+    other_car = SimulatedCanNetwork.from_platform(car_model, vin='1FAKEVN0000000001', **ecu_kwargs)
+    assert simulate_fingerprinting(other_car, latency_model=latency_model) == cold
+    assert latency_model.vin == '1FAKEVN0000000001'
+
+  @pytest.mark.parametrize("vin", [VIN_UNKNOWN, 'NOT A VIN'])
+  def test_latency_model_unknown_vin(self, vin):
+    # without a readable VIN the car could be any car, so the model is neither used nor changed
+    ecu_kwargs = {'latency': 0.02, 'separation_time': 5}
+    latency_model = EcuLatencyModel()
+    for _ in range(2):
+      simulate_fingerprinting(SimulatedCanNetwork.from_platform('TOYOTA_RAV4_TSS2', **ecu_kwargs), latency_model=latency_model)
+    learned = latency_model.to_json()
+
+    assert latency_model.for_vin(vin) is None
+    no_model = simulate_fingerprinting(SimulatedCanNetwork.from_platform('HONDA_CIVIC', vin=vin, **ecu_kwargs))
+    assert simulate_fingerprinting(SimulatedCanNetwork.from_platform('HONDA_CIVIC', vin=vin, **ecu_kwargs), latency_model=latency_model) == no_model
+    assert latency_model.to_json() == learned
+
+  def test_latency_model_reprobe(self):
+    # ECUs assumed absent are queried again every REPROBE_ABSENT_EVERY starts, and are no longer skipped once they respond
+    key = (0, 0x7e0, None, b'\x3e\x00')
+    latency_model = EcuLatencyModel('1FAKEVN0000000000')
+    for _ in range(ABSENT_AFTER_MISSES):
+      assert not latency_model.skip_query(key)
+      latency_model.record(key, None)
+
+    for _ in range(3):
+      latency_model = EcuLatencyModel.from_json(latency_model.to_json())
+      skipped = [latency_model.skip_query(key) for _ in range(REPROBE_ABSENT_EVERY)]
+      assert skipped == [True] * (REPROBE_ABSENT_EVERY - 1) + [False]
+      latency_model.record(key, None)
+
+    assert latency_model.skip_query(key)
+    latency_model.record(key, 0.01)
+    assert not any(latency_model.skip_query(key) for _ in range(REPROBE_ABSENT_EVERY * 2))
+
+  def test_fingerprint_stop_on_exact_match(self, mocker):
+    # fingerprint only stops querying early when asked to, by default carFw has every FW version of the car
+    # the simulated car sends no periodic messages to CAN fingerprint on
+    mocker.patch("opendbc.car.car_helpers.can_fingerprint", return_value=(None, {}))
+    results = []
+    for stop_on_exact_match in (False, True):
+      network = SimulatedCanNetwork.from_platform('TOYOTA_RAV4_TSS2')
+      with simulated_time(network):
+        candidate, _, _, car_fw, source, exact_match = fingerprint(network.can_recv, network.can_send, network.set_obd_multiplexing, 1, None, None,
+                                                                   stop_on_exact_match=stop_on_exact_match)
+      assert (candidate, source, exact_match) == ('TOYOTA_RAV4_TSS2', CarParams.FingerprintSource.fw, True)
+      results.append([fw.to_dict() for fw in car_fw if fw.brand == 'toyota'])
+
+    full_fw, stop_fw = results
+    assert {(fw['ecu'], fw['address']) for fw in full_fw} == {(ECU_NAME[ecu], addr) for ecu, addr, _ in VERSIONS['toyota']['TOYOTA_RAV4_TSS2']}
+    assert len(stop_fw) < len(full_fw) and all(fw in full_fw for fw in stop_fw)
+
+  def test_latency_model_slow_response(self):
+    # an ECU responding after its learned deadline is queried again with the full timeout, so its FW version isn't dropped
+    latency_model = EcuLatencyModel('1FAKEVN0000000000')
+
+    def query(slow_latency: float = None):
+      network = SimulatedCanNetwork.from_platform('TOYOTA_RAV4_TSS2')
+      if slow_latency is not None:
+        for ecu in network.ecus:
+          ecu.latency = slow_latency
+      with simulated_time(network):
+        network.set_obd_multiplexing(True)
+        ecu_rx_addrs = get_present_ecus(network.can_recv, network.can_send, network.set_obd_multiplexing, latency_model=latency_model)
+        car_fw = get_fw_versions(network.can_recv, network.can_send, network.set_obd_multiplexing, query_brand='toyota', latency_model=latency_model)
+      return ecu_rx_addrs, [fw.to_dict() for fw in car_fw]
+
+    expected = query()
+    assert query() == expected
+    assert query(slow_latency=0.05) == expected
+
+  @pytest.mark.parametrize("brand", VERSIONS.keys())
+  def test_fw_versions_ordered_complete(self, brand):
+    # stopping at the brand with an exact match returns all of its FW versions, the same as querying it in full.
+    # stop_on_exact_match can skip some of them, but never changes the match
+    vin = '1FAKEVN0000000000'
+    for seed, car_model in enumerate(VERSIONS[brand]):
+      results = []
+      for query in ('ordered', 'stop_on_exact_match', 'full'):
+        network = SimulatedCanNetwork.from_platform(car_model, vin=vin, seed=seed)
+        with simulated_time(network):
+          network.set_obd_multiplexing(True)
+          if query == 'full':
+            car_fw = get_fw_versions(network.can_recv, network.can_send, network.set_obd_multiplexing, query_brand=brand)
+          else:
+            ecu_rx_addrs = get_present_ecus(network.can_recv, network.can_send, network.set_obd_multiplexing)
+            car_fw = get_fw_versions_ordered(network.can_recv, network.can_send, network.set_obd_multiplexing, vin, ecu_rx_addrs,
+                                             stop_on_exact_match=query == 'stop_on_exact_match')
+        car_fw = [fw for fw in car_fw if fw.brand == brand]
+        results.append((match_fw_to_car(car_fw, vin, log=False), [fw.to_dict() for fw in car_fw]))
+
+      (ordered_match, ordered_fw), (stop_match, stop_fw), (full_match, full_fw) = results
+      assert ordered_fw == full_fw, car_model
+      assert ordered_match == stop_match == full_match, car_model
+      assert all(fw in full_fw for fw in stop_fw), car_model
+
 
 class TestFwFingerprintTiming:
   N: int = 5
@@ -212,7 +405,7 @@ class TestFwFingerprintTiming:
       self.current_obd_multiplexing = obd_multiplexing
       self.total_time += 0.1 / 2
 
-  def fake_get_data(self, timeout):
+  def fake_get_data(self, timeout, timeouts=None):
     self.total_time += timeout
     return {}
 
@@ -236,10 +429,11 @@ class TestFwFingerprintTiming:
   def test_startup_timing(self, subtests, mocker):
     # Tests worse-case VIN query time and typical present ECU query time
     vin_ref_times = {'worst': 1.6, 'best': 0.8}  # best assumes we go through all queries to get a match
-    present_ecu_ref_time = 0.45
+    present_ecu_ref_time = 0.27
 
-    def fake_get_ecu_addrs(*_, timeout):
-      self.total_time += timeout
+    def fake_get_ecu_addrs(_, __, queries, *args, timeout, response_times=None, query_responses=None):
+      # no ECU responds, each sub-addressed probe after the first goes out later
+      self.total_time += timeout + max(sum(sub_addr is not None for _, sub_addr, _ in queries) - 1, 0) * SUB_ADDR_PROBE_SPACING
       return set()
 
     self.total_time = 0.0
@@ -0,0 +1,120 @@
+import time
+
+from opendbc.car import uds
+from opendbc.car.can_definitions import CanData
+from opendbc.car.fw_query_definitions import StdQueries
+from opendbc.car.isotp_parallel_query import IsoTpParallelQuery
+from opendbc.car.tests.ecu_sim import SimulatedCanNetwork, simulated_time
+
+REQUEST = b'\x22\xf1\x90' + b'\x00' * 20  # long enough to need consecutive frames
+RESPONSE = b'\x62\xf1\x90'
+
+
+class FakeEcu:
+  """Answers one multi-frame request with a multi-frame response, asking for separation_time between frames"""
+  def __init__(self, tx_addr: int, fw_version: bytes, separation_time: int = 0, sub_addr: int | None = None):
+    self.tx_addr = tx_addr
+    self.fw_version = fw_version
+    self.separation_time = separation_time
+    self.sub_addr = sub_addr
+    self.max_len = 8 if sub_addr is None else 7
+    self.rx_dat = b''
+    self.rx_len = 0
+    self.rx_times: list[float] = []
+    self.tx_frames: list[bytes] = []
+
+  def _pack(self, dat: bytes) -> bytes:
+    return dat if self.sub_addr is None else bytes([self.sub_addr]) + dat
+
+  def recv(self, dat: bytes) -> list[CanData]:
+    if self.sub_addr is not None:
+      if dat[0] != self.sub_addr:
+        return []
+      dat = dat[1:]
+
+    frame_type = dat[0] >> 4
+    if frame_type == 1:
+      self.rx_len = ((dat[0] & 0xF) << 8) + dat[1]
+      self.rx_dat = dat[2:]
+      self.rx_times = [time.monotonic()]
+      return [CanData(self.tx_addr + 8, self._pack(bytes([0x30, 0, self.separation_time]).ljust(self.max_len, b'\x00')), 0)]
+    elif frame_type == 2:
+      self.rx_dat += dat[1:]
+      self.rx_times.append(time.monotonic())
+      if len(self.rx_dat) >= self.rx_len:
+        # first frame of the response, the rest follows our flow control
+        response = RESPONSE + self.fw_version
+        if len(response) < self.max_len:
+          return [CanData(self.tx_addr + 8, self._pack(bytes([len(response)]) + response), 0)]
+        ff_len, cf_len = self.max_len - 2, self.max_len - 1
+        self.tx_frames = [response[i:i + cf_len].ljust(cf_len, b'\x00') for i in range(ff_len, len(response), cf_len)]
+        return [CanData(self.tx_addr + 8, self._pack(bytes([0x10, len(response)]) + response[:ff_len]), 0)]
+    elif frame_type == 3:
+      frames, self.tx_frames = self.tx_frames, []
+      return [CanData(self.tx_addr + 8, self._pack(bytes([0x21 + i]) + f), 0) for i, f in enumerate(frames)]
+    return []
+
+
+class FakeBus:
+  def __init__(self, ecus: list[FakeEcu]):
+    self.ecus = {(ecu.tx_addr, ecu.sub_addr): ecu for ecu in ecus}
+    self.rx_queue: list[CanData] = []
+    self.polls = 0  # non-blocking receives
+
+  def can_send(self, msgs: list[CanData]) -> None:
+    for msg in msgs:
+      for (tx_addr, _), ecu in self.ecus.items():
+        if msg.address == tx_addr:
+          self.rx_queue += ecu.recv(msg.dat)
+
+  def can_recv(self, wait_for_one: bool = False) -> list[list[CanData]]:
+    self.polls += not wait_for_one
+    msgs, self.rx_queue = self.rx_queue, []
+    return [msgs] if msgs else []
+
+
+class TestIsoTpParallelQuery:
+  def test_multi_frame_queries(self):
+    ecus = [FakeEcu(0x700 + i, f'FW-VERSION-{i}'.encode()) for i in range(16)]
+    ecus += [FakeEcu(0x750, b'SUB-ADDRESSED-FW', sub_addr=sub_addr) for sub_addr in (0xf, 0x10)]
+    bus = FakeBus(ecus)
+
+    query = IsoTpParallelQuery(bus.can_send, bus.can_recv, 0, [(e.tx_addr, e.sub_addr) for e in ecus], [REQUEST], [RESPONSE])
+    results = query.get_data(0.1)
+    assert results == {(e.tx_addr, e.sub_addr): e.fw_version for e in ecus}
+    assert all(ecu.rx_dat[:len(REQUEST)] == REQUEST for ecu in ecus)
+
+  def test_separation_time_does_not_block(self):
+    # one ECU wants 20 ms between consecutive frames, the others should not wait on it
+    slow_ecu = FakeEcu(0x700, b'SLOW', separation_time=20)
+    ecus = [slow_ecu] + [FakeEcu(0x710 + i, b'FAST') for i in range(4)]
+    bus = FakeBus(ecus)
+
+    query = IsoTpParallelQuery(bus.can_send, bus.can_recv, 0, [e.tx_addr for e in ecus], [REQUEST], [RESPONSE])
+    results = query.get_data(0.1)
+    assert results == {(e.tx_addr, None): e.fw_version for e in ecus}
+
+    # consecutive frames of the slow ECU are spaced by its separation time
+    gaps = [b - a for a, b in zip(slow_ecu.rx_times[1:], slow_ecu.rx_times[2:], strict=False)]
+    assert len(gaps) and min(gaps) >= 0.02
+    # while the fast ECUs received every frame right away
+    assert all(ecu.rx_times[-1] - ecu.rx_times[0] < 0.02 for ecu in ecus[1:])
+    # waiting on the separation time sleeps instead of polling the socket in a tight loop
+    assert bus.polls < 50
+
+  def test_functional_query_sessions(self, mocker):
+    # with functional addrs, only the physical addrs that respond get an ISO-TP session
+    vin = '1FAKEVIN000000000'
+    network = SimulatedCanNetwork.from_platform('TOYOTA_RAV4', vin=vin)
+    tx_addrs = [a for a in range(0x700, 0x800) if a != 0x7DF] + list(range(0x18DA00F1, 0x18DB00F1, 0x100))
+    create_isotp_msg = mocker.spy(IsoTpParallelQuery, '_create_isotp_msg')
+
+    with simulated_time(network):
+      query = IsoTpParallelQuery(network.can_send, network.can_recv, 0, tx_addrs, [StdQueries.UDS_VIN_REQUEST], [StdQueries.UDS_VIN_RESPONSE],
+                                 functional_addrs=uds.FUNCTIONAL_ADDRS)
+      results = query.get_data(0.1)
+
+    assert results == {(0x7e0, None): vin.encode()}
+    assert create_isotp_msg.call_count == len(uds.FUNCTIONAL_ADDRS) + 1
+    # other ECUs still had the full timeout to respond
+    assert network.now >= 0.1
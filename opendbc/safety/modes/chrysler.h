@@ -30,34 +30,11 @@ static uint32_t chrysler_get_checksum(const CANPacket_t *msg) {
 }
 
 static uint32_t chrysler_compute_checksum(const CANPacket_t *msg) {
-  // TODO: clean this up
-  // http://illmatics.com/Remote%20Car%20Hacking.pdf
+  // CRC-8 J1850 over all but the checksum byte, http://illmatics.com/Remote%20Car%20Hacking.pdf
   uint8_t checksum = 0xFFU;
   int len = GET_LEN(msg);
   for (int j = 0; j < (len - 1); j++) {
-    uint8_t shift = 0x80U;
-    uint8_t curr = (uint8_t)msg->data[j];
-    for (int i=0; i<8; i++) {
-      uint8_t bit_sum = curr & shift;
-      uint8_t temp_chk = checksum & 0x80U;
-      if (bit_sum != 0U) {
-        bit_sum = 0x1C;
-        if (temp_chk != 0U) {
-          bit_sum = 1;
-        }
-        checksum = checksum << 1;
-        temp_chk = checksum | 1U;
-        bit_sum ^= temp_chk;
-      } else {
-        if (temp_chk != 0U) {
-          bit_sum = 0x1D;
-        }
-        checksum = checksum << 1;
-        bit_sum ^= checksum;
-      }
-      checksum = bit_sum;
-      shift = shift >> 1;
-    }
+    checksum = crc8_lut_j1850[checksum ^ (uint8_t)msg->data[j]];
   }
   return (uint8_t)(~checksum);
 }
@@ -21,20 +21,13 @@ static uint32_t rivian_get_checksum(const CANPacket_t *msg) {
   return chksum;
 }
 
-static uint8_t _rivian_compute_checksum(const CANPacket_t *msg, uint8_t poly, uint8_t xor_output) {
+static uint8_t _rivian_compute_checksum(const CANPacket_t *msg, uint8_t xor_output) {
   int len = GET_LEN(msg);
 
+  // CRC-8 J1850, skipping the checksum byte
   uint8_t crc = 0;
-  // Skip the checksum byte
   for (int i = 1; i < len; i++) {
-    crc ^= msg->data[i];
-    for (int j = 0; j < 8; j++) {
-      if ((crc & 0x80U) != 0U) {
-        crc = (crc << 1) ^ poly;
-      } else {
-        crc <<= 1;
-      }
-    }
+    crc = crc8_lut_j1850[crc ^ msg->data[i]];
   }
   return crc ^ xor_output;
 }
@@ -42,9 +35,9 @@ static uint8_t _rivian_compute_checksum(const CANPacket_t *msg, uint8_t poly, ui
 static uint32_t rivian_compute_checksum(const CANPacket_t *msg) {
   uint8_t chksum = 0;
   if (msg->addr == 0x208U) {
-    chksum = _rivian_compute_checksum(msg, 0x1D, 0xB1);
+    chksum = _rivian_compute_checksum(msg, 0xB1);
   } else if (msg->addr == 0x150U) {
-    chksum = _rivian_compute_checksum(msg, 0x1D, 0x9A);
+    chksum = _rivian_compute_checksum(msg, 0x9A);
   } else {
   }
   return chksum;
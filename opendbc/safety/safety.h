@@ -104,34 +104,119 @@ static bool is_msg_valid(RxCheck addr_list[], int index) {
   return valid;
 }
 
-static int get_addr_check_index(const CANPacket_t *msg, RxCheck addr_list[], const int len) {
-  int addr = msg->addr;
-  int length = GET_LEN(msg);
+// lookup tables of the current safety config, built by set_safety_hooks so the hooks don't scan the config for every message
+static SafetyLutEntry rx_check_lut[SAFETY_LUT_SIZE];
+static SafetyLutEntry tx_msg_lut[SAFETY_LUT_SIZE];
+static int relay_check_msgs_len = 0;
+
+#define TX_MSG_WHITELISTED 1U       // a tx msg with the addr, bus and len
+#define TX_MSG_CHECK_RELAY 2U       // a tx msg with the addr and bus checking for relay malfunctions
+#define TX_MSG_STATIC_BLOCKING 4U   // a tx msg with the addr and bus blocking its forwarding
+
+static uint32_t safety_lut_hash(int addr, unsigned int bus) {
+  // Fibonacci hashing, the top SAFETY_LUT_BITS bits of the product
+  return ((((uint32_t)addr) ^ (bus << 29U)) * 2654435761U) >> (32U - SAFETY_LUT_BITS);
+}
+
+static bool safety_lut_insert(SafetyLutEntry lut[], int addr, unsigned int bus, int len, int index, uint8_t msg_index) {
+  const uint32_t hash = safety_lut_hash(addr, bus);
+  bool inserted = false;
+  for (uint32_t i = 0U; (i < SAFETY_LUT_SIZE) && !inserted; i++) {
+    SafetyLutEntry *entry = &lut[(hash + i) % SAFETY_LUT_SIZE];
+    if (entry->index == -1) {
+      entry->addr = addr;
+      entry->bus = bus;
+      entry->len = len;
+      entry->index = index;
+      entry->msg_index = msg_index;
+      inserted = true;
+    }
+  }
+  return inserted;
+}
+
+// returns false if the config doesn't fit in the tables
+static bool safety_lut_build(const safety_config *cfg) {
+  bool fits = true;
+  for (uint32_t i = 0U; i < SAFETY_LUT_SIZE; i++) {
+    rx_check_lut[i].index = -1;
+    tx_msg_lut[i].index = -1;
+  }
+  relay_check_msgs_len = 0;
+
+  for (int i = 0; i < cfg->rx_checks_len; i++) {
+    for (uint8_t j = 0U; (j < MAX_ADDR_CHECK_MSGS) && (cfg->rx_checks[i].msg[j].addr != 0); j++) {
+      const CanMsgCheck *m = &cfg->rx_checks[i].msg[j];
+      fits = safety_lut_insert(rx_check_lut, m->addr, m->bus, m->len, i, j) && fits;
+    }
+  }
+  for (int i = 0; i < cfg->tx_msgs_len; i++) {
+    const CanMsg *m = &cfg->tx_msgs[i];
+    fits = safety_lut_insert(tx_msg_lut, m->addr, m->bus, m->len, i, 0U) && fits;
+    if (m->check_relay) {
+      relay_check_msgs_len++;
+    }
+  }
+  return fits;
+}
+
+static int get_addr_check_index(const CANPacket_t *msg, RxCheck addr_list[]) {
+  const int addr = msg->addr;
+  const unsigned int bus = msg->bus;
+  const int length = GET_LEN(msg);
 
+  // the first rx check in the config that has seen this msg, or any of its msgs if it hasn't seen one yet
   int index = -1;
-  for (int i = 0; i < len; i++) {
-    // if multiple msgs are allowed, determine which one is present on the bus
-    if (!addr_list[i].status.msg_seen) {
-      for (uint8_t j = 0U; (j < MAX_ADDR_CHECK_MSGS) && (addr_list[i].msg[j].addr != 0); j++) {
-        if ((addr == addr_list[i].msg[j].addr) && (msg->bus == addr_list[i].msg[j].bus) &&
-              (length == addr_list[i].msg[j].len)) {
-          addr_list[i].status.index = j;
-          addr_list[i].status.msg_seen = true;
-          break;
-        }
+  uint8_t msg_index = 0U;
+  const uint32_t hash = safety_lut_hash(addr, bus);
+  bool probing = true;
+  for (uint32_t i = 0U; (i < SAFETY_LUT_SIZE) && probing; i++) {
+    const SafetyLutEntry *entry = &rx_check_lut[(hash + i) % SAFETY_LUT_SIZE];
+    if (entry->index == -1) {
+      probing = false;
+    } else if ((entry->addr == addr) && (entry->bus == bus) && (entry->len == length)) {
+      const RxStatus *status = &addr_list[entry->index].status;
+      const bool earlier = (index == -1) || (entry->index < index) || ((entry->index == index) && (entry->msg_index < msg_index));
+      if (earlier && (!status->msg_seen || (status->index == entry->msg_index))) {
+        index = entry->index;
+        msg_index = entry->msg_index;
       }
+    } else {
     }
+  }
+
+  // if multiple msgs are allowed, the first one seen on the bus is the one checked
+  if ((index != -1) && !addr_list[index].status.msg_seen) {
+    addr_list[index].status.index = msg_index;
+    addr_list[index].status.msg_seen = true;
+  }
+  return index;
+}
 
-    if (addr_list[i].status.msg_seen) {
-      int idx = addr_list[i].status.index;
-      if ((addr == addr_list[i].msg[idx].addr) && (msg->bus == addr_list[i].msg[idx].bus) &&
-          (length == addr_list[i].msg[idx].len)) {
-        index = i;
-        break;
+// TX_MSG_* flags of the current config's tx msgs with addr on bus
+static uint8_t get_tx_msg_flags(int addr, unsigned int bus, int len) {
+  uint8_t flags = 0U;
+  const uint32_t hash = safety_lut_hash(addr, bus);
+  bool probing = true;
+  for (uint32_t i = 0U; (i < SAFETY_LUT_SIZE) && probing; i++) {
+    const SafetyLutEntry *entry = &tx_msg_lut[(hash + i) % SAFETY_LUT_SIZE];
+    if (entry->index == -1) {
+      probing = false;
+    } else if ((entry->addr == addr) && (entry->bus == bus)) {
+      const CanMsg *m = &current_safety_config.tx_msgs[entry->index];
+      if (entry->len == len) {
+        flags |= TX_MSG_WHITELISTED;
       }
+      if (m->check_relay) {
+        flags |= TX_MSG_CHECK_RELAY;
+        if (!m->disable_static_blocking) {
+          flags |= TX_MSG_STATIC_BLOCKING;
+        }
+      }
+    } else {
     }
   }
-  return index;
+  return flags;
 }
 
 static void update_addr_timestamp(RxCheck addr_list[], int index) {
@@ -152,9 +237,9 @@ static void update_counter(RxCheck addr_list[], int index, uint8_t counter) {
 
 static bool rx_msg_safety_check(const CANPacket_t *msg,
                                 const safety_config *cfg,
-                                const safety_hooks *safety_hooks) {
+                                const safety_hooks *safety_hooks,
+                                int index) {
 
-  int index = get_addr_check_index(msg, cfg->rx_checks, cfg->rx_checks_len);
   update_addr_timestamp(cfg->rx_checks, index);
 
   if (index != -1) {
@@ -188,8 +273,9 @@ static bool rx_msg_safety_check(const CANPacket_t *msg,
 bool safety_rx_hook(const CANPacket_t *msg) {
   bool controls_allowed_prev = controls_allowed;
 
-  bool valid = rx_msg_safety_check(msg, &current_safety_config, current_hooks);
-  bool whitelisted = get_addr_check_index(msg, current_safety_config.rx_checks, current_safety_config.rx_checks_len) != -1;
+  int index = get_addr_check_index(msg, current_safety_config.rx_checks);
+  bool valid = rx_msg_safety_check(msg, &current_safety_config, current_hooks, index);
+  bool whitelisted = index != -1;
   if (valid && whitelisted) {
     current_hooks->rx(msg);
   }
@@ -200,12 +286,10 @@ bool safety_rx_hook(const CANPacket_t *msg) {
   // the relay malfunction hook runs on all incoming rx messages.
   // check all applicable tx msgs for liveness on sending bus.
   // used to detect a relay malfunction or control messages from disabled ECUs like the radar
-  const int addr = msg->addr;
-  for (int i = 0; i < current_safety_config.tx_msgs_len; i++) {
-    const CanMsg *m = &current_safety_config.tx_msgs[i];
-    if (m->check_relay) {
-      stock_ecu_check((m->addr == addr) && (m->bus == msg->bus));
-    }
+  // stock_ecu_check also updates the MADS state, once for each tx msg checking for relay malfunctions
+  const bool stock_ecu_detected = (get_tx_msg_flags(msg->addr, msg->bus, -1) & TX_MSG_CHECK_RELAY) != 0U;
+  for (int i = 0; i < relay_check_msgs_len; i++) {
+    stock_ecu_check(stock_ecu_detected);
   }
 
   // reset mismatches on rising edge of controls_allowed to avoid rare race condition
@@ -216,22 +300,8 @@ bool safety_rx_hook(const CANPacket_t *msg) {
   return valid;
 }
 
-static bool tx_msg_safety_check(const CANPacket_t *msg, const CanMsg msg_list[], int len) {
-  int addr = msg->addr;
-  int length = GET_LEN(msg);
-
-  bool whitelisted = false;
-  for (int i = 0; i < len; i++) {
-    if ((addr == msg_list[i].addr) && (msg->bus == msg_list[i].bus) && (length == msg_list[i].len)) {
-      whitelisted = true;
-      break;
-    }
-  }
-  return whitelisted;
-}
-
 bool safety_tx_hook(CANPacket_t *msg) {
-  bool whitelisted = tx_msg_safety_check(msg, current_safety_config.tx_msgs, current_safety_config.tx_msgs_len);
+  bool whitelisted = (get_tx_msg_flags(msg->addr, msg->bus, GET_LEN(msg)) & TX_MSG_WHITELISTED) != 0U;
   if ((current_safety_mode == SAFETY_ALLOUTPUT) || (current_safety_mode == SAFETY_ELM327)) {
     whitelisted = true;
   }
@@ -262,14 +332,8 @@ int safety_fwd_hook(int bus_num, int addr) {
   // Block messages that are being checked for relay malfunctions. Safety modes can opt out of this
   // in the case of selective AEB forwarding
   const int destination_bus = get_fwd_bus(bus_num);
-  if (!blocked) {
-    for (int i = 0; i < current_safety_config.tx_msgs_len; i++) {
-      const CanMsg *m = &current_safety_config.tx_msgs[i];
-      if (m->check_relay && !m->disable_static_blocking && (m->addr == addr) && (m->bus == (unsigned int)destination_bus)) {
-        blocked = true;
-        break;
-      }
-    }
+  if (!blocked && (destination_bus != -1)) {
+    blocked = (get_tx_msg_flags(addr, (unsigned int)destination_bus, -1) & TX_MSG_STATIC_BLOCKING) != 0U;
   }
 
   if (!blocked && (current_hooks->fwd != NULL)) {
@@ -279,6 +343,32 @@ int safety_fwd_hook(int bus_num, int addr) {
   return blocked ? -1 : destination_bus;
 }
 
+// CRC-8 poly 0x1D, aka SAE J1850, for the modes using it
+const uint8_t crc8_lut_j1850[256] = {
+  0x00U, 0x1DU, 0x3AU, 0x27U, 0x74U, 0x69U, 0x4EU, 0x53U, 0xE8U, 0xF5U, 0xD2U, 0xCFU,
+  0x9CU, 0x81U, 0xA6U, 0xBBU, 0xCDU, 0xD0U, 0xF7U, 0xEAU, 0xB9U, 0xA4U, 0x83U, 0x9EU,
+  0x25U, 0x38U, 0x1FU, 0x02U, 0x51U, 0x4CU, 0x6BU, 0x76U, 0x87U, 0x9AU, 0xBDU, 0xA0U,
+  0xF3U, 0xEEU, 0xC9U, 0xD4U, 0x6FU, 0x72U, 0x55U, 0x48U, 0x1BU, 0x06U, 0x21U, 0x3CU,
+  0x4AU, 0x57U, 0x70U, 0x6DU, 0x3EU, 0x23U, 0x04U, 0x19U, 0xA2U, 0xBFU, 0x98U, 0x85U,
+  0xD6U, 0xCBU, 0xECU, 0xF1U, 0x13U, 0x0EU, 0x29U, 0x34U, 0x67U, 0x7AU, 0x5DU, 0x40U,
+  0xFBU, 0xE6U, 0xC1U, 0xDCU, 0x8FU, 0x92U, 0xB5U, 0xA8U, 0xDEU, 0xC3U, 0xE4U, 0xF9U,
+  0xAAU, 0xB7U, 0x90U, 0x8DU, 0x36U, 0x2BU, 0x0CU, 0x11U, 0x42U, 0x5FU, 0x78U, 0x65U,
+  0x94U, 0x89U, 0xAEU, 0xB3U, 0xE0U, 0xFDU, 0xDAU, 0xC7U, 0x7CU, 0x61U, 0x46U, 0x5BU,
+  0x08U, 0x15U, 0x32U, 0x2FU, 0x59U, 0x44U, 0x63U, 0x7EU, 0x2DU, 0x30U, 0x17U, 0x0AU,
+  0xB1U, 0xACU, 0x8BU, 0x96U, 0xC5U, 0xD8U, 0xFFU, 0xE2U, 0x26U, 0x3BU, 0x1CU, 0x01U,
+  0x52U, 0x4FU, 0x68U, 0x75U, 0xCEU, 0xD3U, 0xF4U, 0xE9U, 0xBAU, 0xA7U, 0x80U, 0x9DU,
+  0xEBU, 0xF6U, 0xD1U, 0xCCU, 0x9FU, 0x82U, 0xA5U, 0xB8U, 0x03U, 0x1EU, 0x39U, 0x24U,
+  0x77U, 0x6AU, 0x4DU, 0x50U, 0xA1U, 0xBCU, 0x9BU, 0x86U, 0xD5U, 0xC8U, 0xEFU, 0xF2U,
+  0x49U, 0x54U, 0x73U, 0x6EU, 0x3DU, 0x20U, 0x07U, 0x1AU, 0x6CU, 0x71U, 0x56U, 0x4BU,
+  0x18U, 0x05U, 0x22U, 0x3FU, 0x84U, 0x99U, 0xBEU, 0xA3U, 0xF0U, 0xEDU, 0xCAU, 0xD7U,
+  0x35U, 0x28U, 0x0FU, 0x12U, 0x41U, 0x5CU, 0x7BU, 0x66U, 0xDDU, 0xC0U, 0xE7U, 0xFAU,
+  0xA9U, 0xB4U, 0x93U, 0x8EU, 0xF8U, 0xE5U, 0xC2U, 0xDFU, 0x8CU, 0x91U, 0xB6U, 0xABU,
+  0x10U, 0x0DU, 0x2AU, 0x37U, 0x64U, 0x79U, 0x5EU, 0x43U, 0xB2U, 0xAFU, 0x88U, 0x95U,
+  0xC6U, 0xDBU, 0xFCU, 0xE1U, 0x5AU, 0x47U, 0x60U, 0x7DU, 0x2EU, 0x33U, 0x14U, 0x09U,
+  0x7FU, 0x62U, 0x45U, 0x58U, 0x0BU, 0x16U, 0x31U, 0x2CU, 0x97U, 0x8AU, 0xADU, 0xB0U,
+  0xE3U, 0xFEU, 0xD9U, 0xC4U
+};
+
 // Given a CRC-8 poly, generate a static lookup table to use with a fast CRC-8
 // algorithm. Called at init time for safety modes using CRC-8.
 void gen_crc_lookup_table_8(uint8_t poly, uint8_t crc_lut[]) {
@@ -484,6 +574,21 @@ int set_safety_hooks(uint16_t mode, uint16_t param) {
       current_safety_config.rx_checks[j].status = (RxStatus){0};
     }
   }
+  if (!safety_lut_build(&current_safety_config)) {
+    // the config doesn't fit the lookup tables, fall back to no output instead of running the mode half configured
+    current_hooks = &nooutput_hooks;
+    current_safety_mode = SAFETY_NOOUTPUT;
+    current_safety_param = 0U;
+    safety_config cfg = nooutput_hooks.init(0U);
+    current_safety_config.rx_checks = cfg.rx_checks;
+    current_safety_config.rx_checks_len = cfg.rx_checks_len;
+    current_safety_config.tx_msgs = cfg.tx_msgs;
+    current_safety_config.tx_msgs_len = cfg.tx_msgs_len;
+    current_safety_config.disable_forwarding = cfg.disable_forwarding;
+    controls_allowed = false;
+    (void)safety_lut_build(&current_safety_config);
+    set_status = -1;
+  }
   return set_status;
 }
 
@@ -194,6 +194,19 @@ typedef struct {
   RxStatus status;
 } RxCheck;
 
+// slot of a lookup table from addr and bus to the rx checks or tx msgs of the current safety config
+typedef struct {
+  int addr;
+  unsigned int bus;
+  int len;
+  int index;          // index in rx_checks or tx_msgs, -1 for an empty slot
+  uint8_t msg_index;  // for rx checks, which of the check's messages
+} SafetyLutEntry;
+
+// at least twice the rx check messages and the tx msgs of any safety config
+#define SAFETY_LUT_BITS 6U
+#define SAFETY_LUT_SIZE (1U << SAFETY_LUT_BITS)
+
 typedef struct {
   RxCheck *rx_checks;
   int rx_checks_len;
@@ -230,6 +243,7 @@ void update_sample(struct sample_t *sample, int sample_new);
 bool get_longitudinal_allowed(void);
 int ROUND(float val);
 void gen_crc_lookup_table_8(uint8_t poly, uint8_t crc_lut[]);
+extern const uint8_t crc8_lut_j1850[256];  // CRC-8 poly 0x1D, aka SAE J1850
 void gen_crc_lookup_table_16(uint16_t poly, uint16_t crc_lut[]);
 bool steer_torque_cmd_checks(int desired_torque, int steer_req, const TorqueSteeringLimits limits);
 bool steer_angle_cmd_checks(int desired_angle, bool steer_control_enabled, const AngleSteeringLimits limits);
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+import random
+import time
+
+from opendbc.car.chrysler.values import ChryslerSafetyFlags
+from opendbc.car.ford.values import FordSafetyFlags
+from opendbc.car.honda.values import HondaSafetyFlags
+from opendbc.car.hyundai.values import HyundaiSafetyFlags
+from opendbc.car.structs import CarParams
+from opendbc.safety.tests.libsafety import libsafety_py
+
+MODES = [
+  ('toyota', CarParams.SafetyModel.toyota, 73),
+  ('hyundai canfd', CarParams.SafetyModel.hyundaiCanfd, HyundaiSafetyFlags.CANFD_LKA_STEERING | HyundaiSafetyFlags.EV_GAS),
+  ('honda bosch', CarParams.SafetyModel.hondaBosch, HondaSafetyFlags.BOSCH_LONG),
+  ('ford', CarParams.SafetyModel.ford, FordSafetyFlags.LONG_CONTROL),
+]
+
+# the modes validating checksums or counters on rx
+RX_CHECK_MODES = [
+  ('chrysler', CarParams.SafetyModel.chrysler, 0),
+  ('chrysler ram dt', CarParams.SafetyModel.chrysler, ChryslerSafetyFlags.RAM_DT),
+  ('honda bosch', CarParams.SafetyModel.hondaBosch, 0),
+  ('hyundai', CarParams.SafetyModel.hyundai, 0),
+  ('hyundai canfd', CarParams.SafetyModel.hyundaiCanfd, 0),
+  ('volkswagen mqb', CarParams.SafetyModel.volkswagen, 0),
+  ('volkswagen pq', CarParams.SafetyModel.volkswagenPq, 0),
+  ('subaru', CarParams.SafetyModel.subaru, 0),
+  ('toyota', CarParams.SafetyModel.toyota, 73),
+  ('ford', CarParams.SafetyModel.ford, 0),
+  ('rivian', CarParams.SafetyModel.rivian, 0),
+  ('tesla', CarParams.SafetyModel.tesla, 0),
+  ('psa', CarParams.SafetyModel.psa, 0),
+]
+
+
+def _rx_check_msgs() -> list[tuple[int, int, int]]:
+  # (addr, bus, len) of every msg of the current safety config's rx checks
+  addr, bus, length = (libsafety_py.ffi.new('int *') for _ in range(3))
+  msgs = []
+  for i in range(64):
+    for j in range(3):
+      if libsafety_py.libsafety.get_rx_check_msg(i, j, addr, bus, length):
+        msgs.append((addr[0], bus[0], length[0]))
+  return msgs
+
+
+def _frames(lengths: tuple[int, ...] = (8,)):
+  # every 11-bit addr received on each bus, then sent on bus 0, with each of lengths
+  msgs, flags = [], []
+  for length in lengths:
+    for addr in range(0x800):
+      for bus in (0, 1, 2):
+        msgs.append((addr, bus, bytes(length)))
+        flags.append(libsafety_py.REPLAY_RX)
+      msgs.append((addr, 0, bytes(length)))
+      flags.append(libsafety_py.REPLAY_TX)
+  return libsafety_py.make_ReplayFrames([i // 100 for i in range(len(msgs))], msgs, flags)
+
+
+def _benchmark_hooks(n: int = 20):
+  # CPU time of the rx, fwd and tx hooks of each mode, the safety_replay loop being a small part of it.
+  # cycle counts of the hooks on the panda's MCU aren't available here, this compares builds of libsafety on the host
+  frames = {lengths: _frames(lengths) for lengths in ((8,), (8, 32, 64))}
+  for name, mode, param in MODES:
+    lengths = (8, 32, 64) if mode == CarParams.SafetyModel.hyundaiCanfd else (8,)
+    ets = []
+    for _ in range(n):
+      libsafety_py.libsafety.set_safety_hooks(mode, param)
+      t1 = time.process_time_ns()
+      libsafety_py.safety_replay(frames[lengths])
+      t2 = time.process_time_ns()
+      ets.append(t2 - t1)
+
+    et = min(ets)
+    print(f'{name:>13}: {len(frames[lengths])} frames in {et / 1e6:.1f}ms, avg: {et / len(frames[lengths]):.0f}ns per frame')
+
+
+def _benchmark_rx_checks(frames: int = 2000, n: int = 10):
+  # CPU time of the rx hook for each msg with rx checks, random payloads so the checksums and counters mostly fail,
+  # which still computes them. Msgs without rx checks show the cost of the hooks alone
+  rng = random.Random(0)
+  for name, mode, param in RX_CHECK_MODES:
+    libsafety_py.libsafety.set_safety_hooks(mode, param)
+    msgs = _rx_check_msgs() + [(0x7FF, 0, 8)]
+    print(f'{name}:')
+    for addr, bus, length in msgs:
+      replay = libsafety_py.make_ReplayFrames(list(range(frames)), [(addr, bus, rng.randbytes(length)) for _ in range(frames)],
+                                              [libsafety_py.REPLAY_RX] * frames)
+      ets = []
+      for _ in range(n):
+        libsafety_py.libsafety.set_safety_hooks(mode, param)
+        t1 = time.process_time_ns()
+        libsafety_py.safety_replay(replay)
+        t2 = time.process_time_ns()
+        ets.append(t2 - t1)
+      print(f'  {hex(addr):>10} bus {bus} len {length:>2}: {min(ets) / frames:.0f}ns per frame')
+
+
+if __name__ == "__main__":
+  _benchmark_hooks()
+  _benchmark_rx_checks()
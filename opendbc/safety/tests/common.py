@@ -1,6 +1,7 @@
 import os
 import abc
 import math
+import types
 import unittest
 import importlib
 import numpy as np
@@ -43,10 +44,50 @@ def make_msg(bus, addr, length=8, dat=None):
 
 
 class CANPackerPanda(CANPacker):
+  # packed msgs by DBC, shared by the packers of every test. A msg only depends on the DBC, the args of make_can_msg_panda
+  # and the counter the packer fills in when values set none of the msg's counter signals, so that counter is part of the key
+  msg_caches: dict[str, dict] = {}
+  MSG_CACHE_SIZE = 1 << 16
+
+  def __init__(self, dbc_name: str):
+    super().__init__(dbc_name)
+    self.msg_cache = CANPackerPanda.msg_caches.setdefault(dbc_name, {})
+
   def make_can_msg_panda(self, name_or_addr, bus, values, fix_checksum=None):
-    msg = self.make_can_msg(name_or_addr, bus, values)
-    if fix_checksum is not None:
-      msg = fix_checksum(msg)
+    """
+    make_can_msg as a CANPacket, memoized. A cached msg skips fix_checksum, so it must only depend on the msg:
+    msgs are only cached for plain functions without a closure, not for bound methods, partials or closures.
+    """
+    msg_def = self.dbc.addr_to_msg.get(name_or_addr) if isinstance(name_or_addr, int) else self.dbc.name_to_msg.get(name_or_addr)
+    plan = None if msg_def is None else self.get_plan(msg_def.address)
+    cacheable = fix_checksum is None or (isinstance(fix_checksum, types.FunctionType) and fix_checksum.__closure__ is None)
+    key = None
+    counter_value = None
+    if plan is not None and cacheable:
+      key = (name_or_addr, bus, tuple(values.items()), fix_checksum)
+      # like CANPacker.pack, the last counter signal in values sets the counter, otherwise the packer fills in its own
+      set_counters = [name for name in values if name in plan.signals and plan.signals[name][5]]
+      if set_counters:
+        counter_value = int(values[set_counters[-1]])
+      elif plan.counter is not None:
+        key += (self.counters.get(plan.address, 0),)
+
+    msg = self.msg_cache.get(key) if key is not None else None
+    if msg is not None:
+      # step the counter like make_can_msg would
+      if counter_value is not None:
+        self.counters[plan.address] = counter_value
+      elif plan.counter is not None:
+        self.counters[plan.address] = (key[-1] + 1) % (1 << plan.counter.size)
+    else:
+      msg = self.make_can_msg(name_or_addr, bus, values)
+      if fix_checksum is not None:
+        msg = fix_checksum(msg)
+      if key is not None:
+        if len(self.msg_cache) >= self.MSG_CACHE_SIZE:
+          self.msg_cache.clear()
+        self.msg_cache[key] = msg
+
     addr, dat, bus = msg
     return libsafety_py.make_CANPacket(addr, bus, dat)
 
@@ -1,4 +1,5 @@
 import os
+import numpy as np
 from cffi import FFI
 from typing import Protocol
 
@@ -35,6 +36,34 @@ ffi.cdef("""
 void can_set_checksum(CANPacket_t *packet);
 """)
 
+ffi.cdef("""
+typedef struct {
+  uint32_t timestamp;
+  uint32_t addr;
+  uint8_t bus;
+  uint8_t len;
+  uint8_t flags;
+  uint8_t data[64];
+} ReplayFrame;
+
+void safety_replay(const ReplayFrame *frames, uint8_t *results, int len);
+""")
+
+REPLAY_FRAME_DTYPE = np.dtype([('timestamp', np.uint32), ('addr', np.uint32), ('bus', np.uint8), ('len', np.uint8), ('flags', np.uint8),
+                               ('data', np.uint8, 64)], align=True)
+assert REPLAY_FRAME_DTYPE.itemsize == ffi.sizeof('ReplayFrame')
+
+# safety_replay frame flags, from safety.c
+REPLAY_RX = 1
+REPLAY_TX = 2
+REPLAY_TICK = 4
+
+# safety_replay results
+REPLAY_ALLOWED = 1
+REPLAY_CONTROLS_ALLOWED = 2
+REPLAY_CONTROLS_ALLOWED_LAT = 4
+REPLAY_CONFIG_INVALID = 8
+
 setup_safety_helpers(ffi)
 
 
@@ -58,6 +87,7 @@ class Panda(PandaSafety, Protocol):
   def safety_tx_hook(self, msg: CANPacket) -> int: ...
   def safety_fwd_hook(self, bus_num: int, addr: int) -> int: ...
   def set_safety_hooks(self, mode: int, param: int) -> int: ...
+  def safety_replay(self, frames, results, n: int) -> None: ...
 
 
 libsafety: Panda = ffi.dlopen(libsafety_fn)
@@ -65,13 +95,37 @@ libsafety: Panda = ffi.dlopen(libsafety_fn)
 
 # helpers
 
+CANPACKET_PTR = ffi.typeof('CANPacket_t *')
+
+
 def make_CANPacket(addr: int, bus: int, dat):
-  ret = ffi.new('CANPacket_t *')
-  ret[0].extended = 1 if addr >= 0x800 else 0
-  ret[0].addr = addr
-  ret[0].data_len_code = LEN_TO_DLC[len(dat)]
-  ret[0].bus = bus
-  ret[0].data = bytes(dat)
+  ret = ffi.new(CANPACKET_PTR)
+  msg = ret[0]
+  msg.extended = 1 if addr >= 0x800 else 0
+  msg.addr = addr
+  msg.data_len_code = LEN_TO_DLC[len(dat)]
+  msg.bus = bus
+  msg.data = bytes(dat)
   libsafety.can_set_checksum(ret)
 
   return ret
+
+
+def make_ReplayFrames(timestamps: list[int], msgs: list[tuple[int, int, bytes]], flags: list[int]) -> np.ndarray:
+  """Frames for safety_replay from each (addr, bus, dat) and its timestamp and REPLAY_* flags"""
+  frames = np.zeros(len(msgs), dtype=REPLAY_FRAME_DTYPE)
+  frames['timestamp'] = timestamps
+  frames['addr'] = [addr for addr, _, _ in msgs]
+  frames['bus'] = [bus for _, bus, _ in msgs]
+  frames['len'] = [len(dat) for _, _, dat in msgs]
+  frames['flags'] = flags
+  frames['data'] = np.frombuffer(b''.join(bytes(dat).ljust(64, b'\x00') for _, _, dat in msgs), dtype=np.uint8).reshape(-1, 64)
+  return frames
+
+
+def safety_replay(frames: np.ndarray) -> np.ndarray:
+  """Runs every frame through the safety hooks selected by its REPLAY_* flags in one call, returns the REPLAY_* results of each"""
+  frames = np.ascontiguousarray(frames, dtype=REPLAY_FRAME_DTYPE)
+  results = np.zeros(len(frames), dtype=np.uint8)
+  libsafety.safety_replay(ffi.from_buffer('ReplayFrame[]', frames), ffi.from_buffer('uint8_t[]', results), len(frames))
+  return results
@@ -11,3 +11,78 @@
 
 // libsafety stuff
 #include "opendbc/safety/tests/libsafety/safety_helpers.h"
+
+// batch replay: run a whole drive through the hooks in one call
+
+#define REPLAY_RX 1U    // frame received from the car, forwarded and passed to the rx hook
+#define REPLAY_TX 2U    // frame sent by openpilot, passed to the tx hook
+#define REPLAY_TICK 4U  // run the safety tick before the frame, a frame without REPLAY_RX or REPLAY_TX only ticks
+
+#define REPLAY_ALLOWED 1U  // rx hook accepted or tx hook allowed the frame
+#define REPLAY_CONTROLS_ALLOWED 2U
+#define REPLAY_CONTROLS_ALLOWED_LAT 4U
+#define REPLAY_CONFIG_INVALID 8U  // the tick before the frame found a missing or invalid rx check
+
+// naturally aligned, so an array of them has the same layout in C, cffi and NumPy
+typedef struct {
+  uint32_t timestamp;
+  uint32_t addr;
+  uint8_t bus;
+  uint8_t len;
+  uint8_t flags;
+  uint8_t data[CANPACKET_DATA_SIZE_MAX];
+} ReplayFrame;
+
+void safety_replay(const ReplayFrame *frames, uint8_t *results, int len) {
+  CANPacket_t msg;
+  for (int i = 0; i < len; i++) {
+    const ReplayFrame *frame = &frames[i];
+    uint8_t result = 0U;
+    set_timer(frame->timestamp);
+
+    if ((frame->flags & REPLAY_TICK) != 0U) {
+      safety_tick_current_safety_config();
+      if (!safety_config_valid()) {
+        result |= REPLAY_CONFIG_INVALID;
+      }
+    }
+
+    if ((frame->flags & (REPLAY_RX | REPLAY_TX)) != 0U) {
+      // smallest DLC fitting the frame, frames longer than the largest DLC are truncated to it
+      uint8_t dlc = 0U;
+      while ((dlc < (sizeof(dlc_to_len) - 1U)) && (dlc_to_len[dlc] < frame->len)) {
+        dlc++;
+      }
+      msg.fd = 0U;
+      msg.bus = frame->bus;
+      msg.data_len_code = dlc;
+      msg.rejected = 0U;
+      msg.returned = 0U;
+      msg.extended = (frame->addr >= 0x800U) ? 1U : 0U;
+      msg.addr = frame->addr;
+      for (uint32_t j = 0U; j < CANPACKET_DATA_SIZE_MAX; j++) {
+        msg.data[j] = frame->data[j];
+      }
+      can_set_checksum(&msg);
+    }
+
+    if ((frame->flags & REPLAY_RX) != 0U) {
+      (void)safety_fwd_hook(frame->bus, frame->addr);
+      if (safety_rx_hook(&msg)) {
+        result |= REPLAY_ALLOWED;
+      }
+    } else if ((frame->flags & REPLAY_TX) != 0U) {
+      if (safety_tx_hook(&msg)) {
+        result |= REPLAY_ALLOWED;
+      }
+    }
+
+    if (get_controls_allowed()) {
+      result |= REPLAY_CONTROLS_ALLOWED;
+    }
+    if (get_controls_allowed_lat()) {
+      result |= REPLAY_CONTROLS_ALLOWED_LAT;
+    }
+    results[i] = result;
+  }
+}
@@ -21,6 +21,18 @@ bool safety_config_valid() {
   return true;
 }
 
+// addr, bus and len of msg j of rx check i of the current safety config, false if there is none
+bool get_rx_check_msg(int i, int j, int *addr, int *bus, int *len) {
+  bool found = (i < current_safety_config.rx_checks_len) && (j < (int)MAX_ADDR_CHECK_MSGS) && (current_safety_config.rx_checks[i].msg[j].addr != 0);
+  if (found) {
+    const CanMsgCheck *m = &current_safety_config.rx_checks[i].msg[j];
+    *addr = m->addr;
+    *bus = m->bus;
+    *len = m->len;
+  }
+  return found;
+}
+
 
 static MADSState *get_mads_state(void) {
   return &m_mads_state;
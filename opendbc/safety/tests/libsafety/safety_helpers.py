@@ -48,6 +48,7 @@ def setup_safety_helpers(ffi):
 
   void safety_tick_current_safety_config();
   bool safety_config_valid();
+  bool get_rx_check_msg(int i, int j, int *addr, int *bus, int *len);
 
   void init_tests(void);
 
@@ -128,6 +129,7 @@ class PandaSafety(Protocol):
 
   def safety_tick_current_safety_config(self) -> None: ...
   def safety_config_valid(self) -> bool: ...
+  def get_rx_check_msg(self, i: int, j: int, addr, bus, length) -> bool: ...
 
   def init_tests(self) -> None: ...
 
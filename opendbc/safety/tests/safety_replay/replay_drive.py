@@ -2,6 +2,8 @@
 import argparse
 import os
 from collections import Counter, defaultdict
+from dataclasses import dataclass, field, fields
+import numpy as np
 from tqdm import tqdm
 
 from opendbc.safety import ALTERNATIVE_EXPERIENCE
@@ -21,27 +23,89 @@ DEBUG_VARS = {
 }
 
 
-# replay a drive to check for safety violations
-def replay_drive(msgs, safety_mode, param, alternative_experience, param_sp):
-  safety = libsafety_py.libsafety
-  msgs.sort(key=lambda m: m.logMonoTime)
+@dataclass
+class ReplayStats:
+  rx_tot: int = 0
+  rx_invalid: int = 0
+  safety_tick_rx_invalid: bool = False
+  invalid_addrs: set[int] = field(default_factory=set)
+  tx_tot: int = 0
+  tx_blocked: int = 0
+  tx_controls: int = 0
+  tx_controls_lat: int = 0
+  tx_controls_blocked: int = 0
+  tx_controls_lat_blocked: int = 0
+  blocked_addrs: Counter = field(default_factory=Counter)
+  mads_mismatch: int = 0  # msgs sent with controls allowed but not controls allowed lat
 
-  safety.set_current_safety_param_sp(param_sp)
-  err = safety.set_safety_hooks(safety_mode, param)
-  assert err == 0, "invalid safety mode: %d" % safety_mode
-  safety.set_alternative_experience(alternative_experience)
+  def __add__(self, other: 'ReplayStats') -> 'ReplayStats':
+    """Merges the stats of two replays"""
+    return ReplayStats(**{f.name: (getattr(self, f.name) | getattr(other, f.name)) if f.name in ('safety_tick_rx_invalid', 'invalid_addrs')
+                          else getattr(self, f.name) + getattr(other, f.name) for f in fields(self)})
 
-  _enable_mads = bool(alternative_experience & ALTERNATIVE_EXPERIENCE.ENABLE_MADS)
-  _disengage_lateral_on_brake = bool(alternative_experience & ALTERNATIVE_EXPERIENCE.MADS_DISENGAGE_LATERAL_ON_BRAKE)
-  _pause_lateral_on_brake = bool(alternative_experience & ALTERNATIVE_EXPERIENCE.MADS_PAUSE_LATERAL_ON_BRAKE)
-  safety.set_mads_params(_enable_mads, _disengage_lateral_on_brake, _pause_lateral_on_brake)
-  print("alternative experience:")
-  print(f"  enable mads: {_enable_mads}")
-  print(f"  disengage lateral on brake: {_disengage_lateral_on_brake}")
-  print(f"  pause lateral on brake: {_pause_lateral_on_brake}")
+  @property
+  def passed(self) -> bool:
+    return self.tx_controls_blocked == 0 and self.tx_controls_lat_blocked == 0 and self.rx_invalid == 0 and not self.safety_tick_rx_invalid
 
-  init_segment(safety, msgs, safety_mode, param)
 
+def replay_frames(safety, can_msgs, progress: bool = True) -> ReplayStats:
+  """Replays all frames through libsafety in one call and summarizes the per-frame results"""
+  start_t = can_msgs[0].logMonoTime
+  end_t = can_msgs[-1].logMonoTime
+
+  msgs, timestamps, flags, log_times = [], [], [], []
+  for msg in tqdm(can_msgs, disable=not progress):
+    # skip start and end of route, warm up/down period
+    tick = libsafety_py.REPLAY_TICK if msg.logMonoTime - start_t > 1e9 and end_t - msg.logMonoTime > 1e9 else 0
+    if msg.which() == 'sendcan':
+      direction, cans = libsafety_py.REPLAY_TX, [(m.address, m.src % 4, m.dat) for m in msg.sendcan]
+    else:
+      # ignore msgs we sent
+      direction, cans = libsafety_py.REPLAY_RX, [(m.address, m.src % 4, m.dat) for m in msg.can if m.src < 128]
+
+    if len(cans):
+      msgs += cans
+      flags += [tick | direction] + [direction] * (len(cans) - 1)
+    else:
+      # a frame that only ticks
+      msgs.append((0, 0, b''))
+      flags.append(tick)
+    timestamps += [(msg.logMonoTime // 1000) % 0xFFFFFFFF] * max(len(cans), 1)
+    log_times += [msg.logMonoTime] * max(len(cans), 1)
+
+  frames = libsafety_py.make_ReplayFrames(timestamps, msgs, flags)
+  results = libsafety_py.safety_replay(frames)
+  flags, addrs = frames['flags'], frames['addr']
+
+  rx = (flags & libsafety_py.REPLAY_RX) != 0
+  tx = (flags & libsafety_py.REPLAY_TX) != 0
+  allowed = (results & libsafety_py.REPLAY_ALLOWED) != 0
+  controls = (results & libsafety_py.REPLAY_CONTROLS_ALLOWED) != 0
+  controls_lat = (results & libsafety_py.REPLAY_CONTROLS_ALLOWED_LAT) != 0
+  rx_invalid = rx & ~allowed
+  tx_blocked = tx & ~allowed
+
+  for i in np.flatnonzero(tx_blocked):
+    carlog.debug("blocked bus %d msg %d at %f" % (frames['bus'][i], addrs[i], (log_times[i] - start_t) / 1e9))
+
+  return ReplayStats(
+    rx_tot=int(rx.sum()),
+    rx_invalid=int(rx_invalid.sum()),
+    safety_tick_rx_invalid=bool(((results & libsafety_py.REPLAY_CONFIG_INVALID) != 0).any()),
+    invalid_addrs=set(addrs[rx_invalid].tolist()),
+    tx_tot=int(tx.sum()),
+    tx_blocked=int(tx_blocked.sum()),
+    tx_controls=int((tx & controls).sum()),
+    tx_controls_lat=int((tx & controls_lat).sum()),
+    tx_controls_blocked=int((tx_blocked & controls).sum()),
+    tx_controls_lat_blocked=int((tx_blocked & controls_lat).sum()),
+    blocked_addrs=Counter(addrs[tx_blocked].tolist()),
+    mads_mismatch=int((tx & controls & ~controls_lat).sum()),
+  )
+
+
+def replay_frames_debug(safety, can_msgs) -> ReplayStats:
+  """Replays frame by frame, printing the safety state at each blocked message"""
   rx_tot, rx_invalid, tx_tot, tx_blocked, tx_controls, tx_controls_lat, tx_controls_blocked, tx_controls_lat_blocked, mads_mismatch = 0, 0, 0, 0, 0, 0, 0, 0, 0
   safety_tick_rx_invalid = False
   blocked_addrs = Counter()
@@ -53,7 +117,6 @@ def replay_drive(msgs, safety_mode, param, alternative_experience, param_sp):
     **{var: None for var in DEBUG_VARS}
   })
 
-  can_msgs = [m for m in msgs if m.which() in ('can', 'sendcan')]
   start_t = can_msgs[0].logMonoTime
   end_t = can_msgs[-1].logMonoTime
   for msg in tqdm(can_msgs):
@@ -84,21 +147,20 @@ def replay_drive(msgs, safety_mode, param, alternative_experience, param_sp):
 
           carlog.debug("blocked bus %d msg %d at %f" % (canmsg.src, canmsg.address, (msg.logMonoTime - start_t) / 1e9))
 
-          if "DEBUG" in os.environ:
-            last_good = last_good_states[canmsg.address]
-            print(f"\nBlocked message at {(msg.logMonoTime - start_t) / 1e9:.3f}s:")
-            print(f"Address: {hex(canmsg.address)} (bus {canmsg.src})")
-            print("Current state:")
-            for var, getter in DEBUG_VARS.items():
-              print(f"  {var}: {getter(safety)}")
-
-            if last_good['timestamp'] is not None:
-              print(f"\nLast good state ({last_good['timestamp']:.3f}s):")
-              for var in DEBUG_VARS:
-                print(f"  {var}: {last_good[var]}")
-            else:
-              print("\nNo previous good state found for this address")
-            print("-" * 80)
+          last_good = last_good_states[canmsg.address]
+          print(f"\nBlocked message at {(msg.logMonoTime - start_t) / 1e9:.3f}s:")
+          print(f"Address: {hex(canmsg.address)} (bus {canmsg.src})")
+          print("Current state:")
+          for var, getter in DEBUG_VARS.items():
+            print(f"  {var}: {getter(safety)}")
+
+          if last_good['timestamp'] is not None:
+            print(f"\nLast good state ({last_good['timestamp']:.3f}s):")
+            for var in DEBUG_VARS:
+              print(f"  {var}: {last_good[var]}")
+          else:
+            print("\nNo previous good state found for this address")
+          print("-" * 80)
         else:  # Update last good state if message is allowed
           last_good_states[canmsg.address].update({
             'timestamp': (msg.logMonoTime - start_t) / 1e9,
@@ -119,22 +181,77 @@ def replay_drive(msgs, safety_mode, param, alternative_experience, param_sp):
           invalid_addrs.add(canmsg.address)
         rx_tot += 1
 
+  return ReplayStats(rx_tot, rx_invalid, safety_tick_rx_invalid, invalid_addrs, tx_tot, tx_blocked, tx_controls, tx_controls_lat,
+                     tx_controls_blocked, tx_controls_lat_blocked, blocked_addrs, mads_mismatch)
+
+
+def get_safety_params(msgs, mode: int = None, param: int = None, alternative_experience: int = None, param_sp: int = None):
+  """The safety mode, param, alternative experience and sunnypilot param of a log, unless overridden"""
+  if None in (mode, param, alternative_experience, param_sp):
+    CP = next(m.carParams for m in msgs if m.which() == 'carParams')
+    CP_SP = next((m.carParamsSP for m in msgs if m.which() == 'carParamsSP'), None)
+    if mode is None:
+      mode = CP.safetyConfigs[-1].safetyModel.raw
+    if param is None:
+      param = CP.safetyConfigs[-1].safetyParam
+    if alternative_experience is None:
+      alternative_experience = CP.alternativeExperience
+    if param_sp is None:
+      param_sp = CP_SP.safetyParam if hasattr(CP_SP, 'safetyParam') else 0
+  return mode, param, alternative_experience, param_sp
+
+
+def replay_segment(msgs, safety_mode, param, alternative_experience, param_sp, progress: bool = True) -> ReplayStats:
+  """Replays a drive through freshly set up safety hooks, without printing"""
+  safety = libsafety_py.libsafety
+  msgs.sort(key=lambda m: m.logMonoTime)
+
+  safety.set_current_safety_param_sp(param_sp)
+  err = safety.set_safety_hooks(safety_mode, param)
+  assert err == 0, "invalid safety mode: %d" % safety_mode
+  safety.set_alternative_experience(alternative_experience)
+
+  _enable_mads = bool(alternative_experience & ALTERNATIVE_EXPERIENCE.ENABLE_MADS)
+  _disengage_lateral_on_brake = bool(alternative_experience & ALTERNATIVE_EXPERIENCE.MADS_DISENGAGE_LATERAL_ON_BRAKE)
+  _pause_lateral_on_brake = bool(alternative_experience & ALTERNATIVE_EXPERIENCE.MADS_PAUSE_LATERAL_ON_BRAKE)
+  safety.set_mads_params(_enable_mads, _disengage_lateral_on_brake, _pause_lateral_on_brake)
+
+  init_segment(safety, msgs, safety_mode, param)
+
+  can_msgs = [m for m in msgs if m.which() in ('can', 'sendcan')]
+  if "DEBUG" in os.environ:
+    return replay_frames_debug(safety, can_msgs)
+  return replay_frames(safety, can_msgs, progress)
+
+
+def print_stats(stats: ReplayStats) -> None:
   print("\nRX")
-  print("total rx msgs:", rx_tot)
-  print("invalid rx msgs:", rx_invalid)
-  print("safety tick rx invalid:", safety_tick_rx_invalid)
-  print("invalid addrs:", invalid_addrs)
+  print("total rx msgs:", stats.rx_tot)
+  print("invalid rx msgs:", stats.rx_invalid)
+  print("safety tick rx invalid:", stats.safety_tick_rx_invalid)
+  print("invalid addrs:", stats.invalid_addrs)
   print("\nTX")
-  print("total openpilot msgs:", tx_tot)
-  print("total msgs with controls allowed:", tx_controls)
-  print("total msgs with controls_lat allowed:", tx_controls_lat)
-  print("blocked msgs:", tx_blocked)
-  print("blocked with controls allowed:", tx_controls_blocked)
-  print("blocked with controls_lat allowed:", tx_controls_lat_blocked)
-  print("blocked addrs:", blocked_addrs)
-  print("mads enabled:", safety.get_enable_mads())
+  print("total openpilot msgs:", stats.tx_tot)
+  print("total msgs with controls allowed:", stats.tx_controls)
+  print("total msgs with controls_lat allowed:", stats.tx_controls_lat)
+  print("blocked msgs:", stats.tx_blocked)
+  print("blocked with controls allowed:", stats.tx_controls_blocked)
+  print("blocked with controls_lat allowed:", stats.tx_controls_lat_blocked)
+  print("blocked addrs:", stats.blocked_addrs)
+  print("msgs with controls allowed but not controls allowed lat:", stats.mads_mismatch)
+
+
+# replay a drive to check for safety violations
+def replay_drive(msgs, safety_mode, param, alternative_experience, param_sp):
+  print("alternative experience:")
+  print(f"  enable mads: {bool(alternative_experience & ALTERNATIVE_EXPERIENCE.ENABLE_MADS)}")
+  print(f"  disengage lateral on brake: {bool(alternative_experience & ALTERNATIVE_EXPERIENCE.MADS_DISENGAGE_LATERAL_ON_BRAKE)}")
+  print(f"  pause lateral on brake: {bool(alternative_experience & ALTERNATIVE_EXPERIENCE.MADS_PAUSE_LATERAL_ON_BRAKE)}")
 
-  return tx_controls_blocked == 0 and tx_controls_lat_blocked == 0 and rx_invalid == 0 and not safety_tick_rx_invalid
+  stats = replay_segment(msgs, safety_mode, param, alternative_experience, param_sp)
+  print_stats(stats)
+  print("mads enabled:", libsafety_py.libsafety.get_enable_mads())
+  return stats.passed
 
 
 if __name__ == "__main__":
@@ -149,21 +266,10 @@ if __name__ == "__main__":
   parser.add_argument("--param-sp", type=int, help="Override the sunnypilot safety param from the log")
   args = parser.parse_args()
 
-  lr = LogReader(args.route_or_segment_name[0])
-
-  if None in (args.mode, args.param, args.alternative_experience, args.param_sp):
-    CP = lr.first('carParams')
-    CP_SP = lr.first('carParamsSP')
-    if args.mode is None:
-      args.mode = CP.safetyConfigs[-1].safetyModel.raw
-    if args.param is None:
-      args.param = CP.safetyConfigs[-1].safetyParam
-    if args.alternative_experience is None:
-      args.alternative_experience = CP.alternativeExperience
-    if args.param_sp is None:
-      _param_sp = CP_SP.safetyParam if hasattr(CP_SP, 'safetyParam') else 0
-      args.param_sp = _param_sp
+  msgs = list(LogReader(args.route_or_segment_name[0]))
+  args.mode, args.param, args.alternative_experience, args.param_sp = get_safety_params(msgs, args.mode, args.param, args.alternative_experience,
+                                                                                       args.param_sp)
 
   print(f"replaying {args.route_or_segment_name[0]} with safety mode {args.mode}, param {args.param}, alternative experience {args.alternative_experience}, " +
         f"param_sp {args.param_sp}")
-  replay_drive(list(lr), args.mode, args.param, args.alternative_experience, args.param_sp)
+  replay_drive(msgs, args.mode, args.param, args.alternative_experience, args.param_sp)
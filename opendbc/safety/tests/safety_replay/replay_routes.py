@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+import argparse
+import os
+from collections.abc import Callable
+from concurrent.futures import ProcessPoolExecutor
+
+from opendbc.safety.tests.safety_replay.replay_drive import ReplayStats, get_safety_params, print_stats, replay_segment
+
+# libsafety keeps the safety state in C globals, so each worker process replays one route or segment at a time with its own copy
+
+
+def load_log(route_or_segment_name: str) -> list:
+  from openpilot.tools.lib.logreader import LogReader
+  return list(LogReader(route_or_segment_name))
+
+
+def replay_route(route_or_segment_name: str, mode: int = None, param: int = None, alternative_experience: int = None, param_sp: int = None,
+                 load: Callable[[str], list] = load_log) -> ReplayStats:
+  msgs = load(route_or_segment_name)
+  return replay_segment(msgs, *get_safety_params(msgs, mode, param, alternative_experience, param_sp), progress=False)
+
+
+def replay_routes(route_or_segment_names: list[str], mode: int = None, param: int = None, alternative_experience: int = None, param_sp: int = None,
+                  load: Callable[[str], list] = load_log, jobs: int = None) -> dict[str, ReplayStats]:
+  """Replays each route or segment in a pool of jobs processes, returns the stats of each"""
+  with ProcessPoolExecutor(max_workers=jobs) as executor:
+    futures = {name: executor.submit(replay_route, name, mode, param, alternative_experience, param_sp, load) for name in route_or_segment_names}
+    return {name: future.result() for name, future in futures.items()}
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Replay CAN messages from many routes or segments through their safety modes in parallel",
+                                   formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+  parser.add_argument("route_or_segment_name", nargs='+')
+  parser.add_argument("--mode", type=int, help="Override the safety mode from the logs")
+  parser.add_argument("--param", type=int, help="Override the safety param from the logs")
+  parser.add_argument("--alternative-experience", type=int, help="Override the alternative experience from the logs")
+  parser.add_argument("--param-sp", type=int, help="Override the sunnypilot safety param from the logs")
+  parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(), help="Number of routes or segments replayed at once")
+  args = parser.parse_args()
+
+  results = replay_routes(args.route_or_segment_name, args.mode, args.param, args.alternative_experience, args.param_sp, jobs=args.jobs)
+  for name, stats in results.items():
+    print(f"{'PASS' if stats.passed else 'FAIL'} {name}: {stats.tx_blocked} blocked msgs ({stats.tx_controls_blocked} with controls allowed), " +
+          f"{stats.rx_invalid} invalid rx msgs, {stats.mads_mismatch} MADS mismatches")
+
+  print_stats(sum(results.values(), ReplayStats()))
+  failed = [name for name, stats in results.items() if not stats.passed]
+  print(f"\n{len(results) - len(failed)}/{len(results)} passed")
+  raise SystemExit(len(failed) > 0)
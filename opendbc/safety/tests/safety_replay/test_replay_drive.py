@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+import unittest
+from types import SimpleNamespace
+
+from opendbc.can import CANPacker
+from opendbc.car.structs import CarParams
+from opendbc.safety.tests.libsafety import libsafety_py
+from opendbc.safety.tests.safety_replay.replay_drive import ReplayStats, replay_frames, replay_frames_debug, replay_segment
+from opendbc.safety.tests.safety_replay.replay_routes import replay_routes
+
+
+def _log_msg(t: int, which: str, frames: list[tuple[int, bytes, int]]):
+  cans = [SimpleNamespace(address=addr, dat=dat, src=bus) for addr, dat, bus in frames]
+  return SimpleNamespace(logMonoTime=t, which=lambda: which, **{which: cans})
+
+
+def toyota_drive(seconds: float = 5.):
+  """A drive engaging for its middle third, steering throughout, with one corrupted frame after disengaging"""
+  packer = CANPacker("toyota_nodsu_pt_generated")
+  msgs = []
+  for i in range(int(seconds * 100)):
+    t = int(1e9 + i * 1e7)
+    engaged = seconds / 3 < i / 100 < seconds * 2 / 3
+    frames = [
+      packer.make_can_msg("PCM_CRUISE", 0, {"CRUISE_ACTIVE": engaged, "GAS_RELEASED": 1}),
+      packer.make_can_msg("STEER_TORQUE_SENSOR", 0, {"STEER_TORQUE_EPS": 0}),
+      packer.make_can_msg("WHEEL_SPEEDS", 0, {}),
+      packer.make_can_msg("BRAKE_MODULE", 0, {}),
+      packer.make_can_msg("PCM_CRUISE_2", 0, {"MAIN_ON": 1}),
+      (0x123, b'\x00' * 8, 2),
+      (0x2E4, b'\x00' * 5, 128),  # our own message echoed back, ignored
+    ]
+    if i == int(seconds * 90):
+      addr, dat, bus = frames[0]
+      frames[0] = (addr, dat[:-1] + bytes([dat[-1] ^ 0xFF]), bus)
+    msgs.append(_log_msg(t, 'can', frames))
+    msgs.append(_log_msg(t + 1, 'sendcan', [packer.make_can_msg("STEERING_LKA", 0, {"STEER_TORQUE_CMD": 10, "STEER_REQUEST": 1})]))
+    if i % 50 == 0:
+      msgs.append(_log_msg(t + 2, 'can', []))
+  return msgs
+
+
+def load_toyota_drive(name: str):
+  return toyota_drive(float(name))
+
+
+class TestSafetyReplay(unittest.TestCase):
+  def _replay(self, replay, msgs):
+    safety = libsafety_py.libsafety
+    safety.set_current_safety_param_sp(0)
+    self.assertEqual(safety.set_safety_hooks(CarParams.SafetyModel.toyota, 73), 0)
+    safety.init_tests()
+    return replay(safety, msgs)
+
+  def test_batch_matches_frame_by_frame(self):
+    msgs = toyota_drive()
+    stats = self._replay(replay_frames, msgs)
+    self.assertEqual(stats, self._replay(replay_frames_debug, msgs))
+
+    self.assertGreater(stats.tx_controls, 0)
+    self.assertGreater(stats.tx_blocked, stats.tx_controls_blocked)
+    self.assertEqual(stats.rx_tot, 6 * 500)
+    self.assertEqual(stats.invalid_addrs, {0x1D2})
+    self.assertEqual(stats.tx_tot, 500)
+
+  def test_oversize_frames(self):
+    # frames longer than the largest DLC replay as 64 byte frames
+    msgs = [(0x2E4, 0, bytes(64)), (0x191, 0, bytes(64)), (0x123, 2, bytes(64))]
+    frames = libsafety_py.make_ReplayFrames([0, 1, 2], msgs, [libsafety_py.REPLAY_TX, libsafety_py.REPLAY_TX, libsafety_py.REPLAY_RX])
+    expected = self._replay(lambda _, f: libsafety_py.safety_replay(f), frames)
+    for length in (65, 100, 255):
+      frames['len'] = length
+      self.assertEqual(self._replay(lambda _, f: libsafety_py.safety_replay(f), frames).tolist(), expected.tolist())
+
+  def test_parallel_routes(self):
+    names = ['3', '4', '5', '6']
+    params = (CarParams.SafetyModel.toyota, 73, 0, 0)
+    results = replay_routes(names, *params, load=load_toyota_drive, jobs=2)
+    self.assertEqual(results, {name: replay_segment(load_toyota_drive(name), *params, progress=False) for name in names})
+
+    total = sum(results.values(), ReplayStats())
+    self.assertEqual(total.tx_tot, sum(stats.tx_tot for stats in results.values()))
+    self.assertEqual(total.blocked_addrs[0x2E4], sum(stats.blocked_addrs[0x2E4] for stats in results.values()))
+    self.assertEqual(total.invalid_addrs, {0x1D2})
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -70,5 +70,33 @@ class TestAllOutputPassthrough(TestAllOutput):
     self.safety.init_tests()
 
 
+class TestSafetyHooks(unittest.TestCase):
+  TX_MSGS = None  # not a safety mode, skipped by test_tx_hook_on_wrong_safety_mode
+
+  # the safety flags of every brand are in the low bits of the param (with Toyota's EPS torque factor), and of param_sp
+  PARAM_BITS = 12
+  PARAM_SP_BITS = 4
+
+  def tearDown(self):
+    libsafety_py.libsafety.set_current_safety_param_sp(0)
+
+  def test_set_safety_hooks_all_modes(self):
+    # the rx check and tx msg lookup tables fit the config of every mode built into libsafety, with any combination of flags
+    safety = libsafety_py.libsafety
+    for mode in CarParams.SafetyModel.schema.enumerants.values():
+      safety.set_current_safety_param_sp(0)
+      safety.set_safety_hooks(CarParams.SafetyModel.noOutput, 0)
+      safety.set_safety_hooks(mode, 0)
+      if safety.get_current_safety_mode() != mode:
+        continue
+
+      params = [(param, 0) for param in range(1 << self.PARAM_BITS)]
+      params += [(param, param_sp) for param in (0, (1 << self.PARAM_BITS) - 1) for param_sp in range(1 << self.PARAM_SP_BITS)]
+      for param, param_sp in params:
+        safety.set_current_safety_param_sp(param_sp)
+        self.assertEqual(safety.set_safety_hooks(mode, param), 0, f"{mode=} {param=} {param_sp=}")
+        self.assertEqual(safety.get_current_safety_mode(), mode)
+
+
 if __name__ == "__main__":
   unittest.main()